@@ -0,0 +1,413 @@
+"""Local JSON-RPC server replaying eth_getLogs answers for the benchmarks.
+
+The logs come either from a synthetic chain, generated from the events of an
+ABI with a given density, or from a file of logs recorded from a real node
+with the record command. The server answers eth_getLogs, eth_blockNumber,
+eth_chainId, eth_getBlockByNumber and eth_getTransactionByHash, single or in
+batches, after a configurable latency, refuses windows with too many logs as
+the providers do and fails a share of the requests with HTTP 503.
+
+    python -m benchmarks.mock_rpc serve --abi abi/stETH.json --events Transfer --density 0.5 --port 8545
+    python -m benchmarks.mock_rpc record -r <rpc> -a <address> -f <from-block> -t <to-block> -o logs.jsonl
+"""
+import argparse
+import bisect
+import collections
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from eth_abi import encode
+from web3 import Web3
+from sample.rpc_batch import JsonRpcBatchClient
+from sample.range_controller import AdaptiveRangeController, fetch_range
+
+# logs above which a get_logs window is refused, as most providers do
+MAX_LOGS = 10000
+# generated blocks kept in memory, retried and overlapping windows are not generated again
+CACHED_BLOCKS = 200000
+GENESIS_TIMESTAMP = 1600000000
+BLOCK_TIME = 12
+
+
+def poisson(rng, mean):
+    """Number of events of a block, drawn with the given mean."""
+    if mean <= 0:
+        return 0
+    if mean > 30:
+        return max(0, round(rng.gauss(mean, math.sqrt(mean))))
+    threshold, n, p = math.exp(-mean), 0, rng.random()
+    while p > threshold:
+        n += 1
+        p *= rng.random()
+    return n
+
+
+def random_word(rng, abi_type):
+    """A random 32 bytes ABI word of a static type, as hex."""
+    if abi_type == 'address':
+        return '00' * 12 + rng.randbytes(20).hex()
+    if abi_type == 'bool':
+        return f"{rng.getrandbits(1):064x}"
+    if abi_type.startswith('bytes'):
+        return rng.randbytes(int(abi_type[5:])).hex().ljust(64, '0')
+    # amounts are rarely above 2 ** 96
+    bits = min(int(abi_type[abi_type.index('int') + 3:] or 256), 96)
+    return f"{rng.getrandbits(bits):064x}"
+
+
+def random_value(rng, abi_type):
+    if abi_type in ('bytes', 'string'):
+        value = rng.randbytes(rng.randint(0, 64))
+        return value if abi_type == 'bytes' else value.hex()
+    return int(random_word(rng, abi_type), 16) if abi_type != 'address' else Web3.to_checksum_address('0x' + random_word(rng, abi_type)[24:])
+
+
+def block_hash(block):
+    # any 32 bytes do, blake2b is cheaper than keccak
+    return '0x' + hashlib.blake2b(f"block-{block}".encode(), digest_size=32).hexdigest()
+
+
+def transaction_hash(block, index):
+    """The block and the position of a transaction are readable back from its hash."""
+    return f"0x{block:016x}{index:08x}" + hashlib.blake2b(f"tx-{block}-{index}".encode(), digest_size=20).hexdigest()
+
+
+class SyntheticChain:
+    """
+    Logs of the events of an ABI, the same for the same seed.
+
+    Args:
+        abi_file (str): ABI of the contract.
+        address (str): Address of the contract emitting the logs.
+        events (list): Names of the events emitted, all the events of the ABI if None.
+        density (float): Mean number of logs per block, over all the events.
+        bursts (list): (from_block, to_block, density) of the block ranges with another density.
+        head (int): The latest block.
+        seed (int): Seed of the generated values.
+    """
+    def __init__(self, abi_file, address, events=None, density=0.5, bursts=(), head=20000000, seed=0):
+        with open(abi_file) as f:
+            abi = json.load(f)
+        self.address = address.lower()
+        self.events = []
+        for item in abi:
+            if item.get('type') != 'event' or (events and item['name'] not in events):
+                continue
+            signature = f"{item['name']}({','.join(i['type'] for i in item['inputs'])})"
+            self.events.append(('0x' + Web3.keccak(text=signature).hex().removeprefix('0x'), item['inputs']))
+        self.density = density
+        self.bursts = list(bursts)
+        self.head = head
+        self.seed = seed
+        self.cache = collections.OrderedDict()
+
+    def block_density(self, block):
+        for from_block, to_block, density in self.bursts:
+            if from_block <= block <= to_block:
+                return density
+        return self.density
+
+    def block_logs(self, block):
+        if block in self.cache:
+            return self.cache[block]
+        rng = random.Random(self.seed * 1000000007 + block)
+        logs = []
+        for i in range(poisson(rng, self.block_density(block))):
+            topic, inputs = self.events[rng.randrange(len(self.events))]
+            topics = [topic] + ['0x' + random_word(rng, i['type']) for i in inputs if i['indexed']]
+            data = [i['type'] for i in inputs if not i['indexed']]
+            if all(t not in ('bytes', 'string') and '[' not in t for t in data):
+                data_hex = ''.join(random_word(rng, t) for t in data)
+            else:
+                data_hex = encode(data, [random_value(rng, t) for t in data]).hex()
+            logs.append({
+                'address': self.address,
+                'blockHash': block_hash(block),
+                'blockNumber': hex(block),
+                'data': '0x' + data_hex,
+                'logIndex': hex(i),
+                'removed': False,
+                'topics': topics,
+                'transactionHash': transaction_hash(block, i),
+                'transactionIndex': hex(i),
+            })
+        self.cache[block] = logs
+        if len(self.cache) > CACHED_BLOCKS:
+            self.cache.popitem(last=False)
+        return logs
+
+    def logs(self, from_block, to_block, keep=None, limit=None):
+        """Logs of [from_block, to_block] passing keep, None as soon as there are more than limit."""
+        logs = []
+        for block in range(from_block, min(to_block, self.head) + 1):
+            logs += filter(keep, self.block_logs(block))
+            if limit is not None and len(logs) > limit:
+                return None
+        return logs
+
+
+class RecordedChain:
+    """
+    Logs read from a file of the record command, one raw log per line.
+
+    Args:
+        path (str): The recorded logs.
+        head (int): The latest block, the last recorded block if None.
+    """
+    def __init__(self, path, head=None):
+        self.blocks = collections.defaultdict(list)
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    log = json.loads(line)
+                    self.blocks[int(log['blockNumber'], 16)].append(log)
+        self.sorted_blocks = sorted(self.blocks)
+        self.head = head if head is not None else (self.sorted_blocks[-1] if self.sorted_blocks else 0)
+
+    def logs(self, from_block, to_block, keep=None, limit=None):
+        logs = []
+        start = bisect.bisect_left(self.sorted_blocks, from_block)
+        for block in self.sorted_blocks[start:]:
+            if block > min(to_block, self.head):
+                break
+            logs += filter(keep, self.blocks[block])
+            if limit is not None and len(logs) > limit:
+                return None
+        return logs
+
+
+def matches(log, addresses, topics):
+    """Whether a log passes the address and topics of a get_logs filter."""
+    if addresses is not None:
+        addresses = [addresses] if isinstance(addresses, str) else addresses
+        if log['address'].lower() not in (a.lower() for a in addresses):
+            return False
+    for position, expected in enumerate(topics or []):
+        if expected is None:
+            continue
+        expected = [expected] if isinstance(expected, str) else expected
+        if position >= len(log['topics']) or log['topics'][position].lower() not in (t.lower() for t in expected):
+            return False
+    return True
+
+
+class MockRpcServer:
+    """
+    A JSON-RPC server over a chain of logs, run in a thread.
+
+    Args:
+        chain (SyntheticChain or RecordedChain): The logs served.
+        port (int): Port listened on, any free port if 0.
+        latency (float): Seconds waited before answering a request.
+        latency_per_log (float): Seconds added per log of the answer.
+        jitter (float): Up to this many seconds more, drawn at random.
+        error_rate (float): Share of the requests failed with HTTP 503.
+        max_logs (int): A get_logs window with more logs is refused.
+    """
+    def __init__(self, chain, port=0, latency=0.0, latency_per_log=0.0, jitter=0.0, error_rate=0.0, max_logs=MAX_LOGS, seed=0):
+        self.chain = chain
+        self.latency = latency
+        self.latency_per_log = latency_per_log
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.max_logs = max_logs
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = collections.Counter()
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), self.handler_class())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def answer(self, request):
+        """The JSON-RPC answer of a single request, and the number of logs in it."""
+        method, params = request.get('method'), request.get('params', [])
+        self.stats[method] += 1
+        result, logs = None, 0
+        if method == 'eth_getLogs':
+            f = params[0]
+            from_block, to_block = int(f.get('fromBlock', '0x0'), 16), int(f.get('toBlock', hex(self.chain.head)), 16)
+            result = self.chain.logs(from_block, to_block, lambda log: matches(log, f.get('address'), f.get('topics')), self.max_logs)
+            if result is None:
+                self.stats['refused'] += 1
+                return {'jsonrpc': '2.0', 'id': request.get('id'), 'error': {'code': -32005, 'message': f'query returned more than {self.max_logs} results'}}, 0
+            logs = len(result)
+            self.stats['logs'] += logs
+        elif method == 'eth_blockNumber':
+            result = hex(self.chain.head)
+        elif method in ('eth_chainId', 'net_version'):
+            result = '0x1' if method == 'eth_chainId' else '1'
+        elif method == 'web3_clientVersion':
+            result = 'mock-rpc/0.1'
+        elif method == 'eth_getBlockByNumber':
+            block = self.chain.head if params[0] == 'latest' else int(params[0], 16)
+            result = None if block > self.chain.head else {
+                'number': hex(block), 'hash': block_hash(block), 'parentHash': block_hash(block - 1),
+                'timestamp': hex(GENESIS_TIMESTAMP + BLOCK_TIME * block), 'transactions': [],
+                'logsBloom': '0x' + '00' * 256, 'miner': '0x' + '00' * 20, 'gasLimit': '0x1c9c380',
+                'gasUsed': '0x0', 'difficulty': '0x0', 'extraData': '0x', 'nonce': '0x0000000000000000',
+                'sha3Uncles': '0x' + '00' * 32, 'stateRoot': '0x' + '00' * 32, 'receiptsRoot': '0x' + '00' * 32,
+                'transactionsRoot': '0x' + '00' * 32, 'size': '0x0', 'uncles': [], 'mixHash': '0x' + '00' * 32,
+            }
+        elif method == 'eth_getTransactionByHash':
+            tx_hash = params[0]
+            block, index = int(tx_hash[2:18], 16), int(tx_hash[18:26], 16)
+            result = {
+                'hash': tx_hash, 'blockNumber': hex(block), 'blockHash': block_hash(block), 'transactionIndex': hex(index),
+                'from': '0x' + tx_hash[-40:], 'to': '0x' + '00' * 20, 'gasPrice': hex(10 ** 9 + int(tx_hash[-8:], 16)),
+                'gas': '0x5208', 'input': '0x', 'nonce': '0x0', 'value': '0x0',
+            }
+        else:
+            return {'jsonrpc': '2.0', 'id': request.get('id'), 'error': {'code': -32601, 'message': f'the method {method} does not exist'}}, 0
+        return {'jsonrpc': '2.0', 'id': request.get('id'), 'result': result}, logs
+
+    def handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def handle(self):
+                # the tracker gives up on hedged or timed out requests and closes their connections
+                try:
+                    super().handle()
+                except (BrokenPipeError, ConnectionResetError):
+                    self.close_connection = True
+
+            def do_GET(self):
+                # the counters of the requests served so far
+                with server.lock:
+                    self.send_body(200, dict(server.stats))
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                with server.lock:
+                    server.stats['requests'] += 1
+                    failed = server.random.random() < server.error_rate
+                    delay = server.latency + server.random.random() * server.jitter
+                    if failed:
+                        server.stats['errors'] += 1
+                if failed:
+                    time.sleep(delay)
+                    return self.send_body(503, {'error': 'service unavailable'})
+                requests = body if isinstance(body, list) else [body]
+                answers, logs = [], 0
+                for request in requests:
+                    with server.lock:
+                        answer, n = server.answer(request)
+                    answers.append(answer)
+                    logs += n
+                time.sleep(delay + logs * server.latency_per_log)
+                self.send_body(200, answers if isinstance(body, list) else answers[0])
+
+            def send_body(self, status, payload):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def parse_burst(value):
+    """A burst given as <from-block>:<to-block>:<density>."""
+    from_block, to_block, density = value.split(':')
+    return int(from_block), int(to_block), float(density)
+
+
+def record(rpc, address, from_block, to_block, output_file, topics=None):
+    """Save the raw logs of a contract from a real node, one per line."""
+    client = JsonRpcBatchClient(rpc)
+    args = {'address': Web3.to_checksum_address(address)}
+    if topics:
+        args['topics'] = [topics]
+    controller = AdaptiveRangeController()
+    n_logs = 0
+    with open(output_file, 'w') as f:
+        fetch_logs = lambda a, b: client.call('eth_getLogs', [dict(args, fromBlock=hex(a), toBlock=hex(b))])
+        for step, toblock, logs in fetch_range(fetch_logs, from_block, to_block, controller):
+            for log in logs:
+                f.write(json.dumps(log) + '\n')
+            n_logs += len(logs)
+            print(f"Recorded {n_logs} logs up to block {toblock}")
+    return n_logs
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Mock JSON-RPC server for the benchmarks")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve = commands.add_parser('serve', help='Serve synthetic or recorded logs')
+    serve.add_argument('--abi', type=str, default=None, help='ABI of the synthetic contract')
+    serve.add_argument('--address', type=str, default='0xae7ab96520DE3A18E5e111B5EaAb095312D7fE84', help='Address of the synthetic contract')
+    serve.add_argument('--events', type=str, nargs='+', default=None, help='Events emitted, all those of the ABI if not given')
+    serve.add_argument('--density', type=float, default=0.5, help='Mean number of logs per block')
+    serve.add_argument('--burst', type=parse_burst, action='append', default=[], help='<from-block>:<to-block>:<density> of a denser block range, can be repeated')
+    serve.add_argument('--replay', type=str, default=None, help='File of recorded logs served instead of synthetic ones')
+    serve.add_argument('--head', type=int, default=None, help='Latest block')
+    serve.add_argument('--seed', type=int, default=0, help='Seed of the synthetic logs, the latency and the errors')
+    serve.add_argument('--port', type=int, default=8545, help='Port listened on')
+    serve.add_argument('--latency', type=float, default=0.0, help='Seconds waited before each answer')
+    serve.add_argument('--latency-per-log', type=float, default=0.0, help='Seconds added per log of an answer')
+    serve.add_argument('--jitter', type=float, default=0.0, help='Up to this many random seconds added to each answer')
+    serve.add_argument('--error-rate', type=float, default=0.0, help='Share of the requests failed with HTTP 503')
+    serve.add_argument('--max-logs', type=int, default=MAX_LOGS, help='get_logs windows with more logs are refused')
+
+    rec = commands.add_parser('record', help='Save the logs of a contract from a node')
+    rec.add_argument('-r', '--rpc', type=str, required=True, help='The node recorded from')
+    rec.add_argument('-a', '--address', type=str, required=True, help='Address of the contract')
+    rec.add_argument('-f', '--from-block', type=int, required=True, help='Starting block number')
+    rec.add_argument('-t', '--to-block', type=int, required=True, help='Stopping block number')
+    rec.add_argument('--topics', type=str, nargs='+', default=None, help='topic0 of the recorded events, all of them if not given')
+    rec.add_argument('-o', '--output-file', type=str, required=True, help='File of the recorded logs')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    if args.command == 'record':
+        record(args.rpc, args.address, args.from_block, args.to_block, args.output_file, args.topics)
+        return
+    if args.replay is not None:
+        chain = RecordedChain(args.replay, args.head)
+    else:
+        chain = SyntheticChain(args.abi, args.address, args.events, args.density, args.burst,
+                               args.head if args.head is not None else 20000000, args.seed)
+    server = MockRpcServer(chain, args.port, args.latency, args.latency_per_log, args.jitter, args.error_rate, args.max_logs, args.seed)
+    print(f"Serving on {server.url}", flush=True)
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""Offline benchmarks of process_event_tracker and parallel_event_tracker.
+
+Each scenario starts the mock JSON-RPC server of benchmarks.mock_rpc on a free
+port, with synthetic logs of one of the bundled contracts, runs a tracker
+against it in a separate process and reports its events per second, the
+seconds spent waiting for the logs, decoding and writing them, its peak
+resident memory (workers included) and the requests the server answered.
+
+    python -m benchmarks.run_benchmarks --blocks 200000 --density 0.5 --latency 0.05 -o results.json
+
+With --min-events-per-second the exit status is 1 when a scenario is slower,
+so that a throughput regression can fail a build.
+"""
+import argparse
+import glob
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+import pyarrow.parquet as pq
+from sample.address_index import is_hidden
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the bundled contracts: ABI, event file, address and events emitted by the mock
+CONTRACTS = {
+    'stETH': ('abi/stETH.json', 'event/stETH-Transfer.sol', '0xae7ab96520DE3A18E5e111B5EaAb095312D7fE84',
+              ['Transfer', 'TransferShares', 'Approval']),
+    'TetherToken': ('abi/TetherToken.json', 'event/TetherToken-Transfer.sol', '0xdAC17F958D2ee523a2206206994597C13D831ec7',
+                    ['Transfer', 'Approval']),
+}
+TRACKERS = ('process', 'parallel')
+STAGE_PATTERN = re.compile(r'Stage seconds[^:]*: fetch=([\d.]+) decode=([\d.]+) enrich=([\d.]+) write=([\d.]+)')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(args, contract, port):
+    """Start the mock server of a contract and wait until it answers."""
+    abi_file, _, address, events = CONTRACTS[contract]
+    cmd = [sys.executable, '-m', 'benchmarks.mock_rpc', 'serve', '--abi', abi_file, '--address', address,
+           '--events', *events, '--density', str(args.density), '--head', str(args.from_block + args.blocks + 1000),
+           '--port', str(port), '--latency', str(args.latency), '--latency-per-log', str(args.latency_per_log),
+           '--jitter', str(args.jitter), '--error-rate', str(args.error_rate), '--max-logs', str(args.max_logs)]
+    for burst in args.burst:
+        cmd += ['--burst', burst]
+    server = subprocess.Popen(cmd, cwd=ROOT, stdout=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            server_stats(port)
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError(f"The mock server of {contract} did not start")
+
+
+def server_stats(port):
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=5) as response:
+        return json.loads(response.read())
+
+
+def tracker_command(args, tracker, contract, rpc, work_dir):
+    abi_file, event_file, address, _ = CONTRACTS[contract]
+    to_block = args.from_block + args.blocks - 1
+    common = ['-n', abi_file, '-a', address, '-e', event_file, '-f', str(args.from_block), '-t', str(to_block), '-r', rpc,
+              '-b', str(args.batch_size), '-i', str(args.in_flight), *args.tracker_args]
+    if tracker == 'process':
+        return [sys.executable, '-m', 'sample.process_event_tracker', *common,
+                '-l', os.path.join(work_dir, 'logs', 'tracker.log'), '-o', os.path.join(work_dir, 'output', 'events.parquet')]
+    return [sys.executable, '-m', 'sample.parallel_event_tracker', *common, '-c', str(args.cores),
+            '-l', os.path.join(work_dir, 'logs') + '/', '-o', os.path.join(work_dir, 'output'), '-x', 'events']
+
+
+def run_tracker(cmd, log_file):
+    """Run a tracker, returning its exit code, seconds and peak RSS in MiB, its workers included."""
+    started = time.monotonic()
+    with open(log_file, 'w') as out:
+        process = subprocess.Popen(cmd, cwd=ROOT, stdout=out, stderr=subprocess.STDOUT)
+        # the peak of the process and of the children it waited for, in KiB on Linux
+        _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return process.returncode, time.monotonic() - started, usage.ru_maxrss / 1024
+
+
+def stage_seconds(work_dir, tracker):
+    """Seconds of each stage, from the tracker logs."""
+    if tracker == 'process':
+        paths = [os.path.join(work_dir, 'logs', 'tracker.log')]
+    else:
+        # the scheduler logs the sum over all the ranges at the end
+        paths = glob.glob(os.path.join(work_dir, 'logs', '*', 'job_main.log'))
+    totals = [0.0, 0.0, 0.0, 0.0]
+    for path in paths:
+        with open(path) as f:
+            matches = STAGE_PATTERN.findall(f.read())
+        for match in matches:
+            totals = [total + float(seconds) for total, seconds in zip(totals, match)]
+    return dict(zip(('fetch', 'decode', 'enrich', 'write'), totals))
+
+
+def output_rows(work_dir):
+    # the compacted dataset and the address indexes repeat the rows of the outputs
+    output_dir = os.path.join(work_dir, 'output')
+    paths = glob.glob(os.path.join(output_dir, '**', '*.parquet'), recursive=True)
+    return sum(pq.read_metadata(path).num_rows for path in paths if not is_hidden(path, output_dir))
+
+
+def run_scenario(args, tracker, contract):
+    port = free_port()
+    server = start_server(args, contract, port)
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            os.makedirs(os.path.join(work_dir, 'output'))
+            cmd = tracker_command(args, tracker, contract, f"http://127.0.0.1:{port}", work_dir)
+            returncode, seconds, peak_rss = run_tracker(cmd, os.path.join(work_dir, 'stdout.log'))
+            if returncode != 0:
+                with open(os.path.join(work_dir, 'stdout.log')) as f:
+                    print(f.read()[-2000:])
+            events = output_rows(work_dir)
+            result = {
+                'tracker': tracker,
+                'contract': contract,
+                'returncode': returncode,
+                'blocks': args.blocks,
+                'events': events,
+                'seconds': seconds,
+                'events_per_second': events / seconds if seconds > 0 else 0.0,
+                'stages': stage_seconds(work_dir, tracker),
+                'peak_rss_mib': peak_rss,
+                'rpc': server_stats(port),
+            }
+    finally:
+        server.terminate()
+        server.wait()
+    return result
+
+
+def print_results(results):
+    print(f"{'tracker':<9} {'contract':<12} {'events':>9} {'seconds':>8} {'events/s':>9} {'fetch':>7} {'decode':>7} {'enrich':>7} {'write':>7} {'rss MiB':>8} {'requests':>9} {'errors':>7}")
+    for r in results:
+        s = r['stages']
+        print(f"{r['tracker']:<9} {r['contract']:<12} {r['events']:>9} {r['seconds']:>8.1f} {r['events_per_second']:>9.0f} "
+              f"{s['fetch']:>7.1f} {s['decode']:>7.1f} {s['enrich']:>7.1f} {s['write']:>7.1f} {r['peak_rss_mib']:>8.0f} "
+              f"{r['rpc'].get('requests', 0):>9} {r['rpc'].get('errors', 0):>7}")
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the event trackers")
+    parser.add_argument('--trackers', type=str, nargs='+', choices=TRACKERS, default=list(TRACKERS), help='Trackers benchmarked')
+    parser.add_argument('--contracts', type=str, nargs='+', choices=list(CONTRACTS), default=list(CONTRACTS), help='Bundled contracts benchmarked')
+    parser.add_argument('--from-block', type=int, default=0, help='First block tracked')
+    parser.add_argument('--blocks', type=int, default=100000, help='Number of blocks tracked')
+    parser.add_argument('--density', type=float, default=0.5, help='Mean number of logs per block')
+    parser.add_argument('--burst', type=str, action='append', default=[], help='<from-block>:<to-block>:<density> of a denser block range, can be repeated')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds the server waits before each answer')
+    parser.add_argument('--latency-per-log', type=float, default=0.0, help='Seconds added per log of an answer')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Up to this many random seconds added to each answer')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of the requests failed with HTTP 503')
+    parser.add_argument('--max-logs', type=int, default=10000, help='get_logs windows with more logs are refused')
+    parser.add_argument('-c', '--cores', type=int, default=4, help='Worker processes of parallel_event_tracker')
+    parser.add_argument('-b', '--batch-size', type=int, default=1, help='Block windows per JSON-RPC batch request')
+    parser.add_argument('-i', '--in-flight', type=int, default=1, help='Concurrent get_logs requests')
+    parser.add_argument('--tracker-args', type=str, nargs=argparse.REMAINDER, default=[], help='Further arguments given to the trackers, at the end')
+    parser.add_argument('-o', '--output-file', type=str, default=None, help='JSON file of the results')
+    parser.add_argument('--min-events-per-second', type=float, default=None, help='Fail when a scenario is slower')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    results = []
+    for contract in args.contracts:
+        for tracker in args.trackers:
+            print(f"Benchmarking {tracker}_event_tracker on {contract}")
+            results.append(run_scenario(args, tracker, contract))
+    print_results(results)
+    if args.output_file is not None:
+        with open(args.output_file, 'w') as f:
+            json.dump({'arguments': vars(args), 'results': results}, f, indent=2)
+
+    failed = [r for r in results if r['returncode'] != 0]
+    slow = [r for r in results if args.min_events_per_second is not None and r['events_per_second'] < args.min_events_per_second]
+    for r in failed:
+        print(f"{r['tracker']}_event_tracker failed on {r['contract']} with exit code {r['returncode']}")
+    for r in slow:
+        print(f"{r['tracker']}_event_tracker on {r['contract']}: {r['events_per_second']:.0f} events/s, below {args.min_events_per_second}")
+    if failed or slow:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+"""Secondary index of the address parameters of the outputs.
+
+The rows of an output are in block order, so finding the events of one
+address reads every row group of every file. Next to each output file, the
+writer keeps _index/<file>.index: a small Parquet file of the sorted (address, row
+group) pairs of the indexed address parameters of the event, e.g. the from
+and to of a Transfer, with the addresses as 20 bytes whatever the
+--address-format. A lookup only reads the index pages that can hold the
+address, from the min/max statistics of the sorted index, and then only the
+row groups of the output holding it. Readers of a directory of outputs, such
+as pyarrow.dataset or Spark, skip the _index directories as they skip any
+path starting with _ or .
+
+    from sample.address_index import find_events
+    table = find_events('transfers.parquet', '0xae7ab96520DE3A18E5e111B5EaAb095312D7fE84')
+
+    python -m sample.address_index <output-file-or-dataset-dir> -a <address>
+"""
+import argparse
+import glob
+import json
+import os
+import time
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+INDEX_DIR = '_index'
+INDEX_SUFFIX = '.index'
+# small row groups, a lookup reads one of them
+INDEX_ROW_GROUP_ROWS = 8192
+
+
+def index_file(output_file):
+    directory, name = os.path.split(output_file)
+    return os.path.join(directory, INDEX_DIR, f"{name}{INDEX_SUFFIX}")
+
+
+def is_hidden(path, root):
+    """Whether a part of path below root starts with _ or ., like the files dataset readers skip."""
+    return any(part.startswith(('_', '.')) for part in os.path.relpath(path, root).split(os.sep))
+
+
+def address_columns(event, event_abi=None):
+    """
+    Indexed address parameters of an event parsed by parse_solidity_event.
+
+    The indexed flags are taken from the ABI entry of the event when given, event
+    files often leave them out.
+    """
+    indexed = event.get('indexed') or []
+    if event_abi is not None and len(event_abi['inputs']) == len(event['fields']):
+        indexed = [bool(i.get('indexed')) for i in event_abi['inputs']]
+    return [field for field, abi_type, is_indexed in zip(event['fields'], event['types'], indexed)
+            if is_indexed and abi_type == 'address']
+
+
+def address_key(address):
+    """An address as 20 bytes, from its hex string or bytes."""
+    if isinstance(address, str):
+        return bytes.fromhex(address.removeprefix('0x'))
+    return bytes(address)
+
+
+def column_keys(column):
+    """The distinct addresses of a column, as 20 bytes."""
+    values = pc.unique(column).drop_null().to_pylist()
+    return [address_key(value) for value in values]
+
+
+class AddressIndex:
+    """
+    Builds the index of an output file as its row groups are written.
+
+    Args:
+        columns (list): The address columns indexed.
+    """
+    def __init__(self, columns):
+        self.columns = list(columns)
+        self.addresses = []
+        self.row_groups = []
+        self.names = []
+
+    def add(self, table, row_group):
+        """Index the rows of a table written as row group number row_group."""
+        for column in self.columns:
+            keys = column_keys(table[column])
+            self.addresses += keys
+            self.row_groups += [row_group] * len(keys)
+            self.names += [column] * len(keys)
+
+    def write(self, output_file, num_rows, num_row_groups):
+        """Write the index of output_file, which has num_rows rows in num_row_groups row groups."""
+        table = pa.table({
+            'address': pa.array(self.addresses, pa.binary(20)),
+            'row_group': pa.array(self.row_groups, pa.int32()),
+            'column': pa.array(self.names, pa.string()),
+        }).sort_by([('address', 'ascending'), ('row_group', 'ascending')])
+        # an index is only used for the file it was written with
+        table = table.replace_schema_metadata({
+            'columns': json.dumps(self.columns), 'num_rows': str(num_rows), 'num_row_groups': str(num_row_groups)
+        })
+        path = index_file(output_file)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        pq.write_table(table, f"{path}.tmp", row_group_size=INDEX_ROW_GROUP_ROWS)
+        os.replace(f"{path}.tmp", path)
+
+
+def remove_index(output_file):
+    """Remove the index of a file being removed or rewritten without one."""
+    path = index_file(output_file)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def indexed_columns(output_file):
+    """The columns indexed for output_file, None if it has no index."""
+    path = index_file(output_file)
+    if not os.path.exists(path):
+        return None
+    return json.loads(pq.read_schema(path).metadata[b'columns'])
+
+
+def lookup(output_file, address, metadata=None):
+    """
+    The row groups of output_file holding address in an indexed column.
+
+    Args:
+        metadata (pq.FileMetaData): The footer of output_file, if already read.
+
+    Returns:
+        list: The row group numbers, None if the file has no index or an index
+            written for another version of the file.
+    """
+    path = index_file(output_file)
+    if not os.path.exists(path):
+        return None
+    metadata = metadata if metadata is not None else pq.read_metadata(output_file)
+    index = pq.ParquetFile(path)
+    key_value = index.schema_arrow.metadata
+    if int(key_value[b'num_rows']) != metadata.num_rows or int(key_value[b'num_row_groups']) != metadata.num_row_groups:
+        return None
+    key = address_key(address)
+    row_groups = set()
+    column = index.schema_arrow.names.index('address')
+    # the index is sorted, the statistics of its row groups point to the one or two holding the key
+    for i in range(index.num_row_groups):
+        statistics = index.metadata.row_group(i).column(column).statistics
+        if statistics is not None and statistics.has_min_max and not statistics.min <= key <= statistics.max:
+            continue
+        table = index.read_row_group(i, columns=['address', 'row_group'])
+        row_groups.update(table.filter(pc.equal(table['address'], pa.scalar(key, pa.binary(20))))['row_group'].to_pylist())
+    return sorted(row_groups)
+
+
+def matches(table, fields, address):
+    """Mask of the rows of table where one of fields holds address."""
+    key = address_key(address)
+    mask = None
+    for field in fields:
+        column = table[field]
+        if pa.types.is_string(column.type) or pa.types.is_large_string(column.type):
+            equal = pc.equal(pc.utf8_lower(column), '0x' + key.hex())
+        else:
+            equal = pc.equal(column, pa.scalar(key, column.type))
+        mask = equal if mask is None else pc.or_(mask, equal)
+    return pc.fill_null(mask, False)
+
+
+def dataset_files(path):
+    """The data files of an output and its fragments, or of a compacted dataset directory."""
+    # output_dataset rewrites the indexes of the files it truncates, it imports this module
+    from .output_dataset import output_files
+    if os.path.isdir(path):
+        files = glob.glob(os.path.join(path, '**', '*.parquet'), recursive=True)
+        return sorted(f for f in files if not is_hidden(f, path))
+    return output_files(path)
+
+
+def address_fields(schema):
+    """The columns of schema that can hold an address: 20 byte binary and string columns."""
+    return [field.name for field in schema
+            if field.type == pa.binary(20) or pa.types.is_string(field.type) or pa.types.is_large_string(field.type)]
+
+
+def find_events(paths, address, fields=None, columns=None):
+    """
+    The events of outputs where an indexed address parameter is address.
+
+    Only the row groups the indexes point to are read. Files without a valid
+    index are scanned entirely, comparing address to the columns the other
+    files are indexed on, or to every column that can hold an address when no
+    file is indexed.
+
+    Args:
+        paths (str or list): Output files, with their fragments, or directories of compacted datasets.
+        address (str): The address looked up.
+        fields (list): The columns compared to address, the indexed ones by default.
+        columns (list): The columns returned, all by default.
+
+    Returns:
+        pa.Table: The matching rows, in the order of the files and their blocks,
+            None if there is no file.
+    """
+    files = [f for path in ([paths] if isinstance(paths, str) else paths) for f in dataset_files(path)]
+    indexed = {path: indexed_columns(path) for path in files}
+    default_fields = next((c for c in indexed.values() if c is not None), None)
+    tables = []
+    schema = None
+    for path in files:
+        parquet = pq.ParquetFile(path)
+        if schema is None:
+            schema = parquet.schema_arrow
+        row_groups = lookup(path, address, parquet.metadata)
+        file_fields = fields if fields is not None else indexed[path]
+        if file_fields is None:
+            names = parquet.schema_arrow.names
+            file_fields = [f for f in default_fields if f in names] if default_fields is not None else address_fields(parquet.schema_arrow)
+        if row_groups is None:
+            row_groups = range(parquet.num_row_groups)
+        if not row_groups or not file_fields:
+            continue
+        table = parquet.read_row_groups(row_groups)
+        table = table.filter(matches(table, file_fields, address))
+        tables.append(table.select(columns) if columns is not None else table)
+    if not tables:
+        if schema is None:
+            return None
+        table = schema.empty_table()
+        return table.select(columns) if columns is not None else table
+    return pa.concat_tables(tables)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Events of the tracker outputs involving an address")
+    parser.add_argument('paths', type=str, nargs='+', help='Output files, with their fragments, or compacted dataset directories')
+    parser.add_argument('-a', '--address', type=str, required=True, help='The address looked up')
+    parser.add_argument('--fields', type=str, nargs='+', default=None, help='Columns compared to the address, the indexed ones by default (optional)')
+    parser.add_argument('-o', '--output-file', type=str, default=None, help='Parquet file of the matching events, printed if not given (optional)')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    started = time.monotonic()
+    table = find_events(args.paths, args.address, args.fields)
+    if table is None:
+        print("No output file found")
+        return
+    print(f"{table.num_rows} events found in {time.monotonic() - started:.3f} seconds")
+    if args.output_file is not None:
+        pq.write_table(table, args.output_file)
+    else:
+        print(table.to_pandas())
+
+if __name__ == "__main__":
+    main()
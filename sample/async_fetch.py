@@ -0,0 +1,142 @@
+"""Asyncio engine keeping several get_logs requests in flight in one process.
+
+Windows are scheduled ahead of the one being consumed and their results are
+handed back strictly in block order. The event loop runs in a background
+thread, so the requests keep flowing while the caller decodes and writes.
+"""
+import asyncio
+import collections
+import threading
+import time
+import aiohttp
+from web3 import AsyncWeb3
+from .range_controller import is_range_limit_error
+from .metrics import METRICS
+
+# network errors worth retrying, everything else is raised straight away
+RETRY_EXCEPTIONS = (aiohttp.ClientError, asyncio.TimeoutError)
+
+
+def make_async_web3(rpc, timeout=40, connect_timeout=None):
+    # the session of the provider is set up by the caller, in the loop using it
+    return AsyncWeb3(
+        AsyncWeb3.AsyncHTTPProvider(
+            rpc,
+            request_kwargs={'timeout': aiohttp.ClientTimeout(total=None, sock_connect=connect_timeout, sock_read=timeout)}
+        )
+    )
+
+
+async def fetch_window(fetch_logs, window_from, window_to, controller, semaphore, max_attempts=3, delay=2):
+    """
+    Fetch one window, splitting it in halves when the provider says it is too large.
+
+    Returns:
+        list: (window_from, window_to, logs) pieces covering the window in block order.
+    """
+    attempts = 0
+    while True:
+        async with semaphore:
+            started = time.monotonic()
+            try:
+                logs = await fetch_logs(window_from, window_to)
+                error = None
+            except Exception as ex:
+                error = ex
+            elapsed = time.monotonic() - started
+
+        if error is None:
+            controller.update(window_to - window_from + 1, len(logs), elapsed)
+            return [(window_from, window_to, logs)]
+
+        if window_to > window_from and is_range_limit_error(error):
+            controller.shrink()
+            METRICS.inc('retries_total', reason='range_limit')
+            middle = (window_from + window_to) // 2
+            print(f"Window {window_from}-{window_to} too large, splitting it at block {middle}")
+            first, second = await asyncio.gather(
+                fetch_window(fetch_logs, window_from, middle, controller, semaphore, max_attempts, delay),
+                fetch_window(fetch_logs, middle + 1, window_to, controller, semaphore, max_attempts, delay),
+            )
+            return first + second
+
+        attempts += 1
+        if isinstance(error, RETRY_EXCEPTIONS) and attempts < max_attempts:
+            METRICS.inc('retries_total', reason='http')
+            print(f"Attempt {attempts} failed: {error}")
+            print(f"Retrying in {delay} seconds...")
+            await asyncio.sleep(delay)
+            continue
+        raise error
+
+
+async def fetch_range_async(fetch_logs, from_block, to_block, controller, in_flight):
+    """
+    Walk [from_block, to_block] keeping up to in_flight requests running.
+
+    Args:
+        fetch_logs (coroutine function): fetch_logs(from_block, to_block) returning the list of logs.
+        from_block (int): First block, included.
+        to_block (int): Last block, included.
+        controller (AdaptiveRangeController): Sizes the windows.
+        in_flight (int): Maximum number of concurrent requests.
+
+    Yields:
+        tuple: (window_from, window_to, logs) in block order.
+    """
+    semaphore = asyncio.Semaphore(in_flight)
+    pending = collections.deque()
+    step = int(from_block)
+    to_block = int(to_block)
+    try:
+        while step <= to_block or pending:
+            # keep windows scheduled ahead so the semaphore never starves
+            while step <= to_block and len(pending) < 2 * in_flight:
+                window_to = min(step + controller.size - 1, to_block)
+                pending.append(asyncio.ensure_future(
+                    fetch_window(fetch_logs, step, window_to, controller, semaphore)
+                ))
+                step = window_to + 1
+            for piece in await pending.popleft():
+                yield piece
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def start_event_loop():
+    """An event loop running on a background daemon thread, and the thread."""
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    return loop, thread
+
+
+def iterate_async(async_iterator, loop=None):
+    """
+    Iterate an async generator from synchronous code.
+
+    The generator runs in an event loop on a background thread, so the tasks it
+    scheduled keep running while the caller processes the current item. The
+    loop given is left running for the next generators, so are the sessions
+    opened in it, otherwise a loop is started and stopped for this one.
+    """
+    async def next_item():
+        return await async_iterator.__anext__()
+
+    own_loop = loop is None
+    if own_loop:
+        loop, thread = start_event_loop()
+    try:
+        while True:
+            try:
+                item = asyncio.run_coroutine_threadsafe(next_item(), loop).result()
+            except StopAsyncIteration:
+                return
+            yield item
+    finally:
+        asyncio.run_coroutine_threadsafe(async_iterator.aclose(), loop).result()
+        if own_loop:
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
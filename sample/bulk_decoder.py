@@ -0,0 +1,138 @@
+"""Column-wise decoding of a whole get_logs result for one event.
+
+Static ABI types are read straight out of the 32 bytes words of the topics
+and of the data with NumPy, instead of decoding every log through web3.
+Events with dynamic types (string, bytes, arrays, tuples) are not supported
+here and are left to log_decoder.decode_log.
+"""
+import re
+import numpy as np
+from eth_hash.auto import keccak
+
+WORD = 32
+STATIC_TYPE = re.compile(r'^(uint|int)(\d*)$|^address$|^bool$|^bytes([1-9]|[12]\d|3[0-2])$')
+
+
+def _as_bytes(value):
+    """Raw bytes of a HexBytes value or of a 0x hex string from a raw JSON-RPC response."""
+    if isinstance(value, str):
+        return bytes.fromhex(value[2:] if value.startswith('0x') else value)
+    return bytes(value)
+
+
+def checksum_addresses(addresses):
+    """
+    EIP-55 checksummed strings of 20 bytes addresses.
+
+    One keccak per address, the case of the hex letters is then set for all
+    of them at once from the nibbles of the hashes.
+    """
+    n = len(addresses)
+    if n == 0:
+        return []
+    hexes = b''.join(a.hex().encode() for a in addresses)
+    hashes = np.frombuffer(b''.join(keccak(hexes[i:i + 40]) for i in range(0, 40 * n, 40)), dtype=np.uint8)
+    hashes = hashes.reshape(n, 32)[:, :20]
+    nibbles = np.stack([hashes >> 4, hashes & 0x0f], axis=2).reshape(n, 40)
+    chars = np.frombuffer(hexes, dtype=np.uint8).reshape(n, 40).copy()
+    chars[(nibbles >= 8) & (chars >= ord('a'))] -= ord('a') - ord('A')
+    text = chars.tobytes().decode()
+    return ['0x' + text[i:i + 40] for i in range(0, 40 * n, 40)]
+
+
+def _decode_words(words, abi_type, checksum_cache):
+    """
+    Decode a (n, 32) uint8 array of ABI words of the same static type.
+
+    Integers up to 64 bits come back as NumPy integer arrays, wider ones as an
+    object array of Python ints, addresses as checksummed strings.
+    """
+    n = words.shape[0]
+    if abi_type == 'address':
+        # checksum each distinct address once, NumPy strips the trailing zero bytes of S20
+        raw = np.ascontiguousarray(words[:, WORD - 20:]).view('S20').ravel()
+        unique, inverse = np.unique(raw, return_inverse=True)
+        missing = [a for a in unique if a not in checksum_cache]
+        checksum_cache.update(zip(missing, checksum_addresses([a.ljust(20, b'\0') for a in missing])))
+        values = np.empty(len(unique), dtype=object)
+        values[:] = [checksum_cache[a] for a in unique]
+        return values[inverse.ravel()]
+    if abi_type == 'bool':
+        return words[:, -1] != 0
+    if abi_type.startswith('bytes'):
+        size = int(abi_type[5:])
+        out = np.empty(n, dtype=object)
+        out[:] = [bytes(row) for row in words[:, :size]]
+        return out
+
+    signed = abi_type.startswith('int')
+    bits = int(abi_type[4 if not signed else 3:] or 256)
+    if bits <= 64:
+        # the low 8 bytes of the word, sign extension is already in place
+        low = np.ascontiguousarray(words[:, WORD - 8:]).view('>i8' if signed else '>u8').ravel()
+        return low.astype(np.int64 if signed else np.uint64)
+    buffer = words.tobytes()
+    out = np.empty(n, dtype=object)
+    out[:] = [int.from_bytes(buffer[i:i + WORD], 'big', signed=signed) for i in range(0, n * WORD, WORD)]
+    return out
+
+
+class BulkEventDecoder:
+    """
+    Decodes all the logs of one event at once.
+
+    Args:
+        event_abi (dict): The ABI entry of the event, as found in generate_event_abi_map.
+    """
+    def __init__(self, event_abi):
+        self.event_abi = event_abi
+        self.inputs = event_abi['inputs']
+        self.indexed = [i for i in self.inputs if i.get('indexed')]
+        self.not_indexed = [i for i in self.inputs if not i.get('indexed')]
+        self.supported = not event_abi.get('anonymous', False) and all(
+            STATIC_TYPE.match(i['type']) for i in self.inputs
+        )
+        self.checksum_cache = {}
+
+    def decode(self, logs):
+        """
+        Decode a list of logs of this event.
+
+        Returns:
+            dict: 'blockNumber', 'transactionHash' and one entry per event
+            parameter, each an array with one value per log.
+        """
+        n = len(logs)
+        if n == 0:
+            return {name: np.empty(0, dtype=object) for name in ['blockNumber', 'transactionHash'] + [i['name'] for i in self.inputs]}
+        n_topics = 1 + len(self.indexed)
+        n_words = len(self.not_indexed)
+
+        topics = [log['topics'] for log in logs]
+        if any(len(t) != n_topics for t in topics):
+            raise ValueError(f"Logs with an unexpected number of topics for event {self.event_abi['name']}")
+        data = b''.join(_as_bytes(log['data']) for log in logs)
+        if len(data) != n * n_words * WORD:
+            raise ValueError(f"Logs with an unexpected data size for event {self.event_abi['name']}")
+
+        topic_words = np.frombuffer(
+            b''.join(_as_bytes(topic) for t in topics for topic in t[1:]), dtype=np.uint8
+        ).reshape(n, n_topics - 1, WORD)
+        data_words = np.frombuffer(data, dtype=np.uint8).reshape(n, n_words, WORD)
+
+        block_numbers = [log['blockNumber'] for log in logs]
+        columns = {
+            'blockNumber': np.array([int(b, 16) if isinstance(b, str) else b for b in block_numbers], dtype=np.int64),
+            'transactionHash': np.array([_as_bytes(log['transactionHash']) for log in logs], dtype=object),
+        }
+        topic_index = 0
+        data_index = 0
+        for param in self.inputs:
+            if param.get('indexed'):
+                words = topic_words[:, topic_index, :]
+                topic_index += 1
+            else:
+                words = data_words[:, data_index, :]
+                data_index += 1
+            columns[param['name']] = _decode_words(words, param['type'], self.checksum_cache)
+        return columns
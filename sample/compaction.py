@@ -0,0 +1,267 @@
+"""Compaction of the range outputs of parallel_event_tracker into one dataset.
+
+A long run leaves a <prefix>-<from-block>-<to-block>.parquet file per range,
+and per event when several are tracked, with their appended fragments; many
+of them are nearly empty and every reader pays for opening their footers.
+Compaction copies their rows into a hive-partitioned dataset, with one file per
+bucket of blocks or per month of the block timestamps, row groups in block
+order, and a _metadata file gathering the footers of all the partitions, so
+that a reader plans its scan from a single file:
+
+    <dataset-dir>/[event=<event>/]block_bucket=<first-block>/part-0.parquet
+    <dataset-dir>/[event=<event>/]month=<yyyy-mm>/part-0.parquet
+    <dataset-dir>/_metadata
+    <dataset-dir>/_common_metadata
+
+The size and modification time of the compacted sources are kept in
+<dataset-dir>/_compaction.json, so a later run only rewrites the partitions
+holding rows of new, changed or removed sources, usually the newest one.
+
+    python -m sample.compaction -o <output-dir> -x <output-prefix> [--partition-by month]
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from .output_dataset import output_files
+from .parquet_writer import StreamingParquetWriter
+from .address_index import AddressIndex, indexed_columns
+
+PARTITION_BY = ('blocks', 'month')
+# blocks of a partition with --partition-by blocks
+BUCKET_BLOCKS = 1000000
+ROW_GROUP_ROWS = 1000000
+STATE_FILE = '_compaction.json'
+PART_FILE = 'part-0.parquet'
+
+
+def default_dataset_dir(output_dir, prefix):
+    # the leading _ makes readers of the output directory skip the dataset, which holds the same rows
+    return os.path.join(output_dir, f"_{prefix}.dataset")
+
+
+def range_sources(output_dir, prefix):
+    """
+    The range outputs of a prefix in output_dir.
+
+    Returns:
+        dict: The base file and fragments of each output, by (event, from_block,
+            to_block), event being None when a single event was tracked. Of
+            outputs covering the same blocks only the last written is given.
+    """
+    pattern = re.compile(rf"{re.escape(prefix)}-(\d+)-(\d+)(?:\.([^.]+))?\.parquet")
+    sources = {}
+    for name in os.listdir(output_dir):
+        match = pattern.fullmatch(name)
+        if match is not None:
+            from_block, to_block, event = match.groups()
+            sources[(event, int(from_block), int(to_block))] = output_files(os.path.join(output_dir, name))
+    # a range tracked again with other bounds leaves the older outputs behind,
+    # the newest output of overlapping ones is kept so that no row is counted twice
+    newest = sorted(sources, key=lambda k: max(os.path.getmtime(path) for path in sources[k]), reverse=True)
+    kept = []
+    for key in newest:
+        overlapping = [k for k in kept if k[0] == key[0] and k[1] <= key[2] and key[1] <= k[2]]
+        if overlapping:
+            print(f"Skipping the output of blocks {key[1]}-{key[2]}, older than the output of blocks {overlapping[0][1]}-{overlapping[0][2]}")
+            del sources[key]
+        else:
+            kept.append(key)
+    return sources
+
+
+def partition_column(partition_by):
+    return 'blockNumber' if partition_by == 'blocks' else 'timestamp'
+
+
+def partition_keys(table, partition_by, bucket_blocks):
+    """The partition of each row: first block of its bucket, or yyyy-mm of its timestamp."""
+    if partition_by == 'blocks':
+        blocks = table['blockNumber'].cast('int64')
+        return pc.multiply(pc.divide(blocks, bucket_blocks), bucket_blocks)
+    if 'timestamp' not in table.column_names:
+        raise ValueError("Partitioning by month needs the timestamp column, track the events with --enrich timestamp")
+    return pc.strftime(table['timestamp'], format='%Y-%m')
+
+
+def partition_dir(event, partition_by, value):
+    key = 'block_bucket' if partition_by == 'blocks' else 'month'
+    path = f"{key}={value}"
+    return path if event is None else os.path.join(f"event={event}", path)
+
+
+def load_state(dataset_dir):
+    path = os.path.join(dataset_dir, STATE_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_state(dataset_dir, state):
+    path = os.path.join(dataset_dir, STATE_FILE)
+    with open(f"{path}.tmp", 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(f"{path}.tmp", path)
+
+
+def first_block(metadata):
+    """Smallest block of a file, from the statistics of its first row group."""
+    column = metadata.schema.names.index('blockNumber')
+    statistics = metadata.row_group(0).column(column).statistics
+    return statistics.min if statistics is not None and statistics.has_min_max else 0
+
+
+def write_metadata(dataset_dir, schema):
+    """Gather the footers of the partition files in _metadata, and the schema in _common_metadata."""
+    collected = []
+    for root, dirs, names in os.walk(dataset_dir):
+        # like dataset readers, skip the _index directories of the partitions
+        dirs[:] = [d for d in dirs if not d.startswith(('_', '.'))]
+        for name in names:
+            if name.endswith('.parquet') and not name.startswith(('_', '.')):
+                path = os.path.join(root, name)
+                metadata = pq.read_metadata(path)
+                metadata.set_file_path(os.path.relpath(path, dataset_dir))
+                collected.append((os.path.dirname(os.path.relpath(root, dataset_dir)), first_block(metadata), metadata))
+    # in block order, event after event
+    collected = [metadata for _, _, metadata in sorted(collected, key=lambda c: c[:2])]
+    pq.write_metadata(schema, os.path.join(dataset_dir, '_common_metadata'))
+    pq.write_metadata(schema, os.path.join(dataset_dir, '_metadata'), metadata_collector=collected)
+
+
+def rewrite_partition(dataset_dir, partition, sources, schema, partition_by, bucket_blocks, row_group_rows, index_columns=None):
+    """
+    Write the rows of one partition from the sources holding some, in block order.
+
+    The partition file is indexed on index_columns, see address_index.
+
+    Returns:
+        int: The number of rows written, the partition is removed when there is none.
+    """
+    event, value = partition
+    target_dir = os.path.join(dataset_dir, partition_dir(event, partition_by, value))
+    target = os.path.join(target_dir, PART_FILE)
+    sorting = [pq.SortingColumn(schema.names.index('blockNumber'))]
+    with StreamingParquetWriter(target, schema, row_group_rows, float('inf'), keep_empty=False,
+                                index=AddressIndex(index_columns) if index_columns else None, sorting_columns=sorting) as writer:
+        # the sources are disjoint block ranges, sorting each row group sorts the whole file
+        for path in sources:
+            parquet = pq.ParquetFile(path)
+            for i in range(parquet.num_row_groups):
+                table = parquet.read_row_group(i).select(schema.names).cast(schema)
+                table = table.filter(pc.equal(partition_keys(table, partition_by, bucket_blocks), value))
+                table = table.sort_by('blockNumber')
+                # the writer flushes once it holds row_group_rows rows, large row groups are cut first
+                for offset in range(0, table.num_rows, row_group_rows):
+                    writer.write(table.slice(offset, row_group_rows))
+    rows = writer.rows_written
+    if rows == 0 and os.path.isdir(target_dir):
+        shutil.rmtree(target_dir)
+    return rows
+
+
+def compact(output_dir, prefix, dataset_dir=None, partition_by='blocks', bucket_blocks=BUCKET_BLOCKS, row_group_rows=ROW_GROUP_ROWS):
+    """
+    Compact the range outputs of a prefix into a partitioned dataset.
+
+    Args:
+        output_dir (str): Directory of the range outputs.
+        prefix (str): Output prefix of the range outputs.
+        dataset_dir (str): Directory of the dataset, <output-dir>/_<prefix>.dataset by default.
+        partition_by (str): 'blocks' for buckets of bucket_blocks blocks, or 'month'.
+        bucket_blocks (int): Blocks of a partition when partitioning by blocks.
+        row_group_rows (int): Rows of the row groups written.
+
+    Returns:
+        list: The directories of the partitions rewritten, relative to dataset_dir.
+    """
+    if partition_by not in PARTITION_BY:
+        raise ValueError(f"Unknown partitioning {partition_by}, expected one of {PARTITION_BY}")
+    dataset_dir = dataset_dir if dataset_dir is not None else default_dataset_dir(output_dir, prefix)
+    options = {'prefix': prefix, 'partition_by': partition_by, 'bucket_blocks': bucket_blocks}
+    state = load_state(dataset_dir)
+    if state is None or state['options'] != options:
+        # another layout, the dataset is written again from scratch
+        if os.path.isdir(dataset_dir):
+            shutil.rmtree(dataset_dir)
+        state = {'options': options, 'sources': {}}
+    os.makedirs(dataset_dir, exist_ok=True)
+
+    previous = state['sources']
+    current = {}
+    # partitions by (event, value) whose rows changed
+    dirty = set()
+    for (event, from_block, _), files in range_sources(output_dir, prefix).items():
+        for order, path in enumerate(files):
+            stat = os.stat(path)
+            entry = {'event': event, 'order': [from_block, order], 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+            known = previous.get(path)
+            if known is not None and all(known[k] == entry[k] for k in ('size', 'mtime_ns', 'event')):
+                entry['partitions'] = known['partitions']
+            else:
+                # the partition column alone is read
+                column = partition_column(partition_by)
+                table = pq.read_table(path, columns=[column] if column in pq.read_schema(path).names else [])
+                values = partition_keys(table, partition_by, bucket_blocks).unique().to_pylist() if table.num_rows else []
+                entry['partitions'] = sorted(values)
+                dirty.update((event, value) for value in entry['partitions'])
+                if known is not None:
+                    dirty.update((known['event'], value) for value in known['partitions'])
+            current[path] = entry
+    for path, known in previous.items():
+        if path not in current:
+            dirty.update((known['event'], value) for value in known['partitions'])
+
+    schema = None
+    if os.path.exists(os.path.join(dataset_dir, '_common_metadata')):
+        schema = pq.read_schema(os.path.join(dataset_dir, '_common_metadata'))
+    elif current:
+        # the types of the first source, the others are cast to them
+        schema = pq.read_schema(min(current, key=lambda p: current[p]['order'])).remove_metadata()
+
+    rewritten = []
+    for partition in sorted(dirty, key=lambda p: (p[0] or '', p[1])):
+        event, value = partition
+        sources = sorted((p for p, e in current.items() if e['event'] == event and value in e['partitions']),
+                         key=lambda p: current[p]['order'])
+        # the partitions are indexed on the columns the sources were
+        index_columns = next((c for c in map(indexed_columns, sources) if c is not None), None)
+        rewrite_partition(dataset_dir, partition, sources, schema, partition_by, bucket_blocks, row_group_rows, index_columns)
+        rewritten.append(partition_dir(event, partition_by, value))
+
+    if schema is not None:
+        write_metadata(dataset_dir, schema)
+    state['sources'] = current
+    save_state(dataset_dir, state)
+    return rewritten
+
+
+def read_dataset(dataset_dir, columns=None, filter=None):
+    """Read a compacted dataset, planned from its _metadata file, with its partition columns."""
+    dataset = ds.parquet_dataset(os.path.join(dataset_dir, '_metadata'), partitioning='hive')
+    return dataset.to_table(columns=columns, filter=filter)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Compact the range outputs of parallel_event_tracker into a partitioned dataset")
+    parser.add_argument('-o', '--output-dir', type=str, required=True, help='Directory of the range outputs')
+    parser.add_argument('-x', '--output-prefix', type=str, required=True, help='Prefix of the range outputs')
+    parser.add_argument('-d', '--dataset-dir', type=str, default=None, help='Directory of the dataset, defaults to <output-dir>/_<output-prefix>.dataset (optional)')
+    parser.add_argument('--partition-by', type=str, choices=PARTITION_BY, default='blocks', help='Partition by buckets of blocks or by month of the block timestamps (optional)')
+    parser.add_argument('--bucket-blocks', type=int, default=BUCKET_BLOCKS, help='Blocks of a partition when partitioning by blocks (optional)')
+    parser.add_argument('--row-group-rows', type=int, default=ROW_GROUP_ROWS, help='Rows of the row groups written (optional)')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    rewritten = compact(args.output_dir, args.output_prefix, args.dataset_dir, args.partition_by, args.bucket_blocks, args.row_group_rows)
+    print(f"{len(rewritten)} partitions rewritten: {', '.join(rewritten) or 'none'}")
+
+if __name__ == "__main__":
+    main()
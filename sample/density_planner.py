@@ -0,0 +1,238 @@
+"""Density pre-scan of parallel_event_tracker.
+
+Before any worker starts, the number of events in a few windows spread over
+the block range is counted with eth_getLogs, and the ranges whose row count is
+known from an earlier run are read from the manifest instead. The resulting
+profile, events per block over the range, is used to cut it into ranges of
+about the same number of events, and to estimate the get_logs calls and the
+time a run will take before it is started.
+"""
+import math
+import time
+from .log_decoder import parse_raw_log
+from .range_controller import is_range_limit_error
+from .rate_limiter import compute_units
+
+# windows counted by the pre-scan, and their length in blocks
+SAMPLES = 32
+SAMPLE_BLOCKS = 1000
+# ranges are not cut shorter than this
+MIN_PARTITION_BLOCKS = 1000
+
+
+class DensityProfile:
+    """
+    Estimated events per block over a block range.
+
+    Args:
+        segments (list): Contiguous (from_block, to_block, density) in block
+            order, density being the events per block.
+    """
+    def __init__(self, segments):
+        self.segments = sorted(segments)
+        self.from_block = self.segments[0][0]
+        self.to_block = self.segments[-1][1]
+
+    def events(self, from_block, to_block):
+        """Estimated events in [from_block, to_block]."""
+        total = 0.0
+        for a, b, density in self.segments:
+            overlap = min(b, to_block) - max(a, from_block) + 1
+            if overlap > 0:
+                total += overlap * density
+        return total
+
+    def block_at(self, from_block, events):
+        """First block where the events counted from from_block reach events."""
+        total = 0.0
+        for a, b, density in self.segments:
+            if b < from_block or density <= 0:
+                continue
+            a = max(a, from_block)
+            if total + (b - a + 1) * density >= events:
+                return a + max(0, math.ceil((events - total) / density) - 1)
+            total += (b - a + 1) * density
+        return self.to_block
+
+    def partition(self, from_block, to_block, n_parts, min_blocks=MIN_PARTITION_BLOCKS):
+        """
+        Cut [from_block, to_block] in up to n_parts ranges of about the same number of events.
+
+        The block count is balanced instead when no event is expected.
+
+        Returns:
+            list: (from_block, to_block) of the ranges, in block order.
+        """
+        total = self.events(from_block, to_block)
+        cuts = []
+        for k in range(1, n_parts):
+            if total > 0:
+                cuts.append(self.block_at(from_block, total * k / n_parts))
+            else:
+                cuts.append(from_block + (to_block - from_block + 1) * k // n_parts - 1)
+        ranges = []
+        start = from_block
+        for cut in cuts:
+            # too short ranges are merged with the next one
+            if cut - start + 1 >= min_blocks and to_block - cut >= min_blocks:
+                ranges.append((start, cut))
+                start = cut + 1
+        ranges.append((start, to_block))
+        return ranges
+
+
+class DensityPlanner:
+    """
+    Pre-scans a block range and plans and prices the ranges of a run.
+
+    Args:
+        tracker (EventTracker): Its filter and batch client count the sampled windows,
+            its range controller tells how the windows will be sized.
+        samples (int): Number of windows counted over the whole range.
+        sample_blocks (int): Length of a counted window, halved while the node
+            refuses to answer for it.
+    """
+    def __init__(self, tracker, samples=SAMPLES, sample_blocks=SAMPLE_BLOCKS):
+        self.tracker = tracker
+        self.samples = samples
+        self.sample_blocks = sample_blocks
+        # (logs, seconds) of the sampled get_logs calls
+        self.timings = []
+        self.calls = 0
+        # the sampled logs are decoded too, for the time spent per event
+        self.decoded = 0
+        self.decode_seconds = 0.0
+
+    def count_logs(self, from_block, to_block):
+        """Number of logs in a window, and the blocks actually counted."""
+        while True:
+            self.calls += 1
+            started = time.monotonic()
+            try:
+                logs = self.tracker.batch_client.get_logs(self.tracker.window_filter(from_block, to_block))
+            except Exception as ex:
+                if to_block > from_block and is_range_limit_error(ex):
+                    to_block = from_block + (to_block - from_block) // 2
+                    continue
+                raise
+            self.timings.append((len(logs), time.monotonic() - started))
+            self.decode([parse_raw_log(log) for log in logs])
+            return len(logs), to_block - from_block + 1
+
+    def decode(self, logs):
+        started = time.monotonic()
+        for topic, group in self.tracker.split_logs(logs).items():
+            self.tracker.decode_logs(self.tracker.events_by_topic[topic], group)
+            self.decoded += len(group)
+        self.decode_seconds += time.monotonic() - started
+
+    def profile(self, from_block, to_block, known=()):
+        """
+        Estimate the density over [from_block, to_block].
+
+        Args:
+            known (list): (from_block, to_block, events) of ranges whose events
+                are known, they are not sampled.
+
+        Returns:
+            DensityProfile: The known ranges and one segment per sampled window
+            around it elsewhere.
+        """
+        segments = []
+        gaps = []
+        start = from_block
+        for a, b, events in sorted(known):
+            if a < start or b > to_block:
+                continue
+            if a > start:
+                gaps.append((start, a - 1))
+            segments.append((a, b, events / (b - a + 1)))
+            start = b + 1
+        if start <= to_block:
+            gaps.append((start, to_block))
+
+        # the samples are shared between the gaps by length
+        gap_blocks = sum(b - a + 1 for a, b in gaps)
+        for a, b in gaps:
+            n_samples = max(1, round(self.samples * (b - a + 1) / gap_blocks))
+            edges = [a + (b - a + 1) * k // n_samples for k in range(n_samples + 1)]
+            for lower, upper in zip(edges, edges[1:]):
+                if upper <= lower:
+                    continue
+                # a window in the middle of each stratum stands for all of it
+                length = min(self.sample_blocks, upper - lower)
+                first = lower + (upper - lower - length) // 2
+                events, counted = self.count_logs(first, first + length - 1)
+                segments.append((lower, upper - 1, events / counted))
+        return DensityProfile(segments)
+
+    def latency(self):
+        """Seconds of a get_logs call as a + b * logs, fitted on the sampled calls."""
+        if not self.timings:
+            return 0.0, 0.0
+        n = len(self.timings)
+        mean_logs = sum(logs for logs, _ in self.timings) / n
+        mean_seconds = sum(seconds for _, seconds in self.timings) / n
+        spread = sum((logs - mean_logs) ** 2 for logs, _ in self.timings)
+        if spread == 0:
+            return mean_seconds, 0.0
+        b = max(0.0, sum((logs - mean_logs) * (seconds - mean_seconds) for logs, seconds in self.timings) / spread)
+        return max(0.0, mean_seconds - b * mean_logs), b
+
+    def window_calls(self, profile, from_block, to_block):
+        """get_logs calls over a range, with windows sized for the density as the range controller does."""
+        controller = self.tracker.controller
+        calls = 0.0
+        for a, b, density in profile.segments:
+            overlap = min(b, to_block) - max(a, from_block) + 1
+            if overlap <= 0:
+                continue
+            window = controller.target_logs / density if density > 0 else controller.max_size
+            calls += overlap / max(controller.min_size, min(window, controller.max_size))
+        return max(1, math.ceil(calls))
+
+    def estimate(self, profile, ranges, workers=1, in_flight=1, batch_size=1,
+                 requests_per_second=None, compute_units_per_second=None):
+        """
+        Estimated cost of tracking ranges.
+
+        Returns:
+            dict: 'ranges', a list of dicts of the blocks, events, calls and
+            seconds of each range, and the totals 'events', 'calls', 'requests'
+            (batched calls are one request), 'compute_units' and 'seconds' of
+            the run, the latter bounded by the request budgets if given. The
+            time counts the get_logs calls and the decoding, not the writes
+            nor the enrichment.
+        """
+        a, b = self.latency()
+        per_event = self.decode_seconds / self.decoded if self.decoded else 0.0
+        estimates = []
+        for from_block, to_block in ranges:
+            events = profile.events(from_block, to_block)
+            calls = self.window_calls(profile, from_block, to_block)
+            estimates.append({
+                'from_block': from_block,
+                'to_block': to_block,
+                'blocks': to_block - from_block + 1,
+                'events': int(round(events)),
+                'calls': calls,
+                # the calls of a worker overlap, its decoding does not
+                'seconds': (a * calls + b * events) / max(1, in_flight) + per_event * events,
+            })
+        calls = sum(e['calls'] for e in estimates)
+        requests = sum(math.ceil(e['calls'] / batch_size) for e in estimates)
+        units = calls * compute_units(['eth_getLogs'])
+        # the idle workers split the running ranges, the work is shared evenly
+        seconds = sum(e['seconds'] for e in estimates) / max(1, workers)
+        if requests_per_second:
+            seconds = max(seconds, requests / requests_per_second)
+        if compute_units_per_second:
+            seconds = max(seconds, units / compute_units_per_second)
+        return {
+            'ranges': estimates,
+            'events': sum(e['events'] for e in estimates),
+            'calls': calls,
+            'requests': requests,
+            'compute_units': units,
+            'seconds': seconds,
+        }
@@ -0,0 +1,202 @@
+"""Block and transaction columns added to the decoded events.
+
+The distinct blocks and transactions of a decoded window are looked up in a
+local SQLite store first, the missing ones are fetched with batched,
+deduplicated eth_getBlockByNumber and eth_getTransactionByHash calls and
+stored for the next windows, runs and neighbouring ranges. Enriching costs one
+request per distinct block or transaction, not one per event.
+"""
+import sqlite3
+import time
+import numpy as np
+import pyarrow as pa
+from web3 import Web3
+from .log_filters import retry_on_error
+from .output_schema import arrow_type, to_arrow_array
+from .rpc_batch import BatchRejectedError, JsonRpcError
+
+# columns that can be added, and where they come from
+ENRICH_COLUMNS = ('timestamp', 'tx_from', 'gasPrice')
+BLOCK_COLUMNS = ('timestamp',)
+TX_COLUMNS = ('tx_from', 'gasPrice')
+
+# SQLite limits the number of parameters of a query
+QUERY_CHUNK = 500
+
+
+def _chunks(values, size):
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+class ChainStore:
+    """
+    Persistent store of block timestamps and transaction senders and gas prices.
+
+    Args:
+        path (str): SQLite file, shared by the processes of a run. The store only
+            lives in memory if None.
+    """
+    def __init__(self, path=None):
+        self.connection = sqlite3.connect(path if path is not None else ':memory:', timeout=60)
+        if path is not None:
+            # concurrent readers while a worker writes
+            self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS blocks (number INTEGER PRIMARY KEY, timestamp INTEGER)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS transactions (hash BLOB PRIMARY KEY, block_number INTEGER, tx_from TEXT, gas_price TEXT)')
+        self.connection.commit()
+
+    def get_blocks(self, numbers):
+        """Timestamps of the stored blocks among numbers, by block number."""
+        found = {}
+        for chunk in _chunks(numbers, QUERY_CHUNK):
+            query = f"SELECT number, timestamp FROM blocks WHERE number IN ({','.join('?' * len(chunk))})"
+            found.update(self.connection.execute(query, chunk).fetchall())
+        return found
+
+    def put_blocks(self, rows):
+        self.connection.executemany('INSERT OR REPLACE INTO blocks VALUES (?, ?)', rows)
+        self.connection.commit()
+
+    def get_transactions(self, hashes):
+        """(tx_from, gas_price) of the stored transactions among hashes, by hash."""
+        found = {}
+        for chunk in _chunks(hashes, QUERY_CHUNK):
+            query = f"SELECT hash, tx_from, gas_price FROM transactions WHERE hash IN ({','.join('?' * len(chunk))})"
+            for tx_hash, tx_from, gas_price in self.connection.execute(query, chunk):
+                found[bytes(tx_hash)] = (tx_from, int(gas_price))
+        return found
+
+    def put_transactions(self, rows):
+        self.connection.executemany(
+            'INSERT OR REPLACE INTO transactions VALUES (?, ?, ?, ?)',
+            [(tx_hash, block, tx_from, str(gas_price)) for tx_hash, block, tx_from, gas_price in rows]
+        )
+        self.connection.commit()
+
+
+class Enricher:
+    """
+    Adds block and transaction columns to the decoded tables.
+
+    Args:
+        client (JsonRpcBatchClient): Client posting the batched calls.
+        store (ChainStore): Local store consulted before the node.
+        columns (list): Columns to add, among ENRICH_COLUMNS.
+        address_format (str): Storage of tx_from, as for the event addresses.
+        batch_size (int): Number of calls in a single JSON-RPC batch.
+        finalized_block (int): Blocks after this one and their transactions are
+            fetched but not stored, nothing is stored while it is None.
+        max_attempts (int): Number of times a block or transaction the node answers
+            with null is asked for, a node behind the head of the chain has not seen it yet.
+        delay (int): Delay between these attempts in seconds.
+    """
+    def __init__(self, client, store, columns, address_format='string', batch_size=100, finalized_block=None, max_attempts=3, delay=2):
+        self.client = client
+        self.store = store
+        self.columns = [c for c in ENRICH_COLUMNS if c in columns]
+        self.address_format = address_format
+        self.batch_size = batch_size
+        self.finalized_block = finalized_block
+        self.max_attempts = max_attempts
+        self.delay = delay
+
+    def fields(self):
+        """The fields appended to the output schema."""
+        types = {
+            # Parquet has no second unit, milliseconds avoid a cast when reading back
+            'timestamp': pa.timestamp('ms', tz='UTC'),
+            'tx_from': arrow_type('address', address=self.address_format),
+            'gasPrice': pa.uint64(),
+        }
+        return [pa.field(c, types[c]) for c in self.columns]
+
+    @retry_on_error()
+    def post(self, calls):
+        return self.client.call_batch(calls)
+
+    def call_all(self, calls):
+        """Results of the calls, batch_size at a time, halving the batches the provider refuses."""
+        results = []
+        i = 0
+        while i < len(calls):
+            chunk = calls[i:i + self.batch_size]
+            try:
+                answers = self.post(chunk)
+            except BatchRejectedError as ex:
+                if self.batch_size == 1:
+                    raise
+                self.batch_size = max(1, self.batch_size // 2)
+                print(f"Batch rejected by the provider ({ex}), using batches of {self.batch_size}")
+                continue
+            for answer in answers:
+                if isinstance(answer, JsonRpcError):
+                    raise answer
+            results += answers
+            i += len(chunk)
+        return results
+
+    def call_found(self, calls, names):
+        """Results of the calls, asking again for the ones the node answers with null."""
+        results = self.call_all(calls)
+        for attempt in range(1, self.max_attempts):
+            nulls = [i for i, result in enumerate(results) if result is None]
+            if not nulls:
+                break
+            print(f"The node has no {names[nulls[0]]} yet, retrying {len(nulls)} calls in {self.delay} seconds...")
+            time.sleep(self.delay)
+            for i, result in zip(nulls, self.call_all([calls[i] for i in nulls])):
+                results[i] = result
+        for name, result in zip(names, results):
+            if result is None:
+                raise ValueError(f"The node has no {name} after {self.max_attempts} attempts")
+        return results
+
+    def is_final(self, block):
+        return self.finalized_block is not None and block <= self.finalized_block
+
+    def timestamps(self, numbers):
+        found = self.store.get_blocks(numbers)
+        missing = [n for n in numbers if n not in found]
+        if missing:
+            headers = self.call_found([('eth_getBlockByNumber', [hex(n), False]) for n in missing], [f"block {n}" for n in missing])
+            fetched = {n: int(header['timestamp'], 16) for n, header in zip(missing, headers)}
+            self.store.put_blocks([(n, t) for n, t in fetched.items() if self.is_final(n)])
+            found.update(fetched)
+        return found
+
+    def transactions(self, hashes):
+        found = self.store.get_transactions(hashes)
+        missing = [h for h in hashes if h not in found]
+        if missing:
+            txs = self.call_found([('eth_getTransactionByHash', ['0x' + h.hex()]) for h in missing], [f"transaction 0x{h.hex()}" for h in missing])
+            rows = [(h, int(tx['blockNumber'], 16), Web3.to_checksum_address(tx['from']), int(tx['gasPrice'], 16)) for h, tx in zip(missing, txs)]
+            self.store.put_transactions([row for row in rows if self.is_final(row[1])])
+            found.update({h: (tx_from, gas_price) for h, _, tx_from, gas_price in rows})
+        return found
+
+    def enrich(self, table):
+        """Append the enrichment columns to a table with blockNumber and transactionHash."""
+        if table.num_rows == 0:
+            for field in self.fields():
+                table = table.append_column(field, pa.array([], field.type))
+            return table
+
+        if any(c in BLOCK_COLUMNS for c in self.columns):
+            blocks = table['blockNumber'].to_numpy()
+            unique = np.unique(blocks)
+            timestamps = self.timestamps([int(n) for n in unique])
+            values = np.array([timestamps[int(n)] for n in unique], dtype=np.int64)[np.searchsorted(unique, blocks)]
+        if any(c in TX_COLUMNS for c in self.columns):
+            hashes = table['transactionHash'].to_pylist()
+            txs = self.transactions(list(dict.fromkeys(hashes)))
+
+        for field in self.fields():
+            if field.name == 'timestamp':
+                column = pa.array(values, pa.timestamp('s', tz='UTC')).cast(field.type)
+            elif field.name == 'tx_from':
+                column = to_arrow_array(np.array([txs[h][0] for h in hashes], dtype=object), field.type)
+            else:
+                column = pa.array([txs[h][1] for h in hashes], field.type)
+            table = table.append_column(field, column)
+        return table
@@ -0,0 +1,195 @@
+"""Live follow mode of process_event_tracker.
+
+After catching up, the tracker polls the node for its head and tracks the
+blocks that reached the confirmation depth, appending them to the output as
+fragments. The hash of the last block of each append is kept next to the
+output: when the node no longer has the same hash for it, the chain was
+reorganized, and only the files covering the blocks after the last block still
+on the chain are truncated and tracked again. The fragments older than the
+hashes kept can no longer be reorganized, they are merged into larger ones.
+"""
+import json
+import os
+import time
+from .logger import logging
+from .output_dataset import last_tracked_block, merge_fragments, truncate_output
+from .rpc_batch import JsonRpcError
+
+CONFIRMATIONS = 12
+POLL_INTERVAL = 12.0
+# appends whose last block hash is kept, the deepest reorganization handled
+KEEP_HASHES = 64
+# fragments older than the hashes kept merged at once
+MERGE_FRAGMENTS = 32
+
+
+def block_hash_file(output_file):
+    """Block hashes of an output: <name>.hashes.json"""
+    return f"{os.path.splitext(output_file)[0]}.hashes.json"
+
+
+class BlockHashes:
+    """
+    Hashes of the last blocks of the appends, by block number.
+
+    Args:
+        path (str): JSON file where they are kept, only in memory if None.
+        keep (int): Number of hashes kept.
+    """
+    def __init__(self, path=None, keep=KEEP_HASHES):
+        self.path = path
+        self.keep = keep
+        self.hashes = {}
+        if path is not None and os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self.hashes = {int(block): block_hash for block, block_hash in json.load(f).items()}
+            except (OSError, ValueError):
+                self.hashes = {}
+
+    def blocks(self):
+        """Block numbers with a hash, latest first."""
+        return sorted(self.hashes, reverse=True)
+
+    def add(self, block, block_hash):
+        self.hashes[block] = block_hash.lower()
+        for old in self.blocks()[self.keep:]:
+            del self.hashes[old]
+
+    def drop_after(self, block):
+        self.hashes = {b: h for b, h in self.hashes.items() if b <= block}
+
+    def clear(self):
+        self.hashes = {}
+
+    def save(self):
+        if self.path is None:
+            return
+        tmp_file = f"{self.path}.tmp"
+        with open(tmp_file, 'w') as f:
+            json.dump({str(b): h for b, h in self.hashes.items()}, f)
+        os.replace(tmp_file, self.path)
+
+
+class ChainFollower:
+    """
+    Keeps the output of an EventTracker up to date with the chain.
+
+    Args:
+        tracker (EventTracker): The tracker, its batch client reads the block hashes.
+        output_file (str): The output, one file per event derived from it as in track().
+        from_block (int): First block tracked when there is no output yet.
+        confirmations (int): Blocks a block must have on top of it to be tracked.
+        poll_interval (float): Seconds between two looks at the head.
+        append (bool): Extend the existing output, it is written again otherwise.
+        merge_fragments (int): Number of fragments older than the hashes kept that
+            are merged together, each append leaves one.
+    """
+    def __init__(self, tracker, output_file, from_block=None, confirmations=CONFIRMATIONS,
+                 poll_interval=POLL_INTERVAL, append=True, merge_fragments=MERGE_FRAGMENTS):
+        self.tracker = tracker
+        self.output_file = output_file
+        self.confirmations = confirmations
+        self.poll_interval = poll_interval
+        self.append = append
+        self.merge_fragments = merge_fragments
+        self.logger = logging.getLogger()
+        self.outputs = list(tracker.output_files(output_file).values())
+        self.hashes = BlockHashes(block_hash_file(output_file))
+
+        self.last_block = (from_block or 0) - 1
+        if append and all(os.path.exists(path) for path in self.outputs):
+            last_blocks = [last_tracked_block(path) for path in self.outputs]
+            if None not in last_blocks:
+                self.last_block = max(self.last_block, min(last_blocks))
+            # appends without any event leave no file behind, their hash tells where they ended
+            if self.hashes.blocks():
+                self.last_block = max(self.last_block, self.hashes.blocks()[0])
+        else:
+            self.hashes.clear()
+
+    def block_hashes(self, blocks):
+        """Current hashes of the blocks on the node, by block number."""
+        headers = self.tracker.batch_client.call_batch([('eth_getBlockByNumber', [hex(b), False]) for b in blocks])
+        hashes = {}
+        for block, header in zip(blocks, headers):
+            if isinstance(header, JsonRpcError):
+                raise header
+            hashes[block] = header['hash'].lower() if header is not None else None
+        return hashes
+
+    def fork_block(self):
+        """
+        Last block both in the output and still on the chain, None if the chain was not reorganized.
+
+        The latest stored hash is checked at each poll, the older ones only once it changed.
+        """
+        blocks = self.hashes.blocks()
+        if not blocks:
+            return None
+        if self.block_hashes(blocks[:1])[blocks[0]] == self.hashes.hashes[blocks[0]]:
+            return None
+        current = self.block_hashes(blocks[1:])
+        for block in blocks[1:]:
+            if current[block] == self.hashes.hashes[block]:
+                return block
+        raise RuntimeError(f"The chain was reorganized before block {blocks[-1]}, deeper than the {len(blocks)} block hashes kept")
+
+    def rewind(self, block):
+        """Drop what the output holds after block."""
+        for path in self.outputs:
+            truncate_output(path, block)
+        self.hashes.drop_after(block)
+        self.hashes.save()
+        self.last_block = min(self.last_block, block)
+
+    def poll(self, to_block=None):
+        """
+        Track the blocks confirmed since the last poll, up to to_block if given.
+
+        Returns:
+            int: The number of events found.
+        """
+        head = self.tracker.w3.eth.block_number
+        fork = self.fork_block()
+        if fork is not None:
+            self.logger.info(f"Chain reorganized after block {fork}, tracking the blocks after it again")
+            self.rewind(fork)
+
+        confirmed = head - self.confirmations
+        to_block = confirmed if to_block is None else min(to_block, confirmed)
+        if to_block <= self.last_block:
+            return 0
+        # read before tracking, a reorganization in between shows at the next poll
+        block_hash = self.block_hashes([to_block])[to_block]
+        # the outputs end at the last block tracked, their footers are not read again
+        events = self.tracker.track(self.last_block + 1, to_block, self.output_file, self.append,
+                                    last_block=self.last_block if self.append else None)
+        # the next polls extend what was just written
+        self.append = True
+        self.hashes.add(to_block, block_hash)
+        self.hashes.save()
+        self.last_block = to_block
+        self.merge()
+        return events
+
+    def merge(self):
+        """Merge the fragments the hashes kept no longer reach, merge_fragments at a time."""
+        blocks = self.hashes.blocks()
+        if len(blocks) < self.hashes.keep:
+            return
+        for path in self.outputs:
+            for merged in merge_fragments(path, blocks[-1], self.merge_fragments):
+                self.logger.info(f"Merged the fragments of {path} into {merged}")
+
+    def run(self, to_block=None):
+        """Poll until to_block is tracked, forever if it is None."""
+        self.logger.info(f"Following the chain from block {self.last_block + 1} with {self.confirmations} confirmations")
+        while to_block is None or self.last_block < to_block:
+            started = time.monotonic()
+            events = self.poll(to_block)
+            if events:
+                self.logger.info(f"Tracked {events} new events up to block {self.last_block}")
+            if to_block is not None and self.last_block >= to_block:
+                break
+            time.sleep(max(0.0, self.poll_interval - (time.monotonic() - started)))
@@ -0,0 +1,129 @@
+"""HTTP transport of the trackers.
+
+All the requests of a process go through sessions configured here: a
+keep-alive connection pool sized for the requests the process keeps in
+flight, compressed responses (gzip, and brotli or zstd when their decoders
+are installed with the compress extra), separate connect and read timeouts,
+and optionally HTTP/2 through httpx when it is installed with its h2 extra.
+The aiohttp sessions of the asyncio engine get the same pool, timeouts and
+compression, HTTP/2 is not available with aiohttp.
+"""
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter, BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 40
+POOL_SIZE = 10
+
+
+def accept_encoding():
+    """gzip and deflate, plus br and zstd when their decoders, used by urllib3 and httpx, can be imported."""
+    encodings = ['gzip', 'deflate']
+    try:
+        import brotli
+        encodings.append('br')
+    except ImportError:
+        pass
+    try:
+        import zstandard
+        encodings.append('zstd')
+    except ImportError:
+        pass
+    return ', '.join(encodings)
+
+
+ACCEPT_ENCODING = accept_encoding()
+
+
+def aiohttp_accept_encoding():
+    """gzip and deflate, plus br and zstd when aiohttp finds their decoders."""
+    from aiohttp import compression_utils
+    encodings = ['gzip', 'deflate']
+    if getattr(compression_utils, 'HAS_BROTLI', False):
+        encodings.append('br')
+    if getattr(compression_utils, 'HAS_ZSTD', False):
+        encodings.append('zstd')
+    return ', '.join(encodings)
+
+
+class Http2Adapter(BaseAdapter):
+    """
+    requests transport adapter sending the requests with an httpx HTTP/2 client.
+
+    Args:
+        pool_size (int): Maximum number of connections kept open.
+        timeout (tuple): (connect, read) timeouts in seconds.
+    """
+    def __init__(self, pool_size=POOL_SIZE, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)):
+        super().__init__()
+        try:
+            import httpx
+        except ImportError:
+            raise ImportError("HTTP/2 needs httpx with its h2 extra: pip install 'httpx[http2]'")
+        self.httpx = httpx
+        self.client = httpx.Client(
+            http2=True,
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            timeout=httpx.Timeout(timeout[1], connect=timeout[0]),
+        )
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        if isinstance(timeout, tuple):
+            timeout = self.httpx.Timeout(timeout[1], connect=timeout[0])
+        elif timeout is None:
+            timeout = self.client.timeout
+        try:
+            # connection management headers are not allowed in HTTP/2
+            headers = {k: v for k, v in request.headers.items() if k.lower() != 'connection'}
+            answer = self.client.request(request.method, request.url, headers=headers,
+                                         content=request.body, timeout=timeout)
+        except self.httpx.TimeoutException as ex:
+            raise requests.exceptions.Timeout(ex, request=request)
+        except self.httpx.TransportError as ex:
+            raise requests.exceptions.ConnectionError(ex, request=request)
+
+        response = requests.Response()
+        response.status_code = answer.status_code
+        # httpx already decoded the body
+        response.headers = CaseInsensitiveDict((k, v) for k, v in answer.headers.items() if k.lower() != 'content-encoding')
+        response._content = answer.content
+        response.encoding = answer.encoding
+        response.url = request.url
+        response.reason = answer.reason_phrase
+        response.request = request
+        response.connection = self
+        return response
+
+    def close(self):
+        self.client.close()
+
+
+def configure_session(session, pool_size=POOL_SIZE, http2=False, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)):
+    """
+    Set up the connection pool and the headers of a requests.Session.
+
+    Returns:
+        requests.Session: The session given.
+    """
+    adapter = Http2Adapter(pool_size, timeout) if http2 else HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers['Accept-Encoding'] = ACCEPT_ENCODING
+    return session
+
+
+def async_session(pool_size=POOL_SIZE, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)):
+    """
+    An aiohttp.ClientSession set up as configure_session sets up the requests ones.
+
+    It has to be created in the event loop it is used in.
+    """
+    return aiohttp.ClientSession(
+        # as the sessions of web3, whose errors the callers handle
+        raise_for_status=True,
+        connector=aiohttp.TCPConnector(limit=pool_size, limit_per_host=pool_size),
+        timeout=aiohttp.ClientTimeout(total=None, sock_connect=timeout[0], sock_read=timeout[1]),
+        headers={'Accept-Encoding': aiohttp_accept_encoding()},
+    )
@@ -0,0 +1,309 @@
+"""Local on-disk cache of raw get_logs responses.
+
+Finalized history never changes, so the logs of a block window only need to be
+downloaded once. The cache keeps them per (chain id, addresses, topics) in a
+directory named after a hash of that key, as compressed Arrow IPC segments
+<from-block>-<to-block>.arrow. A window is served from the segments covering
+it, and only the blocks no segment covers are fetched from the node, so
+overlapping and repeated windows, appends and re-runs after a decoding change
+stay on the local disk. Once the segments cover a whole bucket of finalized
+blocks, they are merged into a single segment of the bucket, so that a long
+history is not left as thousands of small files.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import pyarrow as pa
+import pyarrow.compute as pc
+from web3 import Web3
+from web3.datastructures import AttributeDict
+from hexbytes import HexBytes
+
+# blocks behind the head considered final, newer blocks are never cached
+FINALITY_DEPTH = 64
+# blocks of the merged segments
+BUCKET_BLOCKS = 100000
+
+SEGMENT_SCHEMA = pa.schema([
+    ('address', pa.string()),
+    ('blockHash', pa.binary(32)),
+    ('blockNumber', pa.int64()),
+    ('data', pa.binary()),
+    ('logIndex', pa.int64()),
+    ('topics', pa.list_(pa.binary(32))),
+    ('transactionHash', pa.binary(32)),
+    ('transactionIndex', pa.int64()),
+])
+
+
+def cache_key(chain_id, address, topics):
+    """Hash identifying the logs of one filter on one chain."""
+    addresses = address if isinstance(address, (list, tuple)) else [address]
+    key = {
+        'chain_id': int(chain_id),
+        'addresses': sorted(a.lower() for a in addresses),
+        'topics': json.loads(json.dumps(topics).lower()),
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()[:32], key
+
+
+def _ipc_options():
+    for codec in ('zstd', 'lz4'):
+        if pa.Codec.is_available(codec):
+            return pa.ipc.IpcWriteOptions(compression=codec)
+    return pa.ipc.IpcWriteOptions()
+
+
+def _as_bytes(value):
+    """Bytes of a HexBytes value or of a hex string of the fast path."""
+    if isinstance(value, str):
+        return bytes.fromhex(value[2:] if value.startswith('0x') else value)
+    return bytes(value)
+
+
+def logs_to_table(logs):
+    return pa.Table.from_pydict({
+        'address': [log['address'] for log in logs],
+        'blockHash': [_as_bytes(log['blockHash']) for log in logs],
+        'blockNumber': [log['blockNumber'] for log in logs],
+        'data': [_as_bytes(log['data']) for log in logs],
+        'logIndex': [log['logIndex'] for log in logs],
+        'topics': [[_as_bytes(t) for t in log['topics']] for log in logs],
+        'transactionHash': [_as_bytes(log['transactionHash']) for log in logs],
+        'transactionIndex': [log['transactionIndex'] for log in logs],
+    }, schema=SEGMENT_SCHEMA)
+
+
+def table_to_logs(table):
+    """Give the rows of a segment the shape returned by w3.eth.get_logs."""
+    # checksummed as web3 returns them, the fast path stores them in lowercase
+    addresses = {a: Web3.to_checksum_address(a) for a in pc.unique(table['address']).to_pylist()}
+    return [
+        AttributeDict({
+            'address': addresses[row['address']],
+            'blockHash': HexBytes(row['blockHash']),
+            'blockNumber': row['blockNumber'],
+            'data': HexBytes(row['data']),
+            'logIndex': row['logIndex'],
+            'removed': False,
+            'topics': [HexBytes(t) for t in row['topics']],
+            'transactionHash': HexBytes(row['transactionHash']),
+            'transactionIndex': row['transactionIndex'],
+        })
+        for row in table.to_pylist()
+    ]
+
+
+class LogCache:
+    """
+    Raw logs of one filter, stored by block window.
+
+    Several processes can share the same cache directory: segments are
+    written under a temporary name and moved in place.
+
+    Args:
+        cache_dir (str): Root directory of the cache.
+        chain_id (int): Chain the logs come from.
+        address (str or list): Address or addresses of the filter.
+        topics (list): Topics of the filter.
+        finalized_block (int): Blocks after this one are fetched but not stored,
+            nothing is stored while it is None.
+        bucket_blocks (int): Blocks of the segments merged once a bucket is covered.
+    """
+    def __init__(self, cache_dir, chain_id, address, topics, finalized_block=None, bucket_blocks=BUCKET_BLOCKS):
+        key, description = cache_key(chain_id, address, topics)
+        self.directory = os.path.join(cache_dir, key)
+        self.description = description
+        self.finalized_block = finalized_block
+        self.bucket_blocks = bucket_blocks
+        self.segments = []
+        # the segment read last, consecutive windows often fall in the same one
+        self.loaded = (None, None)
+        self.refresh()
+
+    def refresh(self):
+        """Reload the list of segments, other processes may have added some."""
+        segments = []
+        if os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if not name.endswith('.arrow'):
+                    continue
+                first, last = os.path.splitext(name)[0].split('-')
+                segments.append((int(first), int(last), os.path.join(self.directory, name)))
+        self.segments = sorted(segments)
+
+    def missing(self, from_block, to_block):
+        """The (from, to) windows of [from_block, to_block] no segment covers."""
+        gaps = []
+        step = from_block
+        for first, last, _ in self.segments:
+            if last < step:
+                continue
+            if first > to_block:
+                break
+            if first > step:
+                gaps.append((step, first - 1))
+            step = last + 1
+            if step > to_block:
+                break
+        if step <= to_block:
+            gaps.append((step, to_block))
+        return gaps
+
+    def _load(self, path):
+        if self.loaded[0] != path:
+            with pa.OSFile(path) as source:
+                self.loaded = (path, pa.ipc.open_file(source).read_all())
+        return self.loaded[1]
+
+    def read(self, from_block, to_block):
+        """The cached logs of [from_block, to_block], blocks no segment covers are left out."""
+        try:
+            table = self.read_table(from_block, to_block)
+        except FileNotFoundError:
+            # another process merged the segments in the meantime
+            self.refresh()
+            table = self.read_table(from_block, to_block)
+        return table_to_logs(table) if table is not None else []
+
+    def read_table(self, from_block, to_block):
+        tables = []
+        step = from_block
+        for first, last, path in self.segments:
+            if last < step:
+                continue
+            if first > to_block:
+                break
+            # overlapping segments: each block is read from one of them only
+            low, high = max(step, first), min(to_block, last)
+            table = self._load(path)
+            blocks = table['blockNumber']
+            tables.append(table.filter(pc.and_(pc.greater_equal(blocks, low), pc.less_equal(blocks, high))))
+            step = high + 1
+            if step > to_block:
+                break
+        if not tables:
+            return None
+        return pa.concat_tables(tables)
+
+    def write_segment(self, from_block, to_block, table):
+        path = os.path.join(self.directory, f"{from_block}-{to_block}.arrow")
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            with pa.ipc.new_file(f, SEGMENT_SCHEMA, options=_ipc_options()) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, path)
+        return path
+
+    def merge(self, from_block, to_block):
+        """
+        Merge the segments of a bucket of blocks covered by the cache into one.
+
+        The segments within the bucket, or within buckets already merged, are
+        removed. Those going past the blocks merged are kept.
+        """
+        path = self.write_segment(from_block, to_block, self.read_table(from_block, to_block))
+        buckets = {first for first, last, _ in self.segments if self.is_bucket(first, last)} | {from_block}
+        kept = [(from_block, to_block, path)]
+        for first, last, segment in self.segments:
+            if segment == path:
+                continue
+            spanned = range(first - first % self.bucket_blocks, last + 1, self.bucket_blocks)
+            if not self.is_bucket(first, last) and all(bucket in buckets for bucket in spanned):
+                # readers of another process refresh their segments when one is gone
+                try:
+                    os.remove(segment)
+                except FileNotFoundError:
+                    pass
+            else:
+                kept.append((first, last, segment))
+        self.segments = sorted(kept)
+        self.loaded = (None, None)
+
+    def is_bucket(self, first, last):
+        return first % self.bucket_blocks == 0 and last == first + self.bucket_blocks - 1
+
+    def put(self, from_block, to_block, logs):
+        """Store the logs fetched for [from_block, to_block], up to the finalized block."""
+        if self.finalized_block is None or from_block > self.finalized_block:
+            return
+        if to_block > self.finalized_block:
+            to_block = self.finalized_block
+            logs = [log for log in logs if log['blockNumber'] <= to_block]
+        os.makedirs(self.directory, exist_ok=True)
+        key_file = os.path.join(self.directory, 'key.json')
+        if not os.path.exists(key_file):
+            with open(key_file, 'w') as f:
+                json.dump(self.description, f)
+
+        path = self.write_segment(from_block, to_block, logs_to_table(logs))
+        self.segments = sorted(self.segments + [(from_block, to_block, path)])
+
+        # the buckets of finalized blocks this window completed
+        for first in range(from_block - from_block % self.bucket_blocks, to_block + 1, self.bucket_blocks):
+            last = first + self.bucket_blocks - 1
+            if last > self.finalized_block or self.missing(first, last):
+                continue
+            inside = [s for s in self.segments if first <= s[0] and s[1] <= last]
+            if len(inside) > 1 or (inside and not self.is_bucket(*inside[0][:2])):
+                try:
+                    self.merge(first, last)
+                except FileNotFoundError:
+                    # another process merged it first
+                    self.refresh()
+
+    def _missing(self, from_block, to_block):
+        gaps = self.missing(from_block, to_block)
+        if gaps:
+            # another process may have stored them in the meantime
+            self.refresh()
+            gaps = self.missing(from_block, to_block)
+        return gaps
+
+    def fetch(self, fetch_logs, from_block, to_block):
+        """
+        get_logs through the cache: the cached blocks are read from disk and
+        only the missing windows are passed to fetch_logs(from_block, to_block).
+        """
+        gaps = self._missing(from_block, to_block)
+        logs = self.read(from_block, to_block) if gaps != [(from_block, to_block)] else []
+        for first, last in gaps:
+            fetched = fetch_logs(first, last)
+            self.put(first, last, fetched)
+            logs += fetched
+        if gaps and gaps != [(from_block, to_block)]:
+            logs.sort(key=lambda log: (log['blockNumber'], log['logIndex']))
+        return logs
+
+    async def fetch_async(self, fetch_logs, from_block, to_block):
+        """Same as fetch with a coroutine function fetch_logs."""
+        gaps = self._missing(from_block, to_block)
+        logs = self.read(from_block, to_block) if gaps != [(from_block, to_block)] else []
+        for first, last in gaps:
+            fetched = await fetch_logs(first, last)
+            self.put(first, last, fetched)
+            logs += fetched
+        if gaps and gaps != [(from_block, to_block)]:
+            logs.sort(key=lambda log: (log['blockNumber'], log['logIndex']))
+        return logs
+
+    def fetch_batch(self, fetch_batch, windows):
+        """
+        A batch of windows through the cache: the windows fully cached are read
+        from disk, the others are passed to fetch_batch(windows) as they are.
+        """
+        results = [None] * len(windows)
+        requested = []
+        for i, (first, last) in enumerate(windows):
+            if self._missing(first, last):
+                requested.append(i)
+            else:
+                results[i] = self.read(first, last)
+        if requested:
+            fetched = fetch_batch([windows[i] for i in requested])
+            for i, logs in zip(requested, fetched):
+                if not isinstance(logs, Exception):
+                    self.put(windows[i][0], windows[i][1], logs)
+                results[i] = logs
+        return results
@@ -1,4 +1,6 @@
 from web3 import Web3
+from web3.datastructures import AttributeDict
+from hexbytes import HexBytes
 
 
 # decode logs to get ipfs hash
@@ -25,3 +27,32 @@ def decode_log(log, event_abi_map, contract):
         return contract.events[event_abi['name']]().process_log(log)
     else:
         return None
+
+def _as_int(value):
+    return int(value, 16) if isinstance(value, str) else value
+
+def parse_raw_log(raw_log):
+    """
+    Light shape of a log of a raw JSON-RPC response, for the fast path.
+
+    Only the block number and indexes are turned into ints, the address,
+    topics and data stay hex strings and are read directly by the decoders.
+    """
+    raw_log['blockNumber'] = _as_int(raw_log['blockNumber'])
+    raw_log['logIndex'] = _as_int(raw_log['logIndex'])
+    raw_log['transactionIndex'] = _as_int(raw_log['transactionIndex'])
+    return raw_log
+
+def format_raw_log(raw_log):
+    """Give a log of a raw JSON-RPC response, or parsed by parse_raw_log, the shape returned by w3.eth.get_logs."""
+    return AttributeDict({
+        'address': Web3.to_checksum_address(raw_log['address']),
+        'blockHash': HexBytes(raw_log['blockHash']),
+        'blockNumber': _as_int(raw_log['blockNumber']),
+        'data': HexBytes(raw_log['data']),
+        'logIndex': _as_int(raw_log['logIndex']),
+        'removed': raw_log.get('removed', False),
+        'topics': [HexBytes(topic) for topic in raw_log['topics']],
+        'transactionHash': HexBytes(raw_log['transactionHash']),
+        'transactionIndex': _as_int(raw_log['transactionIndex']),
+    })
@@ -1,6 +1,7 @@
 import time
 from functools import wraps
 import requests  # For HTTP-related exceptions
+from .metrics import METRICS
 
 def retry_on_error(max_attempts=3, delay=2):
     """
@@ -22,6 +23,7 @@ def retry_on_error(max_attempts=3, delay=2):
                     attempts += 1
                     print(f"Attempt {attempts} failed: {http_err}")
                     if attempts < max_attempts:
+                        METRICS.inc('retries_total', reason='http')
                         print(f"Retrying in {delay} seconds...")
                         time.sleep(delay)
                     else:
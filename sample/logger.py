@@ -24,7 +24,13 @@ class StreamToLogger:
     def flush(self):
         pass
 
-def setup_logging(log_file_path=None):
+def setup_logging(log_file_path=None, echo=True):
+    """
+    Log to log_file_path, print and the errors included.
+
+    Args:
+        echo (bool): Whether what is printed also goes to the console.
+    """
     if log_file_path is None:
         raise ValueError("log_file_path must be provided")
     os.makedirs(os.path.dirname(log_file_path), exist_ok=True)
@@ -40,8 +46,8 @@ def setup_logging(log_file_path=None):
     original_stdout = sys.stdout
     original_stderr = sys.stderr
     # Redirect stdout and stderr to logging and also print to original streams
-    sys.stdout = StreamToLogger(logging.getLogger('STDOUT'), logging.INFO, original_stdout)
-    sys.stderr = StreamToLogger(logging.getLogger('STDERR'), logging.ERROR, original_stderr)
+    sys.stdout = StreamToLogger(logging.getLogger('STDOUT'), logging.INFO, original_stdout if echo else None)
+    sys.stderr = StreamToLogger(logging.getLogger('STDERR'), logging.ERROR, original_stderr if echo else None)
 
 if __name__ == "__main__":
     setup_logging()
@@ -0,0 +1,335 @@
+"""Performance metrics of the trackers.
+
+Each process records into its own registry, METRICS: counters, gauges and
+histograms with fixed buckets, keyed by name and labels. The workers of
+parallel_event_tracker send snapshots of it to the scheduler, which merges
+them and exports the result as a JSON summary and in the Prometheus text
+format, to files rewritten periodically and optionally over HTTP.
+
+The summary gives the share of the time spent waiting for the node, for the
+logs or the enrichment calls, decoding and writing, which tells whether a run
+is provider, CPU or disk bound.
+"""
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from .rate_limiter import payload_methods
+
+PREFIX = 'event_tracker_'
+# seconds between two snapshots sent by a worker, or two exports
+INTERVAL = 10.0
+
+BUCKETS = {
+    'rpc_latency_seconds': (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+    'logs_per_call': (0, 10, 100, 500, 1000, 2500, 5000, 10000),
+    'window_blocks': (1, 10, 100, 1000, 2000, 5000, 10000, 50000, 100000, 500000),
+    'decode_seconds_per_1k_logs': (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+}
+DEFAULT_BUCKETS = (0.001, 0.01, 0.1, 1.0, 10.0, 100.0)
+# what the time of each stage is spent on, the enrichment waits for block and transaction calls
+STAGE_BOUNDS = {'fetch': 'provider', 'enrich': 'provider', 'decode': 'cpu', 'write': 'disk'}
+
+
+def metric_key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def key_text(key):
+    """name{label="value",...} of a key."""
+    name, labels = key
+    if not labels:
+        return name
+    return name + '{' + ','.join(f'{k}="{v}"' for k, v in labels) + '}'
+
+
+class Metrics:
+    """
+    Counters, gauges and histograms of one process, safe to update from several threads.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        key = metric_key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.gauges[metric_key(name, labels)] = value
+
+    def observe(self, name, value, **labels):
+        key = metric_key(name, labels)
+        buckets = BUCKETS.get(name, DEFAULT_BUCKETS)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {'buckets': buckets, 'counts': [0] * len(buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram['counts'][i] += 1
+                    break
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def snapshot(self):
+        """A copy of the metrics, picklable to be sent to another process."""
+        with self.lock:
+            return {
+                'counters': dict(self.counters),
+                'gauges': dict(self.gauges),
+                'histograms': {k: dict(h, counts=list(h['counts'])) for k, h in self.histograms.items()},
+            }
+
+    def reset(self):
+        with self.lock:
+            self.counters, self.gauges, self.histograms = {}, {}, {}
+
+
+# the registry of this process
+METRICS = Metrics()
+
+
+def merge(snapshots):
+    """Sum the snapshots of several processes."""
+    merged = {'counters': {}, 'gauges': {}, 'histograms': {}}
+    for snapshot in snapshots:
+        for kind in ('counters', 'gauges'):
+            for key, value in snapshot[kind].items():
+                merged[kind][key] = merged[kind].get(key, 0) + value
+        for key, histogram in snapshot['histograms'].items():
+            total = merged['histograms'].get(key)
+            if total is None:
+                merged['histograms'][key] = dict(histogram, counts=list(histogram['counts']))
+                continue
+            total['counts'] = [a + b for a, b in zip(total['counts'], histogram['counts'])]
+            total['sum'] += histogram['sum']
+            total['count'] += histogram['count']
+    return merged
+
+
+def record_response(response, *args, **kwargs):
+    """requests response hook timing every JSON-RPC request."""
+    methods = payload_methods(response.request.body)
+    method = methods[0] if len(methods) == 1 else 'batch'
+    METRICS.observe('rpc_latency_seconds', response.elapsed.total_seconds(), method=method)
+    METRICS.inc('rpc_requests_total', method=method, status=response.status_code)
+    if response.status_code != 200:
+        METRICS.inc('rpc_errors_total', method=method, status=response.status_code)
+
+
+def total(snapshot, name):
+    """Sum of a counter or a gauge over its labels."""
+    values = list(snapshot['counters'].items()) + list(snapshot['gauges'].items())
+    return sum(value for (n, _), value in values if n == name)
+
+
+def by_label(snapshot, name, label):
+    values = {}
+    for (n, labels), value in list(snapshot['counters'].items()) + list(snapshot['gauges'].items()):
+        if n == name:
+            key = dict(labels).get(label)
+            values[key] = values.get(key, 0) + value
+    return values
+
+
+def quantile(histogram, q):
+    """Upper bound of the bucket holding the q quantile, None past the last bucket."""
+    rank = q * histogram['count']
+    seen = 0
+    for bound, count in zip(histogram['buckets'], histogram['counts']):
+        seen += count
+        if seen >= rank:
+            return bound
+    return None
+
+
+def histogram_summary(snapshot, name):
+    """Count, mean, median and 95th percentile of a histogram, over its labels."""
+    histograms = [h for (n, _), h in snapshot['histograms'].items() if n == name]
+    if not histograms:
+        return None
+    merged = merge([{'counters': {}, 'gauges': {}, 'histograms': {(name, ()): h}} for h in histograms])['histograms'][(name, ())]
+    if not merged['count']:
+        return None
+    return {
+        'count': merged['count'],
+        'mean': merged['sum'] / merged['count'],
+        'p50': quantile(merged, 0.5),
+        'p95': quantile(merged, 0.95),
+    }
+
+
+def summarize(snapshot, elapsed):
+    """
+    The JSON summary of a run.
+
+    Args:
+        snapshot (dict): The metrics, merged over the processes.
+        elapsed (float): Seconds since the start of the run.
+    """
+    stages = by_label(snapshot, 'stage_seconds_total', 'stage')
+    stage_total = sum(stages.values())
+    events = total(snapshot, 'events_written_total')
+    decoded = total(snapshot, 'decoded_logs_total')
+    bound = None
+    if stage_total > 0:
+        # waiting for the node, for the logs or the enrichment calls, decoding or writing
+        bounds = {}
+        for stage, seconds in stages.items():
+            bounds[STAGE_BOUNDS[stage]] = bounds.get(STAGE_BOUNDS[stage], 0.0) + seconds
+        bound = max(bounds, key=bounds.get)
+    return {
+        'elapsed_seconds': elapsed,
+        'events': events,
+        'events_per_second': events / elapsed if elapsed > 0 else 0.0,
+        'stage_seconds': stages,
+        'stage_shares': {stage: seconds / stage_total for stage, seconds in stages.items()} if stage_total > 0 else {},
+        'bound': bound,
+        'rpc_requests': by_label(snapshot, 'rpc_requests_total', 'method'),
+        'rpc_errors': by_label(snapshot, 'rpc_errors_total', 'status'),
+        'rpc_latency_seconds': histogram_summary(snapshot, 'rpc_latency_seconds'),
+        'logs_per_call': histogram_summary(snapshot, 'logs_per_call'),
+        'window_blocks': histogram_summary(snapshot, 'window_blocks'),
+        'retries': by_label(snapshot, 'retries_total', 'reason'),
+        'decode_seconds_per_1k_logs': stages.get('decode', 0.0) * 1000 / decoded if decoded else None,
+        'bytes_written': total(snapshot, 'bytes_written_total'),
+        'gauges': {key_text(key): value for key, value in snapshot['gauges'].items()},
+    }
+
+
+def prometheus_text(snapshot):
+    """The metrics in the Prometheus text exposition format."""
+    lines = []
+    typed = set()
+
+    def declare(name, kind):
+        if name not in typed:
+            typed.add(name)
+            lines.append(f"# TYPE {PREFIX}{name} {kind}")
+
+    for kind, values in (('counter', snapshot['counters']), ('gauge', snapshot['gauges'])):
+        for key in sorted(values, key=key_text):
+            declare(key[0], kind)
+            lines.append(f"{PREFIX}{key_text(key)} {values[key]}")
+    for key in sorted(snapshot['histograms'], key=key_text):
+        name, labels = key
+        histogram = snapshot['histograms'][key]
+        declare(name, 'histogram')
+        cumulative = 0
+        for bound, count in zip(histogram['buckets'], histogram['counts']):
+            cumulative += count
+            lines.append(f"{PREFIX}{key_text((name + '_bucket', labels + (('le', bound),)))} {cumulative}")
+        lines.append(f"{PREFIX}{key_text((name + '_bucket', labels + (('le', '+Inf'),)))} {histogram['count']}")
+        lines.append(f"{PREFIX}{key_text((name + '_sum', labels))} {histogram['sum']}")
+        lines.append(f"{PREFIX}{key_text((name + '_count', labels))} {histogram['count']}")
+    return '\n'.join(lines) + '\n'
+
+
+def write_file(path, text):
+    """Replace a file at once, a reader never sees it half written."""
+    tmp_file = f"{path}.tmp"
+    with open(tmp_file, 'w') as f:
+        f.write(text)
+    os.replace(tmp_file, path)
+
+
+class MetricsExporter:
+    """
+    Writes the metrics of a run to files and serves them over HTTP.
+
+    Args:
+        source (callable): Returns the current snapshot.
+        json_file (str): File of the JSON summary, not written if None.
+        prometheus_file (str): File of the Prometheus text, not written if None.
+        port (int): The Prometheus text is served on http://127.0.0.1:<port>/metrics if given.
+        interval (float): Seconds between two exports by maybe_export().
+    """
+    def __init__(self, source, json_file=None, prometheus_file=None, port=None, interval=INTERVAL):
+        self.source = source
+        self.json_file = json_file
+        self.prometheus_file = prometheus_file
+        self.interval = interval
+        self.started = time.monotonic()
+        self.exported = self.started
+        self.httpd = None
+        if port is not None:
+            self.httpd = ThreadingHTTPServer(('127.0.0.1', port), self.handler_class())
+            self.httpd.daemon_threads = True
+            threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def handler_class(self):
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                snapshot = exporter.source()
+                if self.path.startswith('/summary'):
+                    data, content_type = json.dumps(summarize(snapshot, exporter.elapsed()), default=str).encode(), 'application/json'
+                else:
+                    data, content_type = prometheus_text(snapshot).encode(), 'text/plain; version=0.0.4'
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def export(self):
+        """Write the files now, returns the summary."""
+        snapshot = self.source()
+        summary = summarize(snapshot, self.elapsed())
+        if self.json_file is not None:
+            write_file(self.json_file, json.dumps(summary, indent=2, default=str))
+        if self.prometheus_file is not None:
+            write_file(self.prometheus_file, prometheus_text(snapshot))
+        self.exported = time.monotonic()
+        return summary
+
+    def seconds_to_export(self):
+        """Seconds until maybe_export() writes the files."""
+        return max(0.0, self.interval - (time.monotonic() - self.exported))
+
+    def maybe_export(self):
+        """Write the files if the interval is over, returns the summary if they were."""
+        if time.monotonic() - self.exported < self.interval:
+            return None
+        return self.export()
+
+    def close(self):
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+
+
+def summary_line(summary):
+    """A one line digest of the summary for the logs."""
+    shares = ' '.join(f"{stage}={share:.0%}" for stage, share in summary['stage_shares'].items())
+    latency = summary['rpc_latency_seconds']
+    latency = f"{latency['mean']:.3f}s mean, p95 <= {latency['p95']}s" if latency else 'n/a'
+    return (f"{summary['events']} events, {summary['events_per_second']:.0f} events/s, "
+            f"time share: {shares or 'n/a'} ({summary['bound'] or 'n/a'} bound), "
+            f"rpc latency: {latency}, retries: {sum(summary['retries'].values())}")
+
+
+def start_reporter(send, interval=INTERVAL):
+    """Call send(snapshot) every interval seconds from a daemon thread, returns an event stopping it."""
+    stop = threading.Event()
+
+    def report():
+        while not stop.wait(interval):
+            send(METRICS.snapshot())
+    threading.Thread(target=report, daemon=True).start()
+    return stop
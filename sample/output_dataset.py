@@ -0,0 +1,188 @@
+"""Layout of an output made of a base Parquet file and its appended fragments.
+
+The first run writes <name>.parquet. Append runs never rewrite it, they write
+their rows as fragment files in <name>.parts/. Each file written by the
+trackers keeps the last block it covers in its footer, so resuming only reads
+the Parquet footers and never a data page. Only a reorganized chain tail makes
+the files covering it rewritten, see truncate_output, and the small fragments of
+frequent appends are merged once no reorganization can reach them, see
+merge_fragments.
+"""
+import glob
+import os
+import shutil
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from .parquet_writer import StreamingParquetWriter, FLUSH_ROWS
+from .address_index import AddressIndex, index_file, indexed_columns, remove_index
+
+LAST_BLOCK_KEY = 'last_block'
+
+
+def event_output_file(output_file, event_name):
+    """Output of one event when a tracker follows several: <name>.<event>.parquet"""
+    stem, extension = os.path.splitext(output_file)
+    return f"{stem}.{event_name}{extension}"
+
+
+def range_output_file(output_file, from_block, to_block):
+    """Output of another block range, named like output_file: <prefix>-<from-block>-<to-block>.parquet"""
+    stem, extension = os.path.splitext(output_file)
+    return f"{stem.rsplit('-', 2)[0]}-{from_block}-{to_block}{extension}"
+
+
+def fragment_dir(output_file):
+    return f"{os.path.splitext(output_file)[0]}.parts"
+
+
+def fragment_file(output_file, from_block, to_block):
+    return os.path.join(fragment_dir(output_file), f"{from_block}-{to_block}.parquet")
+
+
+def output_files(output_file):
+    """The base file and its fragments, in block order."""
+    files = [output_file] if os.path.exists(output_file) else []
+    fragments = glob.glob(os.path.join(fragment_dir(output_file), '*.parquet'))
+    fragments.sort(key=lambda path: int(os.path.basename(path).split('-')[0]))
+    return files + fragments
+
+
+def file_last_block(path):
+    """Last block covered by a file, from its footer only."""
+    metadata = pq.read_metadata(path)
+    key_value = metadata.metadata or {}
+    if LAST_BLOCK_KEY.encode() in key_value:
+        return int(key_value[LAST_BLOCK_KEY.encode()])
+
+    # older outputs: the max of the blockNumber statistics of the row groups
+    names = metadata.schema.names
+    if 'blockNumber' not in names or metadata.num_row_groups == 0:
+        return None
+    column = names.index('blockNumber')
+    last_block = None
+    for i in range(metadata.num_row_groups):
+        if metadata.row_group(i).num_rows == 0:
+            continue
+        chunk = metadata.row_group(i).column(column)
+        if not chunk.is_stats_set or not chunk.statistics.has_min_max:
+            # no statistics, read the blockNumber column alone
+            return int(pq.read_table(path, columns=['blockNumber']).column('blockNumber').to_pandas().astype(int).max())
+        block = int(chunk.statistics.max)
+        last_block = block if last_block is None else max(last_block, block)
+    return last_block
+
+
+def last_tracked_block(output_file):
+    """Last block covered by an output and its fragments, None if nothing was written."""
+    blocks = [b for b in (file_last_block(path) for path in output_files(output_file)) if b is not None]
+    return max(blocks) if blocks else None
+
+
+def fragment_range(path):
+    """(from_block, to_block) of a fragment file, from its name."""
+    from_block, to_block = os.path.splitext(os.path.basename(path))[0].split('-')
+    return int(from_block), int(to_block)
+
+
+def truncate_output(output_file, block):
+    """
+    Drop the rows of an output and its fragments after block.
+
+    Fragments starting after block are removed, the files covering block are
+    rewritten without the rows after it, the others are left untouched. The
+    address indexes of the files follow them.
+    """
+    for path in output_files(output_file):
+        last_block = file_last_block(path)
+        if last_block is not None and last_block <= block:
+            continue
+        target = path
+        if path != output_file:
+            from_block, _ = fragment_range(path)
+            if from_block > block:
+                os.remove(path)
+                remove_index(path)
+                continue
+            target = fragment_file(output_file, from_block, block)
+        parquet = pq.ParquetFile(path)
+        columns = indexed_columns(path)
+        index = AddressIndex(columns) if columns else None
+        # one row group at a time, as when appending
+        with StreamingParquetWriter(target, parquet.schema_arrow.remove_metadata(), index=index) as writer:
+            for i in range(parquet.num_row_groups):
+                table = parquet.read_row_group(i)
+                writer.write(table.filter(pc.less_equal(table['blockNumber'], block)))
+            writer.metadata[LAST_BLOCK_KEY] = block
+        if target != path:
+            os.remove(path)
+            remove_index(path)
+
+
+def rename_output(output_file, new_output_file, to_block=None):
+    """
+    Move an output and its fragments, with their address indexes, to another name.
+
+    The fragments are renamed to end by to_block at the latest when it is given,
+    e.g. when the range of the output is cut short.
+    """
+    for path in output_files(output_file):
+        target = new_output_file
+        if path != output_file:
+            from_block, last_block = fragment_range(path)
+            target = fragment_file(new_output_file, from_block, last_block if to_block is None else min(last_block, to_block))
+        os.makedirs(os.path.dirname(os.path.abspath(target)), exist_ok=True)
+        os.replace(path, target)
+        if os.path.exists(index_file(path)):
+            os.makedirs(os.path.dirname(index_file(target)), exist_ok=True)
+            os.replace(index_file(path), index_file(target))
+    if os.path.isdir(fragment_dir(output_file)):
+        shutil.rmtree(fragment_dir(output_file))
+
+
+def merge_fragments(output_file, to_block, min_fragments=2, max_rows=FLUSH_ROWS):
+    """
+    Merge the consecutive fragments of an output ending by to_block with fewer than max_rows rows each.
+
+    Nothing is merged until there are min_fragments such fragments. Each run of
+    them is rewritten as one fragment covering their blocks, with its address
+    index, so that frequent appends do not leave a file each.
+
+    Returns:
+        list: The fragments written.
+    """
+    runs = [[]]
+    for path in output_files(output_file):
+        if path == output_file:
+            continue
+        if fragment_range(path)[1] <= to_block and pq.read_metadata(path).num_rows < max_rows:
+            runs[-1].append(path)
+        elif runs[-1]:
+            runs.append([])
+    runs = [run for run in runs if len(run) > 1]
+    if sum(len(run) for run in runs) < min_fragments:
+        return []
+
+    merged = []
+    for run in runs:
+        from_block, last_block = fragment_range(run[0])[0], fragment_range(run[-1])[1]
+        columns = indexed_columns(run[0])
+        index = AddressIndex(columns) if columns else None
+        # one row group at a time, as when appending
+        with StreamingParquetWriter(fragment_file(output_file, from_block, last_block), pq.read_schema(run[0]).remove_metadata(),
+                                    max_rows, index=index) as writer:
+            for path in run:
+                parquet = pq.ParquetFile(path)
+                for i in range(parquet.num_row_groups):
+                    writer.write(parquet.read_row_group(i))
+            writer.metadata[LAST_BLOCK_KEY] = last_block
+        for path in run:
+            os.remove(path)
+            remove_index(path)
+        merged.append(writer.output_file)
+    return merged
+
+
+def read_output(output_file, columns=None):
+    """Read the base file and its fragments as one table."""
+    return ds.dataset(output_files(output_file), format='parquet').to_table(columns=columns)
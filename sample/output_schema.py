@@ -0,0 +1,91 @@
+"""Arrow schema of the tracker output, driven by the Solidity event types.
+
+Integers up to 64 bits are stored as native Arrow integers. Wider integers
+(uint256, int256, ...) are stored as 32 bytes big-endian fixed_size_binary,
+which holds any of them, as decimal256(76, 0), which cannot hold values of 77
+digits such as unlimited approvals, or as strings like older outputs. Addresses are stored as
+checksummed strings or as 20 bytes fixed_size_binary.
+"""
+import re
+import numpy as np
+import pyarrow as pa
+
+WIDE_INT_FORMATS = ('decimal', 'binary', 'string')
+ADDRESS_FORMATS = ('string', 'binary')
+
+# decimal256 holds up to 76 digits
+DECIMAL_LIMIT = 10 ** 76
+INT_TYPE = re.compile(r'^(u?)int(\d*)$')
+BYTES_TYPE = re.compile(r'^bytes(\d+)$')
+
+
+def arrow_type(abi_type, wide_int='binary', address='string'):
+    """Arrow type used to store a parameter of Solidity type abi_type."""
+    match = INT_TYPE.match(abi_type)
+    if match:
+        unsigned = match.group(1) == 'u'
+        bits = int(match.group(2) or 256)
+        if bits <= 64:
+            width = next(w for w in (8, 16, 32, 64) if bits <= w)
+            return getattr(pa, f"{'u' if unsigned else ''}int{width}")()
+        if wide_int == 'decimal':
+            return pa.decimal256(76, 0)
+        if wide_int == 'binary':
+            return pa.binary(32)
+        return pa.string()
+    if abi_type == 'address':
+        return pa.binary(20) if address == 'binary' else pa.string()
+    if abi_type == 'bool':
+        return pa.bool_()
+    match = BYTES_TYPE.match(abi_type)
+    if match:
+        return pa.binary(int(match.group(1)))
+    if abi_type == 'bytes':
+        return pa.binary()
+    # strings, arrays and tuples keep their text representation
+    return pa.string()
+
+
+def build_schema(event, wide_int='binary', address='string', with_address=False):
+    """Output schema for an event parsed by parse_solidity_event."""
+    return pa.schema(
+        [('blockNumber', pa.int64()), ('transactionHash', pa.binary())]
+        + ([('address', arrow_type('address', wide_int, address))] if with_address else [])
+        + [(field, arrow_type(abi_type, wide_int, address)) for field, abi_type in zip(event['fields'], event['types'])]
+    )
+
+
+def _wide_int_bytes(values, byteorder):
+    out = []
+    for v in values:
+        v = int(v)
+        if not -DECIMAL_LIMIT < v < DECIMAL_LIMIT and byteorder == 'little':
+            raise ValueError(f"{v} does not fit decimal256(76, 0), use the binary format for wide integers")
+        # two's complement for signed values, unsigned values above 2**255 only fit as unsigned
+        out.append(v.to_bytes(32, byteorder, signed=v < 0))
+    return b''.join(out)
+
+
+def to_arrow_array(values, arrow_type):
+    """
+    Build the Arrow array of one output column.
+
+    Args:
+        values (np.ndarray): The decoded values, NumPy integers or Python objects.
+        arrow_type (pa.DataType): Type of the column in the output schema.
+    """
+    n = len(values)
+    if pa.types.is_decimal(arrow_type):
+        # decimal256 is stored as 32 bytes little-endian two's complement
+        return pa.Array.from_buffers(arrow_type, n, [None, pa.py_buffer(_wide_int_bytes(values, 'little'))])
+    if pa.types.is_fixed_size_binary(arrow_type):
+        if arrow_type.byte_width == 32 and n and not isinstance(values[0], (bytes, str)):
+            return pa.Array.from_buffers(arrow_type, n, [None, pa.py_buffer(_wide_int_bytes(values, 'big'))])
+        return pa.array([bytes.fromhex(v[2:]) if isinstance(v, str) else bytes(v) for v in values], arrow_type)
+    if pa.types.is_string(arrow_type):
+        return pa.array([str(v) for v in values], arrow_type)
+    if pa.types.is_binary(arrow_type):
+        return pa.array([bytes(v) for v in values], arrow_type)
+    if pa.types.is_integer(arrow_type) and isinstance(values, np.ndarray) and values.dtype == object:
+        values = values.astype(np.uint64 if pa.types.is_unsigned_integer(arrow_type) else np.int64)
+    return pa.array(values, arrow_type)
@@ -1,33 +1,188 @@
-import subprocess
-import os
+import multiprocessing
 import os
+import re
 from web3 import Web3
 from tqdm import tqdm
 import argparse
 from .logger import setup_logging, logging
-import time
 from datetime import datetime
 from .log_filters import retry_on_error
+from .process_event_tracker import EventTracker, EventTrackerConfig, run_worker, format_stages, STAGES
+from .parquet_writer import FLUSH_ROWS, FLUSH_BYTES
+from .output_schema import WIDE_INT_FORMATS, ADDRESS_FORMATS
+from .enrichment import ENRICH_COLUMNS
+from .rate_limiter import RateLimiter
+from .http_transport import CONNECT_TIMEOUT, READ_TIMEOUT
+from .run_manifest import RunManifest, file_digest, DONE, PARTIAL, FAILED
+from .output_dataset import range_output_file, truncate_output
+from .density_planner import DensityPlanner, SAMPLES
+from .compaction import compact, default_dataset_dir, PARTITION_BY
+from .metrics import METRICS, MetricsExporter, merge, summary_line, INTERVAL as METRICS_INTERVAL
+from .worker_pool import WorkerPool
+
+# ranges planned per worker when --partitions is not given, the idle workers split the longest ones
+PARTITIONS_PER_CORE = 4
+# workers started in place of those that died, per worker of the run
+RESTARTS_PER_WORKER = 2
 
 def parse_arguments():
     parser = argparse.ArgumentParser(description="Parallel Event Tracker Configuration")
-    parser.add_argument('-n', '--contract-file', type=str, required=True, help='Contract ABI file path')
-    parser.add_argument('-a', '--contract-address', type=str, required=True, help='Contract address')
-    parser.add_argument('-e', '--event-file', type=str, required=True, help='Event file path')
+    parser.add_argument('-n', '--contract-file', type=str, nargs='+', required=True, help='Contract ABI file path, several files are merged')
+    parser.add_argument('-a', '--contract-address', type=str, nargs='+', required=True, help='Contract address, or several addresses tracked in the same requests')
+    parser.add_argument('-e', '--event-file', type=str, nargs='+', required=True, help='Event file path, or several events tracked in the same requests')
     parser.add_argument('-f', '--from-block', type=int, default=None, help='Starting block number (optional)')
     parser.add_argument('-t', '--to-block', type=int, default=None, help='Stopping block number (optional)')
     parser.add_argument('-p', '--append', action="store_true", help='Append to existing output (optional)')
-    parser.add_argument('-c', '--cores', type=int, default=4, help='Number of cores to allocate to subprocesses (optional)')
-    parser.add_argument('-r', "--rpc", type=str, required=True, help="the rpc connection")
+    parser.add_argument('-c', '--cores', type=int, default=4, help='Number of worker processes (optional)')
+    parser.add_argument('-r', "--rpc", type=str, nargs='+', required=True, help="the rpc connection, or several endpoints used as a pool")
+    parser.add_argument('--rpc-weights', type=float, nargs='+', default=None, help='Relative share of the requests of each rpc endpoint (optional)')
+    parser.add_argument('--connect-timeout', type=float, default=CONNECT_TIMEOUT, help='Seconds to wait for a connection to the rpc (optional)')
+    parser.add_argument('--read-timeout', type=float, default=READ_TIMEOUT, help='Seconds to wait for an rpc answer (optional)')
+    parser.add_argument('--pool-size', type=int, default=None, help='Connections kept open by each worker to each rpc endpoint, defaults to --in-flight, so a run keeps up to --cores times --in-flight (optional)')
+    parser.add_argument('--http2', action="store_true", help='Use HTTP/2, needs httpx[http2] (optional)')
+    parser.add_argument('--web3-logs', action="store_true", help='Fetch the logs through web3 instead of the raw JSON-RPC fast path (optional)')
     parser.add_argument('-l', '--log-dir', type=str, default=None, help='Path to the log file')
     parser.add_argument('-o', '--output-dir', type=str, required=True, help='The directory where to store the output')
     parser.add_argument('-x', '--output-prefix', type=str, required=True, help='the prefix the output files will use')
+    parser.add_argument('-m', '--manifest', type=str, default=None, help='SQLite file recording the status of each block range, defaults to the output directory (optional)')
+    parser.add_argument('--plan', action="store_true", help='Cut the block range in ranges of about the same number of events, from a pre-scan of the event density (optional)')
+    parser.add_argument('--partitions', type=int, default=None, help='Number of ranges planned with --plan, defaults to 4 per core (optional)')
+    parser.add_argument('--plan-samples', type=int, default=SAMPLES, help='Number of block windows counted by the pre-scan (optional)')
+    parser.add_argument('--dry-run', action="store_true", help='Print the ranges with their estimated events, RPC calls and time, and exit (optional)')
+    parser.add_argument('--retries', type=int, default=1, help='Number of times a failed block range is queued again during the run (optional)')
+    parser.add_argument('--metrics-file', type=str, default=None, help='JSON file of the metrics summary of all the workers, rewritten periodically, defaults to the output directory (optional)')
+    parser.add_argument('--prometheus-file', type=str, default=None, help='File of the metrics in the Prometheus text format, rewritten periodically, defaults to the output directory (optional)')
+    parser.add_argument('--metrics-port', type=int, default=None, help='Serve the metrics on http://127.0.0.1:<port>/metrics (optional)')
+    parser.add_argument('--metrics-interval', type=float, default=METRICS_INTERVAL, help='Seconds between two exports of the metrics (optional)')
+    parser.add_argument('--compact', action="store_true", help='Compact the range outputs into a partitioned dataset at the end, <output-dir>/_<output-prefix>.dataset (optional)')
+    parser.add_argument('--partition-by', type=str, choices=PARTITION_BY, default='blocks', help='Partitions of the compacted dataset, buckets of blocks or months of the block timestamps (optional)')
+    parser.add_argument('-s', '--range-state', type=str, default=None, help='JSON file where the learned block window per contract is kept, defaults to the output directory (optional)')
+    parser.add_argument('-b', '--batch-size', type=int, default=1, help='Number of block windows sent in a single JSON-RPC batch request (optional)')
+    parser.add_argument('-i', '--in-flight', type=int, default=1, help='Number of concurrent get_logs requests inside each worker (optional)')
+    parser.add_argument('--flush-rows', type=int, default=FLUSH_ROWS, help='Number of buffered rows written as a Parquet row group (optional)')
+    parser.add_argument('--flush-bytes', type=int, default=FLUSH_BYTES, help='Number of buffered bytes written as a Parquet row group (optional)')
+    parser.add_argument('--wide-int', type=str, choices=WIDE_INT_FORMATS, default='binary', help='Storage of integers wider than 64 bits: 32 bytes binary, decimal256 or string (optional)')
+    parser.add_argument('--address-format', type=str, choices=ADDRESS_FORMATS, default='string', help='Storage of addresses: checksummed string or 20 bytes binary (optional)')
+    parser.add_argument('--cache-dir', type=str, default=None, help='Directory caching the raw logs of finalized blocks, shared by the workers (optional)')
+    parser.add_argument('--enrich', type=str, nargs='+', choices=ENRICH_COLUMNS, default=None, help='Block and transaction columns added to the events (optional)')
+    parser.add_argument('--chain-store', type=str, default=None, help='SQLite file keeping the fetched block timestamps and transactions, defaults to the output directory (optional)')
+    parser.add_argument('--requests-per-second', type=float, default=None, help='Maximum number of requests sent to the provider per second by all the workers together (optional)')
+    parser.add_argument('--compute-units-per-second', type=float, default=None, help='Maximum number of provider compute units spent per second by all the workers together (optional)')
 
     return parser.parse_args()
 
+def fixed_ranges(start_block, end_block, size):
+    """Ranges of size blocks aligned on multiples of size, the first and last ones may be shorter."""
+    ranges = []
+    first_end = (start_block // size + 1) * size - 1
+    current_start_block = start_block
+    while current_start_block <= end_block:
+        current_end_block = min(first_end if current_start_block == start_block else current_start_block + size - 1, end_block)
+        ranges.append((current_start_block, current_end_block))
+        current_start_block = current_end_block + 1
+    return ranges
+
+
+def migrate_range_names(output_dir, prefix, size, manifest):
+    """
+    Rename the outputs of older runs, whose ranges ended on the first block of the next one.
+
+    <prefix>-<s>-<s + size>.parquet is rewritten without its last block, which the
+    next range holds too, as <prefix>-<s>-<s + size - 1>.parquet, the name of its
+    range now, so that it is appended to instead of being left next to a new output.
+
+    Returns:
+        list: The (old, new) paths of the outputs renamed.
+    """
+    pattern = re.compile(rf'^{re.escape(prefix)}-(\d+)-(\d+)\.parquet$')
+    # the ranges of the manifest and the pieces they were split into already have the new names
+    known = {path for record in manifest.ranges(0, 2 ** 63 - 1) for path in [record['output_file']] + record['files']}
+    renamed = []
+    for name in sorted(os.listdir(output_dir)):
+        match = pattern.match(name)
+        if match is None:
+            continue
+        from_block, to_block = int(match.group(1)), int(match.group(2))
+        path = f'{output_dir}/{name}'
+        new_path = f'{output_dir}/{prefix}-{from_block}-{to_block - 1}.parquet'
+        if to_block % size != 0 or not 0 < to_block - from_block <= size or path in known or os.path.exists(new_path):
+            continue
+        truncate_output(path, to_block - 1)
+        os.replace(path, new_path)
+        renamed.append((path, new_path))
+    return renamed
+
+
+def plan_ranges(profile, start_block, end_block, n_parts, kept=()):
+    """
+    Ranges of about the same number of events over [start_block, end_block].
+
+    The kept ranges are left as they are, the blocks they do not cover get a
+    share of the n_parts ranges in proportion to their events.
+    """
+    ranges = sorted(kept)
+    gaps = []
+    start = start_block
+    for a, b in ranges:
+        if a > start:
+            gaps.append((start, a - 1))
+        start = max(start, b + 1)
+    if start <= end_block:
+        gaps.append((start, end_block))
+
+    total = profile.events(start_block, end_block)
+    for a, b in gaps:
+        share = profile.events(a, b) / total if total > 0 else (b - a + 1) / (end_block - start_block + 1)
+        ranges += profile.partition(a, b, max(1, round(n_parts * share)))
+    return sorted(ranges)
+
+
+def print_estimate(estimate, skipped=0):
+    """Print the plan of a dry run."""
+    for r in estimate['ranges']:
+        print(f"{r['from_block']:>10} {r['to_block']:>10} {r['blocks']:>10} blocks {r['events']:>10} events {r['calls']:>7} calls {r['seconds']:>9.1f}s")
+    if skipped:
+        print(f"{skipped} block ranges already done are skipped")
+    print(f"{len(estimate['ranges'])} block ranges, {estimate['events']} events, {estimate['calls']} get_logs calls "
+          f"in {estimate['requests']} requests, {estimate['compute_units']} compute units, about {estimate['seconds']:.0f}s")
+
+
+def remove_split_outputs(manifest, output_file):
+    """Remove the pieces left by an earlier split of a range, which is tracked again as a whole."""
+    record = manifest.get(output_file)
+    if record is None:
+        return
+    own = os.path.splitext(output_file)[0] + '.'
+    for path in record['files']:
+        if not path.startswith(own) and os.path.exists(path):
+            os.remove(path)
+
+
+def record_range(manifest, output_file, results, error):
+    """
+    Store in the manifest the outcome of a range, once all its pieces are settled.
+
+    A split range is only done if all its pieces are, the pieces of a range
+    that is not are tracked again as a whole by the next run.
+    """
+    results.sort(key=lambda result: result[0])
+    statuses = [status for _, status, _ in results]
+    files = [path for _, _, details in results for path in details['files']]
+    rows = sum(details['rows'] or 0 for _, _, details in results)
+    if len(results) == 1:
+        details = results[0][2]
+        manifest.record(output_file, statuses[0], details['rows'], details['last_block'], files, details['size'], details['checksum'], error)
+        return
+    status = DONE if all(status == DONE for status in statuses) else FAILED
+    try:
+        size, checksum = file_digest(files)
+    except OSError:
+        size, checksum = None, None
+    last_block = results[-1][2]['last_block'] if status == DONE else None
+    manifest.record(output_file, status, rows, last_block, files, size, checksum, error)
+
+
 def main():   
-    # Determine the directory of the current script
-    script_dir = os.path.dirname(os.path.abspath(__file__))
     args = parse_arguments()
 
     # set up log
@@ -45,77 +200,325 @@ def main():
     # Define the block range size
     BLOCK_RANGE_SIZE = 50000
 
+    # the workers share what they learn about the event density
+    range_state_file = args.range_state if args.range_state is not None else os.path.join(args.output_dir, '.range_state.json')
+    # and the block timestamps and transactions they fetched
+    chain_store = args.chain_store if args.chain_store is not None else os.path.join(args.output_dir, '.chain_store.sqlite')
+    # and the status of every range, completed ranges are not queued again in append mode
+    manifest = RunManifest(args.manifest if args.manifest is not None else os.path.join(args.output_dir, '.manifest.sqlite'))
+
     # Establish a Web3 connection
-    w3 = Web3(Web3.HTTPProvider(args.rpc, request_kwargs={'timeout': 40}))
-    logger.info(f'Chain connected?: {retry_on_error(w3.is_connected())})')
+    w3 = Web3(Web3.HTTPProvider(args.rpc[0], request_kwargs={'timeout': 40}))
+    logger.info(f'Chain connected?: {retry_on_error()(w3.is_connected)()}')
     # Get the latest block number
     latest_block = w3.eth.block_number
 
-    logger.info(f"Arguments received: contract_file={args.contract_file}, contract_address={args.contract_address}, event_file={args.event_file}, from_block={args.from_block}, to_block={args.to_block}, append={args.append}, cores={args.cores}, rpc={args.rpc}, log_dir={args.log_dir}, output_dir={args.output_dir}, output_prefix={args.output_prefix}")
+    logger.info(f"Arguments received: contract_file={args.contract_file}, contract_address={args.contract_address}, event_file={args.event_file}, from_block={args.from_block}, to_block={args.to_block}, append={args.append}, cores={args.cores}, rpc={args.rpc}, batch_size={args.batch_size}, in_flight={args.in_flight}, log_dir={args.log_dir}, output_dir={args.output_dir}, output_prefix={args.output_prefix}")
+    logger.info(f"Up to {args.cores * (args.pool_size or args.in_flight)} connections to each rpc endpoint, {args.pool_size or args.in_flight} per worker")
 
     # Determine the starting and ending blocks
     start_block = args.from_block if args.from_block is not None else 0
     end_block = args.to_block if args.to_block is not None else latest_block
 
-    # Adjust the first batch if start_block is not a multiple of BLOCK_RANGE_SIZE
-    first_batch_end = ((start_block // BLOCK_RANGE_SIZE) + 1) * BLOCK_RANGE_SIZE if start_block % BLOCK_RANGE_SIZE != 0 else start_block + BLOCK_RANGE_SIZE
+    def range_file(from_block, to_block):
+        return f'{args.output_dir}/{args.output_prefix}-{from_block}-{to_block}.parquet'
+
+    for old_path, new_path in migrate_range_names(args.output_dir, args.output_prefix, BLOCK_RANGE_SIZE, manifest):
+        logger.info(f"Renamed {old_path} of an older run to {new_path}, without its last block held by the next range")
+
+    context = multiprocessing.get_context('spawn')
+    # one budget of requests for all the workers
+    rate_limiter = None
+    if args.requests_per_second or args.compute_units_per_second:
+        rate_limiter = RateLimiter(args.requests_per_second, args.compute_units_per_second, context=context)
+
+    # the workers load contract, decoder and sessions once and then pull
+    # block ranges from the shared queue until they receive None
+    config = EventTrackerConfig(
+        args.contract_file,
+        args.contract_address,
+        args.event_file,
+        None,
+        None,
+        args.append,
+        None,
+        None,
+        args.rpc,
+        range_state_file,
+        args.batch_size,
+        args.in_flight,
+        args.flush_rows,
+        args.flush_bytes,
+        args.wide_int,
+        args.address_format,
+        args.cache_dir,
+        args.enrich,
+        chain_store,
+        rate_limiter,
+        args.rpc_weights,
+        args.connect_timeout,
+        args.read_timeout,
+        args.pool_size,
+        args.http2,
+        not args.web3_logs
+    )
 
     logger.info(f"Starting block processing from start_block={start_block} to end_block={end_block}")
-    processes = []
-    active_processes = []
+    profile = None
+    if args.plan or args.dry_run:
+        planner = DensityPlanner(EventTracker(config), args.plan_samples)
+        # the ranges of earlier runs of this output give their event count exactly
+        records = [r for r in manifest.ranges(start_block, end_block) if r['output_file'] == range_file(r['from_block'], r['to_block'])]
+        known = [(r['from_block'], r['to_block'], r['rows']) for r in records if r['status'] == DONE and r['rows'] is not None]
+        profile = planner.profile(start_block, end_block, known)
+        logger.info(f"Pre-scan of the event density: {planner.calls} get_logs calls, {profile.events(start_block, end_block):.0f} events expected")
 
+    if args.plan:
+        n_parts = args.partitions if args.partitions is not None else args.cores * PARTITIONS_PER_CORE
+        # appending keeps the ranges of the earlier runs, only the blocks they do not cover are planned
+        kept = [(r['from_block'], r['to_block']) for r in records] if args.append else []
+        ranges = plan_ranges(profile, start_block, end_block, n_parts, kept)
+    else:
+        ranges = fixed_ranges(start_block, end_block, BLOCK_RANGE_SIZE)
 
-    for current_start_block in tqdm(range(start_block, end_block, BLOCK_RANGE_SIZE), desc="Processing blocks"):
-        # Calculate current end block
-        if current_start_block == start_block and start_block % BLOCK_RANGE_SIZE != 0:
-            current_end_block = min(first_batch_end, end_block)
-        else:
-            current_end_block = min(current_start_block + BLOCK_RANGE_SIZE, end_block)
-
-        logger.info(f"Processing block range: current_start_block={current_start_block}, current_end_block={current_end_block}")
-        cmd = [
-            'python', os.path.join(script_dir, 'process_event_tracker.py'),
-            '-n', args.contract_file,
-            '-a', args.contract_address,
-            '-e', args.event_file,
-            '-f', str(current_start_block),
-            '-t', str(current_end_block),
-            '-r', args.rpc
-        ]
+    tasks = []
+    for current_start_block, current_end_block in ranges:
         log_file = f"{log_dir}/job_from_{current_start_block}_to_{current_end_block}.log"
-        cmd.extend(['-l', log_file])
-        cmd.extend(['-o', f'{args.output_dir}/{args.output_prefix}-{current_start_block}-{current_end_block}.parquet'])
-        if args.append:    
-            cmd.append('-p')
-
-        logger.info(f"Prepared command: {' '.join(cmd)}")
-
-        # Wait if we've reached the core limit
-        while len(active_processes) >= args.cores:
-            # Check all active processes
-            for proc in active_processes[:]:  # Create a copy to iterate over
-                if proc.poll() is not None:  # Process has finished
-                    active_processes.remove(proc)
-            time.sleep(0.1)  # Short sleep to prevent CPU spinning
-
-        # Start new process
-        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        active_processes.append(process)
-        processes.append(process)
-
-    while active_processes:
-        for proc in active_processes[:]:  # Create a copy to iterate over
-            if proc.poll() is not None:
-                active_processes.remove(proc)
-        time.sleep(0.1)
-
-    # Check for any errors in the completed processes
-    for process in processes:
-        stdout, stderr = process.communicate()
-        if process.returncode != 0:
-            logger.info(f"Process failed with return code {process.returncode}")
-            logger.info(f"stderr: {stderr.decode()}")
+        output_file = range_file(current_start_block, current_end_block)
+        if args.append and manifest.is_done(output_file):
+            continue
+        record = manifest.get(output_file) if args.append else None
+        if record is not None and record['status'] == PARTIAL and record['last_block'] is not None:
+            # the worker appends after the blocks committed by the last attempt
+            logger.info(f"Resuming {output_file} after block {record['last_block']}, {record['rows']} rows kept")
+        tasks.append((current_start_block, current_end_block, output_file, log_file, args.append))
+
+    if args.dry_run:
+        estimate = planner.estimate(profile, [task[:2] for task in tasks], args.cores, args.in_flight, args.batch_size,
+                                    args.requests_per_second, args.compute_units_per_second)
+        print_estimate(estimate, len(ranges) - len(tasks))
+        manifest.close()
+        return
+
+    if args.plan and not args.append:
+        # the outputs of an earlier plan would overlap the new ranges
+        planned = {range_file(a, b) for a, b in ranges}
+        for record in records:
+            if record['output_file'] not in planned:
+                logger.info(f"Removing {record['output_file']}, replaced by the new ranges")
+                for path in set(record['files']) | {record['output_file']}:
+                    if os.path.exists(path):
+                        os.remove(path)
+                manifest.remove(record['output_file'])
+    for task in tasks:
+        remove_split_outputs(manifest, task[2])
+
+    manifest.schedule([(task[0], task[1], task[2]) for task in tasks])
+    logger.info(f"{len(tasks)} block ranges to process, manifest: {manifest.summary()}")
+    if not tasks:
+        logger.info("All the block ranges are already done.")
+        if args.compact:
+            rewritten = compact(args.output_dir, args.output_prefix, partition_by=args.partition_by)
+            logger.info(f"Compacted into {default_dataset_dir(args.output_dir, args.output_prefix)}, {len(rewritten)} partitions rewritten: {rewritten}")
+        return
+
+    task_queue = context.Queue()
+    for task in tasks:
+        task_queue.put(task)
+    # ranges queued and not taken by a worker yet
+    waiting = len(tasks)
+    # the ranges by (from_block, to_block), a split range is replaced by its two pieces
+    ranges = {(task[0], task[1]): task for task in tasks}
+    attempts = {key: 0 for key in ranges}
+    # the manifest range each piece belongs to, and the results of its pieces
+    manifest_ranges = {key: task[2] for key, task in ranges.items()}
+    piece_results = {task[2]: [] for task in tasks}
+    open_pieces = {task[2]: 1 for task in tasks}
+
+    # more workers than ranges still helps, the ranges are split for them
+    n_workers = args.cores
+    # set by the scheduler to ask a worker for the tail of its range
+    split_requests = context.RawArray('b', n_workers)
+    running = {}
+    not_splittable = set()
+    # blocks written and events found by the running ranges, from their progress messages
+    written = {}
+    # last block and rows committed by the running ranges, a killed worker is resumed from there
+    checkpoints = {}
+    total_blocks = sum(task[1] - task[0] + 1 for task in tasks)
+    finished_blocks, finished_events = 0, 0
+    # the last metrics of each worker, merged with those of the scheduler on export
+    worker_metrics = {}
+    exporter = MetricsExporter(
+        lambda: merge(list(worker_metrics.values()) + [METRICS.snapshot()]),
+        args.metrics_file if args.metrics_file is not None else os.path.join(args.output_dir, '.metrics.json'),
+        args.prometheus_file if args.prometheus_file is not None else os.path.join(args.output_dir, '.metrics.prom'),
+        args.metrics_port,
+        args.metrics_interval
+    )
+    # the scheduler wakes up on any message or exit of a worker
+    pool = WorkerPool(context, run_worker, lambda worker_id, sender: (
+        config, f"{log_dir}/worker_{worker_id}.log", task_queue, sender, worker_id, split_requests, args.metrics_interval
+    ))
+    for worker_id in range(n_workers):
+        pool.start(worker_id)
+
+    failed = []
+    # seconds spent in each stage by all the workers
+    stages = dict.fromkeys(STAGES, 0.0)
+    done = 0
+
+    def finish(from_block, to_block, events, error, details):
+        """Record the end of a range, or queue it again if it failed and has retries left."""
+        nonlocal done, waiting, finished_blocks, finished_events
+        for stage, seconds in details['stages'].items():
+            stages[stage] += seconds
+        task = ranges[(from_block, to_block)]
+        status = DONE if error is None else PARTIAL if details['last_block'] is not None else FAILED
+        if error is not None and attempts[(from_block, to_block)] < args.retries:
+            attempts[(from_block, to_block)] += 1
+            logger.info(f"Block range {from_block} to {to_block} failed: {error}, queued again")
+            # a partial range resumes after the blocks it kept
+            task_queue.put(task[:4] + (task[4] or status == PARTIAL,))
+            waiting += 1
+            return
+        done += 1
+        if error is None:
+            finished_blocks += to_block - from_block + 1
+            finished_events += events
+        progress.update(1)
+        output_file = manifest_ranges[(from_block, to_block)]
+        piece_results[output_file].append((from_block, status, details))
+        open_pieces[output_file] -= 1
+        if open_pieces[output_file] == 0:
+            record_range(manifest, output_file, piece_results[output_file], error)
+        if error is None:
+            logger.info(f"Finished block range {from_block} to {to_block} with {events} events")
+        else:
+            failed.append((from_block, to_block))
+            logger.info(f"Block range {from_block} to {to_block} failed: {error}")
+
+    with tqdm(total=len(tasks), desc="Processing blocks") as progress:
+        while done < progress.total:
+            messages, exited = pool.wait(exporter.seconds_to_export())
+            for message in messages:
+                if message[0] == 'metrics':
+                    _, worker_id, snapshot = message
+                    worker_metrics[worker_id] = snapshot
+
+                elif message[0] == 'progress':
+                    _, worker_id, from_block, to_block, written_block, events = message
+                    written[worker_id] = (written_block - from_block + 1, events)
+
+                elif message[0] == 'checkpoint':
+                    _, worker_id, from_block, to_block, last_block, rows = message
+                    checkpoints[(from_block, to_block)] = (last_block, rows)
+                    # the pieces of a split range are tracked again as a whole by the next run
+                    if (from_block, to_block) in ranges and ranges[(from_block, to_block)][2] == manifest_ranges[(from_block, to_block)]:
+                        manifest.checkpoint(manifest_ranges[(from_block, to_block)], last_block, rows)
+
+                elif message[0] == 'started':
+                    _, worker_id, from_block, to_block = message
+                    waiting -= 1
+                    running[worker_id] = (from_block, to_block)
+
+                elif message[0] == 'split':
+                    _, worker_id, from_block, to_block, new_to_block = message
+                    if new_to_block is None:
+                        not_splittable.add((from_block, to_block))
+                        continue
+                    # the worker keeps the head of its range, the tail goes back to the queue
+                    task = ranges.pop((from_block, to_block))
+                    output_file = manifest_ranges.pop((from_block, to_block))
+                    head = (from_block, new_to_block, range_output_file(task[2], from_block, new_to_block), task[3], task[4])
+                    tail = (new_to_block + 1, to_block, range_output_file(task[2], new_to_block + 1, to_block),
+                            f"{log_dir}/job_from_{new_to_block + 1}_to_{to_block}.log", False)
+                    attempts[head[:2]] = attempts.pop((from_block, to_block))
+                    if (from_block, to_block) in checkpoints:
+                        checkpoints[head[:2]] = checkpoints.pop((from_block, to_block))
+                    attempts[tail[:2]] = 0
+                    for piece in (head, tail):
+                        ranges[piece[:2]] = piece
+                        manifest_ranges[piece[:2]] = output_file
+                    open_pieces[output_file] += 1
+                    running[worker_id] = head[:2]
+                    task_queue.put(tail)
+                    waiting += 1
+                    progress.total += 1
+                    progress.refresh()
+                    logger.info(f"Block range {from_block} to {to_block} split after block {new_to_block}")
+
+                else:
+                    _, worker_id, from_block, to_block, events, error, details = message
+                    running.pop(worker_id, None)
+                    written.pop(worker_id, None)
+                    checkpoints.pop((from_block, to_block), None)
+                    split_requests[worker_id] = 0
+                    finish(from_block, to_block, events, error, details)
+
+            # a worker only exits on its own once the queue is closed, its range is failed
+            # and another worker takes its place right away
+            for worker_id, exitcode in exited:
+                split_requests[worker_id] = 0
+                written.pop(worker_id, None)
+                key = running.pop(worker_id, None)
+                logger.info(f"Worker {worker_id} exited with code {exitcode}" + (f" while tracking blocks {key[0]} to {key[1]}" if key else ""))
+                if key is not None:
+                    # the range is partial if its worker committed some blocks before exiting
+                    last_block, rows = checkpoints.pop(key, (None, None))
+                    finish(key[0], key[1], 0, f"worker exited with code {exitcode}",
+                           {'last_block': last_block, 'rows': rows, 'files': [], 'size': None, 'checksum': None, 'stages': {}})
+                if done < progress.total and pool.started < n_workers * (1 + RESTARTS_PER_WORKER):
+                    pool.start(worker_id)
+            if not len(pool):
+                logger.info(f"All workers exited with {progress.total - done} block ranges not reported")
+                break
+
+            blocks = finished_blocks + sum(b for b, _ in written.values())
+            events = finished_events + sum(e for _, e in written.values())
+            progress.set_postfix_str(f"{blocks}/{total_blocks} blocks, {events} events")
+
+            # once the queue is empty, idle workers take over the tail of the running ranges
+            alive = len(pool)
+            METRICS.set('ranges_waiting', waiting)
+            METRICS.set('ranges_running', len(running))
+            METRICS.set('ranges_done', done)
+            METRICS.set('workers_alive', alive)
+            summary = exporter.maybe_export()
+            if summary is not None:
+                logger.info(f"Metrics: {summary_line(summary)}")
+            requested = sum(split_requests[worker_id] for worker_id in running)
+            idle = alive - len(running) - waiting - requested
+            if waiting == 0 and idle > 0:
+                candidates = [w for w, key in running.items() if not split_requests[w] and key not in not_splittable]
+                for worker_id in candidates[:idle]:
+                    split_requests[worker_id] = 1
+
+    # the workers exit once the queue is drained, their last metrics are read until then
+    for _ in range(len(pool)):
+        task_queue.put(None)
+    while len(pool):
+        messages, exited = pool.wait()
+        for message in messages:
+            if message[0] == 'metrics':
+                worker_metrics[message[1]] = message[2]
+        for worker_id, exitcode in exited:
+            if exitcode != 0:
+                logger.info(f"Worker {worker_id} failed with exit code {exitcode}")
 
+    if failed:
+        logger.info(f"Failed block ranges: {failed}")
+    logger.info(f"Stage seconds of all the ranges: {format_stages(stages)}")
+    METRICS.set('ranges_running', 0)
+    METRICS.set('workers_alive', 0)
+    logger.info(f"Metrics: {summary_line(exporter.export())}")
+    exporter.close()
+    logger.info(f"Manifest: {manifest.summary()}")
+    if args.compact:
+        # only the partitions holding new or changed ranges are rewritten
+        rewritten = compact(args.output_dir, args.output_prefix, partition_by=args.partition_by)
+        logger.info(f"Compacted into {default_dataset_dir(args.output_dir, args.output_prefix)}, {len(rewritten)} partitions rewritten: {rewritten}")
+    manifest.close()
     logger.info("All event tracking processes have completed.")
 
 if __name__ == "__main__":
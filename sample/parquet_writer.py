@@ -0,0 +1,126 @@
+"""Streaming Parquet output with bounded memory.
+
+Decoded windows are buffered as Arrow record batches and flushed through a
+pq.ParquetWriter as row groups once a row or byte threshold is reached, so the
+memory used by a run does not depend on the size of the block range.
+"""
+import os
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# default thresholds triggering a row group flush
+FLUSH_ROWS = 100000
+FLUSH_BYTES = 64 * 1024 * 1024
+
+
+class StreamingParquetWriter:
+    """
+    Writes record batches to output_file as they come.
+
+    The file is written under a temporary name and moved in place when the
+    writer is closed, so readers never see a file without its footer.
+
+    Args:
+        output_file (str): The Parquet file to write.
+        schema (pa.Schema): Schema of every batch written.
+        flush_rows (int): Number of buffered rows triggering a flush.
+        flush_bytes (int): Number of buffered bytes triggering a flush.
+        append (bool): Copy the row groups of an existing output_file first. If that
+            file was written with another schema, the new batches are cast to it.
+        keep_empty (bool): Write the file even if no row was written.
+        index (AddressIndex): Index of the row groups written, saved next to the file on close.
+        writer_options: Further arguments of pq.ParquetWriter, e.g. sorting_columns.
+
+    Key-value pairs put in the metadata dict are stored in the file footer on close.
+    """
+    def __init__(self, output_file, schema, flush_rows=FLUSH_ROWS, flush_bytes=FLUSH_BYTES, append=False, keep_empty=True, index=None, **writer_options):
+        self.output_file = output_file
+        self.tmp_file = f"{output_file}.tmp"
+        self.schema = schema
+        self.flush_rows = flush_rows
+        self.flush_bytes = flush_bytes
+        self.buffer = []
+        self.buffered_rows = 0
+        self.buffered_bytes = 0
+        self.rows_written = 0
+        self.keep_empty = keep_empty
+        self.metadata = {}
+        self.index = index
+        self.row_groups = 0
+
+        existing = None
+        if append and os.path.exists(output_file):
+            existing = pq.ParquetFile(output_file)
+            file_schema = existing.schema_arrow.remove_metadata()
+            if not file_schema.equals(schema):
+                # keep the types of the file being extended, e.g. string columns of older outputs
+                print(f"Appending to {output_file} with its own schema: {file_schema}")
+                self.schema = file_schema
+        os.makedirs(os.path.dirname(os.path.abspath(self.tmp_file)), exist_ok=True)
+        self.writer = pq.ParquetWriter(self.tmp_file, self.schema, **writer_options)
+
+        if existing is not None:
+            # one row group at a time, the old file is never fully in memory
+            for i in range(existing.num_row_groups):
+                table = existing.read_row_group(i).select(self.schema.names).cast(self.schema)
+                self.write_row_group(table)
+
+    def write(self, batch):
+        """Buffer a record batch or a table, flushing when a threshold is reached."""
+        if batch.num_rows == 0:
+            return
+        if not batch.schema.equals(self.schema):
+            batch = pa.Table.from_batches([batch]) if isinstance(batch, pa.RecordBatch) else batch
+            batch = batch.cast(self.schema)
+        self.buffer.append(batch)
+        self.buffered_rows += batch.num_rows
+        self.buffered_bytes += batch.nbytes
+        if self.buffered_rows >= self.flush_rows or self.buffered_bytes >= self.flush_bytes:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered batches as a row group."""
+        if not self.buffer:
+            return
+        table = pa.concat_tables(
+            [b if isinstance(b, pa.Table) else pa.Table.from_batches([b]) for b in self.buffer]
+        )
+        self.write_row_group(table)
+        self.buffer = []
+        self.buffered_rows = 0
+        self.buffered_bytes = 0
+
+    def write_row_group(self, table):
+        if self.index is not None:
+            self.index.add(table, self.row_groups)
+        self.writer.write_table(table, row_group_size=table.num_rows)
+        self.rows_written += table.num_rows
+        self.row_groups += 1
+
+    def close(self):
+        self.flush()
+        if self.rows_written == 0 and not self.keep_empty:
+            self.abort()
+            return
+        if self.metadata:
+            self.writer.add_key_value_metadata({str(k): str(v) for k, v in self.metadata.items()})
+        self.writer.close()
+        os.replace(self.tmp_file, self.output_file)
+        if self.index is not None:
+            self.index.write(self.output_file, self.rows_written, self.row_groups)
+
+    def abort(self):
+        """Drop what was written, leaving a previous output_file untouched."""
+        self.writer.close()
+        if os.path.exists(self.tmp_file):
+            os.remove(self.tmp_file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
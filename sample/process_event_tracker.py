@@ -1,25 +1,58 @@
 """This script connects to an Ethereum node and
 finds all the occurrences of a specific event, saving them to a single file.
+Several events can be tracked at once, saving one file per event.
 It is meant to run as a process cmd managed by the script parallel_event_tracker.py
 """
 import argparse
+import asyncio
+import atexit
+import contextlib
+import functools
 from web3 import Web3
+from web3.datastructures import AttributeDict
 import os
+import shutil
+import time
 import pandas as pd
 import json
 import pyarrow as pa
+import pyarrow.compute as pc
 import pyarrow.parquet as pq
-import numpy as np
-from logger import setup_logging, logging
-from log_decoder import generate_event_abi_map, decode_log
-from log_filters import make_filter, retry_on_error
-from parse_solidity_event import parse_solidity_event
+from .logger import setup_logging, logging
+from .log_decoder import generate_event_abi_map, decode_log, format_raw_log, parse_raw_log
+from .log_filters import make_filter, retry_on_error
+from .parse_solidity_event import parse_solidity_event
+from .range_controller import AdaptiveRangeController, fetch_range, load_range_state, save_range_state, range_state_key
+from .rpc_batch import JsonRpcBatchClient, JsonRpcError, fetch_range_batched, to_rpc_filter
+from .async_fetch import make_async_web3, fetch_range_async, iterate_async, start_event_loop
+from .log_cache import LogCache, FINALITY_DEPTH
+from .enrichment import ChainStore, Enricher, ENRICH_COLUMNS
+from .rate_limiter import RateLimiter, RateLimitedSession, compute_units, retry_after_seconds
+from .rpc_pool import RpcPool, PooledSession
+from .http_transport import async_session, configure_session, CONNECT_TIMEOUT, READ_TIMEOUT
+from .follow import ChainFollower, CONFIRMATIONS, POLL_INTERVAL
+import requests
+import aiohttp
+from .bulk_decoder import BulkEventDecoder
+from .parquet_writer import StreamingParquetWriter, FLUSH_ROWS, FLUSH_BYTES
+from .output_dataset import last_tracked_block, fragment_file, fragment_dir, event_output_file, range_output_file, rename_output, LAST_BLOCK_KEY, output_files as dataset_files
+from .run_manifest import file_digest
+from .output_schema import build_schema, to_arrow_array, WIDE_INT_FORMATS, ADDRESS_FORMATS
+from .address_index import AddressIndex, address_columns
+from .metrics import METRICS, MetricsExporter, record_response, start_reporter, summary_line, INTERVAL as METRICS_INTERVAL
 
+# initial window, the range controller adapts it to the event density
 # TK optimal 10000, alchemy is 2k
 REQ_SIZE = 2000
+# smallest tail handed over to another worker, in blocks
+MIN_SPLIT_BLOCKS = 1000
+# seconds between two progress messages of a worker
+PROGRESS_INTERVAL = 1.0
+# the timed stages of a range: waiting for the logs, decoding them, writing them
+STAGES = ('fetch', 'decode', 'enrich', 'write')
 
 class EventTrackerConfig:
-    def __init__(self, contract_file, contract_address, event_file, from_block, to_block, append, log_file, output_file, rpc):
+    def __init__(self, contract_file, contract_address, event_file, from_block, to_block, append, log_file, output_file, rpc, range_state_file=None, batch_size=1, in_flight=1, flush_rows=FLUSH_ROWS, flush_bytes=FLUSH_BYTES, wide_int='binary', address_format='string', cache_dir=None, enrich=None, chain_store=None, rate_limiter=None, rpc_weights=None, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT, pool_size=None, http2=False, fast_logs=True, follow=False, confirmations=CONFIRMATIONS, poll_interval=POLL_INTERVAL, metrics_file=None, prometheus_file=None, metrics_port=None, metrics_interval=METRICS_INTERVAL):
         self.output_file = output_file
         self.contract_abi_path = contract_file
         self.contract_address = contract_address
@@ -29,18 +62,67 @@ class EventTrackerConfig:
         self.append = append
         self.log_file_path = log_file
         self.rpc = rpc
-        
+        self.range_state_file = range_state_file
+        self.batch_size = batch_size
+        self.in_flight = in_flight
+        self.flush_rows = flush_rows
+        self.flush_bytes = flush_bytes
+        self.wide_int = wide_int
+        self.address_format = address_format
+        self.cache_dir = cache_dir
+        self.enrich = enrich
+        self.chain_store = chain_store
+        self.rate_limiter = rate_limiter
+        self.rpc_weights = rpc_weights
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.pool_size = pool_size
+        self.http2 = http2
+        self.fast_logs = fast_logs
+        self.follow = follow
+        self.confirmations = confirmations
+        self.poll_interval = poll_interval
+        self.metrics_file = metrics_file
+        self.prometheus_file = prometheus_file
+        self.metrics_port = metrics_port
+        self.metrics_interval = metrics_interval
+
 def parse_arguments():
     parser = argparse.ArgumentParser(description="Event Tracker Configuration")
-    parser.add_argument('-n', '--contract-file', type=str, required=True, help='Contract ABI file path')
-    parser.add_argument('-a', '--contract-address', type=str, required=True, help='Contract address')
-    parser.add_argument('-e', '--event-file', type=str, required=True, help='Event file path')
+    parser.add_argument('-n', '--contract-file', type=str, nargs='+', required=True, help='Contract ABI file path, several files are merged')
+    parser.add_argument('-a', '--contract-address', type=str, nargs='+', required=True, help='Contract address, or several addresses tracked in the same requests')
+    parser.add_argument('-e', '--event-file', type=str, nargs='+', required=True, help='Event file path, or several events tracked in the same requests')
     parser.add_argument('-f', '--from-block', type=int, default=None, help='Starting block number (optional)')
-    parser.add_argument('-t', '--to-block', type=int, default=None, help='Stopping block number (optional)')
+    parser.add_argument('-t', '--to-block', type=int, default=None, help='Stopping block number, with --follow the block where following stops (optional)')
     parser.add_argument('-p', '--append', action="store_true", help='Append to existing output (optional)')
     parser.add_argument('-l', '--log-file', type=str, required=True, help='Path to the log file')
     parser.add_argument('-o', '--output-file', type=str, required=True, help='Output file path')
-    parser.add_argument('-r', "--rpc", type=str, required=True, help="the rpc connection")
+    parser.add_argument('-r', "--rpc", type=str, nargs='+', required=True, help="the rpc connection, or several endpoints used as a pool")
+    parser.add_argument('--rpc-weights', type=float, nargs='+', default=None, help='Relative share of the requests of each rpc endpoint (optional)')
+    parser.add_argument('--connect-timeout', type=float, default=CONNECT_TIMEOUT, help='Seconds to wait for a connection to the rpc (optional)')
+    parser.add_argument('--read-timeout', type=float, default=READ_TIMEOUT, help='Seconds to wait for an rpc answer (optional)')
+    parser.add_argument('--pool-size', type=int, default=None, help='Connections kept open to each rpc endpoint, defaults to --in-flight (optional)')
+    parser.add_argument('--http2', action="store_true", help='Use HTTP/2, needs httpx[http2] (optional)')
+    parser.add_argument('--web3-logs', action="store_true", help='Fetch the logs through web3 instead of the raw JSON-RPC fast path (optional)')
+    parser.add_argument('--follow', action="store_true", help='Keep tracking the new blocks once the output is up to date (optional)')
+    parser.add_argument('--confirmations', type=int, default=CONFIRMATIONS, help='Blocks on top of a block before it is tracked in follow mode (optional)')
+    parser.add_argument('--poll-interval', type=float, default=POLL_INTERVAL, help='Seconds between two looks at the head in follow mode (optional)')
+    parser.add_argument('-s', '--range-state', type=str, default=None, help='JSON file where the learned block window per contract is kept (optional)')
+    parser.add_argument('-b', '--batch-size', type=int, default=1, help='Number of block windows sent in a single JSON-RPC batch request (optional)')
+    parser.add_argument('-i', '--in-flight', type=int, default=1, help='Number of concurrent get_logs requests, uses the asyncio engine when greater than 1 (optional)')
+    parser.add_argument('--flush-rows', type=int, default=FLUSH_ROWS, help='Number of buffered rows written as a Parquet row group (optional)')
+    parser.add_argument('--flush-bytes', type=int, default=FLUSH_BYTES, help='Number of buffered bytes written as a Parquet row group (optional)')
+    parser.add_argument('--wide-int', type=str, choices=WIDE_INT_FORMATS, default='binary', help='Storage of integers wider than 64 bits: 32 bytes binary, decimal256 or string (optional)')
+    parser.add_argument('--address-format', type=str, choices=ADDRESS_FORMATS, default='string', help='Storage of addresses: checksummed string or 20 bytes binary (optional)')
+    parser.add_argument('--cache-dir', type=str, default=None, help='Directory caching the raw logs of finalized blocks, windows already cached are not fetched again (optional)')
+    parser.add_argument('--enrich', type=str, nargs='+', choices=ENRICH_COLUMNS, default=None, help='Block and transaction columns added to the events (optional)')
+    parser.add_argument('--chain-store', type=str, default=None, help='SQLite file keeping the fetched block timestamps and transactions (optional)')
+    parser.add_argument('--requests-per-second', type=float, default=None, help='Maximum number of requests sent to the provider per second (optional)')
+    parser.add_argument('--compute-units-per-second', type=float, default=None, help='Maximum number of provider compute units spent per second (optional)')
+    parser.add_argument('--metrics-file', type=str, default=None, help='JSON file of the metrics summary, rewritten periodically (optional)')
+    parser.add_argument('--prometheus-file', type=str, default=None, help='File of the metrics in the Prometheus text format, rewritten periodically (optional)')
+    parser.add_argument('--metrics-port', type=int, default=None, help='Serve the metrics on http://127.0.0.1:<port>/metrics (optional)')
+    parser.add_argument('--metrics-interval', type=float, default=METRICS_INTERVAL, help='Seconds between two exports of the metrics (optional)')
 
     args = parser.parse_args()
     
@@ -53,120 +135,704 @@ def parse_arguments():
         args.append,
         args.log_file,
         args.output_file,
-        args.rpc
+        args.rpc,
+        args.range_state,
+        args.batch_size,
+        args.in_flight,
+        args.flush_rows,
+        args.flush_bytes,
+        args.wide_int,
+        args.address_format,
+        args.cache_dir,
+        args.enrich,
+        args.chain_store,
+        RateLimiter(args.requests_per_second, args.compute_units_per_second) if args.requests_per_second or args.compute_units_per_second else None,
+        args.rpc_weights,
+        args.connect_timeout,
+        args.read_timeout,
+        args.pool_size,
+        args.http2,
+        not args.web3_logs,
+        args.follow,
+        args.confirmations,
+        args.poll_interval,
+        args.metrics_file,
+        args.prometheus_file,
+        args.metrics_port,
+        args.metrics_interval
     )
 
-def main():
-    config = parse_arguments()
+def as_list(value):
+    return list(value) if isinstance(value, (list, tuple)) else [value]
 
-    # Set up logging
-    setup_logging(log_file_path=config.log_file_path)
-    logger = logging.getLogger()
-    logger.info(f"Started event tracking with arguments: contract_file={config.contract_abi_path}, contract_address={config.contract_address}, event_file={config.event_solidity_path}, from_block={config.from_block}, to_block={config.to_block}, append={config.append}, log_file={config.log_file_path}, output_file={config.output_file}, rpc={config.rpc}")
 
-    w3 = Web3(
-        Web3.HTTPProvider(
-            config.rpc,
-            request_kwargs={'timeout': 40}
+def observe_window(from_block, to_block, logs):
+    METRICS.observe('window_blocks', to_block - from_block + 1)
+    METRICS.observe('logs_per_call', len(logs))
+
+
+def format_stages(stages):
+    return ' '.join(f"{stage}={stages.get(stage, 0.0):.3f}" for stage in STAGES)
+
+
+class PartialRangeError(Exception):
+    """
+    A range failed after some windows were written.
+
+    The output covers the blocks up to last_block and is resumed from there in
+    append mode.
+    """
+    def __init__(self, last_block, events, error):
+        super().__init__(f"stopped after block {last_block}: {error!r}")
+        self.last_block = last_block
+        self.events = events
+        self.error = error
+
+
+class TrackedEvent:
+    """
+    One of the events followed by an EventTracker.
+
+    Args:
+        event (dict): The event parsed by parse_solidity_event.
+        event_abi_map (dict): The ABI entries of the contracts by topic, from generate_event_abi_map.
+        with_address (bool): Add the address emitting the log as a column.
+        wide_int (str): Storage of the integers wider than 64 bits.
+        address_format (str): Storage of the addresses.
+        extra_fields (list): Fields appended to the schema after decoding, e.g. by the Enricher.
+    """
+    def __init__(self, event, event_abi_map, with_address=False, wide_int='binary', address_format='string', extra_fields=()):
+        self.event = event
+        self.name = event['event_name']
+        self.topic = '0x' + Web3.keccak(text=event['event_name'] + '(' + ",".join(event['types']) + ')').hex()
+        # None when the ABI lacks the event
+        event_abi = event_abi_map.get(self.topic)
+        self.columns = ['blockNumber', 'transactionHash'] + (['address'] if with_address else []) + event['fields']
+        # written with an index of their row groups for address lookups
+        self.address_columns = address_columns(event, event_abi)
+        # the Solidity types decide how each column is stored
+        self.decoded_schema = build_schema(event, wide_int, address_format, with_address)
+        self.schema = self.decoded_schema
+        for field in extra_fields:
+            self.schema = self.schema.append(field)
+
+        # column-wise decoding for events made only of static types
+        self.bulk_decoder = BulkEventDecoder(event_abi) if event_abi is not None else None
+        if self.bulk_decoder is not None and not self.bulk_decoder.supported:
+            self.bulk_decoder = None
+
+
+class EventTracker:
+    """
+    Loads the contracts, the events and the RPC clients once, then tracks any
+    number of block ranges with them.
+
+    Several events and addresses are fetched with a single get_logs per
+    window, OR-ing their topic0 and listing the addresses, and the logs are
+    split back into one output per event.
+
+    Args:
+        config (EventTrackerConfig): The contract, event, rpc and fetch options,
+            the block range and output fields are given to track().
+    """
+    def __init__(self, config):
+        self.config = config
+        self.logger = logging.getLogger()
+
+        # every request, web3 or batched, draws from the budget shared by the workers
+        # and goes through the pool when several endpoints are given
+        timeout = (config.connect_timeout, config.read_timeout)
+        # one connection per request in flight, the workers of a parallel run each have their own
+        pool_size = config.pool_size or max(1, config.in_flight)
+
+        def new_session():
+            session = RateLimitedSession(config.rate_limiter) if config.rate_limiter is not None else requests.Session()
+            # every answer is timed for the metrics
+            session.hooks['response'].append(record_response)
+            return configure_session(session, pool_size, config.http2, timeout)
+        self.rpcs = as_list(config.rpc)
+        self.pool = None
+        if len(self.rpcs) > 1:
+            self.pool = RpcPool(self.rpcs, config.rpc_weights, session_factory=new_session)
+            self.session = PooledSession(self.pool)
+        else:
+            self.session = new_session()
+        self.w3 = Web3(
+            Web3.HTTPProvider(
+                self.rpcs[0],
+                request_kwargs={'timeout': timeout},
+                session=self.session
+            )
         )
-    )
-    # # Check if connected
-    # if not w3.is_connected():
-    #     raise ConnectionError("Failed to connect to RPC Port")
-
-    # def get_logs_try(w3, filter_params):
-    #     try:
-    #         logs = w3.eth.get_logs(filter_params)
-    #         logger.info(f"Retrieved {len(logs)} logs from block {filter_params['fromBlock']} to {filter_params['toBlock']}")
-    #     except Exception as e:
-    #         logger.error(f"Error retrieving logs: {e}")
-    #         logs = []
-    #     return logs
-    
+        # # Check if connected
+        # if not w3.is_connected():
+        #     raise ConnectionError("Failed to connect to RPC Port")
+
+        contract_files = as_list(config.contract_abi_path)
+        contract_abi = []
+        for contract_file in contract_files:
+            with open(contract_file) as f:
+                contract_abi += json.load(f)
+        self.event_abi_map = generate_event_abi_map(contract_abi)
+        self.addresses = as_list(config.contract_address)
+        # several ABIs can define the same event, the contract only needs one of each
+        if len(contract_files) > 1:
+            contract_abi = list(self.event_abi_map.values())
+        self.contract = self.w3.eth.contract(address=self.addresses[0], abi=contract_abi)
+
+        self.batch_client = JsonRpcBatchClient(self.rpcs[0], timeout=timeout, session=self.session)
+        self.async_w3 = {rpc: make_async_web3(rpc, config.read_timeout, config.connect_timeout) for rpc in self.rpcs}
+        # the asyncio engine runs in one loop for all the ranges, so that its sessions keep their connections
+        self.loop = None
+        self.async_sessions = []
+        self.pool_size = pool_size
+        self.timeout = timeout
+
+        # timestamps and transactions are fetched once per distinct block and transaction
+        self.enricher = None
+        if config.enrich:
+            self.enricher = Enricher(self.batch_client, ChainStore(config.chain_store), config.enrich, config.address_format)
+        extra_fields = self.enricher.fields() if self.enricher is not None else []
+
+        with_address = len(self.addresses) > 1
+        self.events = []
+        for event_file in as_list(config.event_solidity_path):
+            event = parse_solidity_event(event_file)
+            self.events.append(TrackedEvent(event, self.event_abi_map, with_address, config.wide_int, config.address_format, extra_fields))
+        self.events_by_topic = {e.topic: e for e in self.events}
+        self.checksum_cache = {}
+        # seconds spent by the last track() waiting for the node, decoding and writing
+        self.stage_seconds = dict.fromkeys(STAGES, 0.0)
+        # a single topic0, or the list of the topic0 OR-ed by the node
+        if len(self.events) == 1:
+            self.topics = [self.events[0].topic]
+        else:
+            self.topics = [[e.topic for e in self.events]]
+
+        # the window grows on sparse ranges and shrinks on dense ones,
+        # it is kept between the ranges tracked by the same instance
+        self.state_key = range_state_key(self.addresses, self.topics)
+        self.controller = AdaptiveRangeController(initial_size=REQ_SIZE)
+        self.controller.load_state(load_range_state(config.range_state_file, self.state_key))
+
+        # raw logs of finalized blocks are read from the disk instead of the node
+        self.log_cache = None
+        if config.cache_dir is not None:
+            self.log_cache = LogCache(config.cache_dir, self.w3.eth.chain_id, self.addresses, self.topics)
+
+    def window_filter(self, from_block, to_block):
+        args = {
+            'fromBlock': from_block,
+            'toBlock': to_block,
+            'address': self.addresses[0] if len(self.addresses) == 1 else self.addresses,
+            'topics': self.topics
+        }
+        return make_filter(args)
+
     @retry_on_error()
-    def get_logs_try(w3, filter_params):
-        logs = w3.eth.get_logs(filter_params)
-        logger.info(f"Retrieved {len(logs)} logs from block {filter_params['fromBlock']} to {filter_params['toBlock']}")
+    def fetch_logs(self, from_block, to_block):
+        if self.config.fast_logs:
+            # raw JSON-RPC answer, without web3's middlewares and result formatters
+            logs = [parse_raw_log(l) for l in self.batch_client.get_logs(self.window_filter(from_block, to_block))]
+        else:
+            logs = self.w3.eth.get_logs(self.window_filter(from_block, to_block))
+        self.logger.info(f"Retrieved {len(logs)} logs from block {from_block} to {to_block}")
+        observe_window(from_block, to_block, logs)
         return logs
 
-    if config.from_block is None:
-        fromblock = 0
-    else:
-        fromblock = config.from_block
+    @retry_on_error()
+    def fetch_batch(self, windows):
+        results = self.batch_client.get_logs_batch([self.window_filter(a, b) for a, b in windows])
+        self.logger.info(f"Retrieved batch of {len(windows)} windows from block {windows[0][0]} to {windows[-1][1]}")
+        format_log = parse_raw_log if self.config.fast_logs else format_raw_log
+        for (a, b), r in zip(windows, results):
+            if not isinstance(r, Exception):
+                observe_window(a, b, r)
+        return [r if isinstance(r, Exception) else [format_log(l) for l in r] for r in results]
 
-    if config.to_block is None:
-        to_block = w3.eth.block_number
-    else:
-        to_block = config.to_block
+    async def open_sessions(self):
+        """Give the async providers sessions with the pool, timeouts and compression of the requests ones."""
+        self.async_sessions = [await w3.provider.cache_async_session(async_session(self.pool_size, self.timeout))
+                               for w3 in self.async_w3.values()]
 
-    logger.info(f"Final block range: fromblock={fromblock}, toblock={to_block}")
+    def close_loop(self):
+        """Close the sessions of the asyncio engine and stop its loop."""
+        if self.loop is None:
+            return
 
-    f = open(config.contract_abi_path)
-    contract_abi = json.load(f)
-    contract = w3.eth.contract(address=config.contract_address, abi=contract_abi)
-    event_abi_map = generate_event_abi_map(contract_abi)
+        async def close_sessions():
+            for session in self.async_sessions:
+                await session.close()
+        asyncio.run_coroutine_threadsafe(close_sessions(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.loop = None
 
-    event = parse_solidity_event(config.event_solidity_path)
+    async def get_logs_async(self, rpc, filter_params):
+        if not self.config.fast_logs:
+            return await self.async_w3[rpc].eth.get_logs(filter_params)
+        # the provider posts the request, the middlewares and formatters are skipped
+        response = await self.async_w3[rpc].provider.make_request('eth_getLogs', [to_rpc_filter(filter_params)])
+        if 'error' in response:
+            raise JsonRpcError(response['error'].get('code'), response['error'].get('message'))
+        return [parse_raw_log(l) for l in response['result']]
 
-    # output = pd.DataFrame(columns=['blockNumber'] + event['fields'])
-    # if the file already exists and it is append mode
-    # don't repeat the analysis
-    if config.append and os.path.exists(config.output_file):
-        existing_table = pq.read_table(config.output_file)
-        existing_df = existing_table.to_pandas()
-        last_block_number = existing_df['blockNumber'].astype(int).max()
-        fromblock = last_block_number + 1
-        del existing_df
+    async def fetch_logs_async(self, from_block, to_block):
+        limiter = self.config.rate_limiter
+        if limiter is not None:
+            await asyncio.sleep(limiter.reserve(1, compute_units(['eth_getLogs'])))
+        started = time.monotonic()
+        try:
+            filter_params = self.window_filter(from_block, to_block)
+            if self.pool is not None:
+                logs = await self.pool.call_async(lambda endpoint: self.get_logs_async(endpoint.url, filter_params))
+            else:
+                logs = await self.get_logs_async(self.rpcs[0], filter_params)
+        except aiohttp.ClientResponseError as ex:
+            METRICS.inc('rpc_errors_total', method='eth_getLogs', status=ex.status)
+            if ex.status == 429 and limiter is not None:
+                # the engine retries the window once the pause is over
+                METRICS.inc('retries_total', reason='rate_limited')
+                limiter.pause(retry_after_seconds((ex.headers or {}).get('Retry-After')))
+            raise
+        finally:
+            # the requests of aiohttp are not seen by the session hooks
+            METRICS.observe('rpc_latency_seconds', time.monotonic() - started, method='eth_getLogs')
+            METRICS.inc('rpc_requests_total', method='eth_getLogs', status='async')
+        self.logger.info(f"Retrieved {len(logs)} logs from block {from_block} to {to_block}")
+        observe_window(from_block, to_block, logs)
+        return logs
 
-    # list to save all output dicts
-    output_list = []
+    def iter_windows(self, from_block, to_block):
+        """Yield (window_from, window_to, logs) over the range, with the configured fetch mode."""
+        fetch_logs, fetch_batch, fetch_logs_async = self.fetch_logs, self.fetch_batch, self.fetch_logs_async
+        if self.log_cache is not None:
+            fetch_logs = functools.partial(self.log_cache.fetch, self.fetch_logs)
+            fetch_batch = functools.partial(self.log_cache.fetch_batch, self.fetch_batch)
+            fetch_logs_async = functools.partial(self.log_cache.fetch_async, self.fetch_logs_async)
+        if self.config.in_flight > 1:
+            # the asyncio engine takes precedence over batching
+            if self.loop is None:
+                self.loop, _ = start_event_loop()
+                asyncio.run_coroutine_threadsafe(self.open_sessions(), self.loop).result()
+                atexit.register(self.close_loop)
+            return iterate_async(fetch_range_async(fetch_logs_async, from_block, to_block, self.controller, self.config.in_flight), self.loop)
+        if self.config.batch_size > 1:
+            return fetch_range_batched(fetch_batch, fetch_logs, from_block, to_block, self.controller, self.config.batch_size)
+        return fetch_range(fetch_logs, from_block, to_block, self.controller)
 
-    for step in np.arange(fromblock, to_block, REQ_SIZE):
-        toblock = min(step + REQ_SIZE, to_block)
-        args = {
-            'fromBlock': step,
-            'toBlock': toblock,
-            'address': config.contract_address,
-            'topics': ['0x' + Web3.keccak(text=event['event_name'] + '(' + ",".join(event['types']) + ')').hex()]
-        }
-        filter_params = make_filter(args)
-
-        logs = get_logs_try(w3, filter_params)
-
-        if len(logs) > 0:
-
-            for log in logs:
-                decoded_log = decode_log(log, event_abi_map, contract)
-                work = {
-                    'blockNumber': decoded_log['blockNumber'],
-                    'transactionHash': decoded_log['transactionHash']
-                    }
-                for field in event['fields']:
-                    work[field] = decoded_log['args'][field]
-                
-                output_list.append(work)
-
-    logger.info(f"Finished processing logs for address: {config.contract_address}, block range: {config.from_block} to {config.to_block}. Total events found: {len(output_list)}")
-
-    # create the columns, so that if output_list is empty the dataframe has the right header
-    columns = ['blockNumber', 'transactionHash'] + event['fields']
-    logger.info(f"Output Dataframe columns: {columns}")
-    # output dataframe out of the list of events stored as dicts
-    output = pd.DataFrame(output_list, columns=columns)
-    ##### write the output
-    # if the file already exists just append to the existing
-    if config.append and os.path.exists(config.output_file):
-        existing_table = pq.read_table(config.output_file)
-        existing_df = existing_table.to_pandas()
-        output = pd.concat([existing_df, output], ignore_index=True)
-    
-    # Convert columns to string to avoid errors from numbers larger than max
-    for c in event['fields']:
-        output[c] = output[c].astype(str)
-    output['blockNumber'] = output['blockNumber'].astype(int)
-    table = pa.Table.from_pandas(output)
-    pq.write_table(table, config.output_file)
-    logger.info(f"Dumped logs to file {config.output_file}")
+    def split_logs(self, logs):
+        """Group the logs of a window by tracked event, through their topic0."""
+        if len(self.events) == 1:
+            return {self.events[0].topic: logs}
+        groups = {}
+        for log in logs:
+            topic = log['topics'][0] if log['topics'] else None
+            if topic is not None and not isinstance(topic, str):
+                topic = Web3.to_hex(topic)
+            event_abi = self.event_abi_map.get(topic)
+            if event_abi is not None and topic in self.events_by_topic:
+                groups.setdefault(topic, []).append(log)
+        return groups
+
+    def checksum_address(self, address):
+        if address not in self.checksum_cache:
+            self.checksum_cache[address] = Web3.to_checksum_address(address)
+        return self.checksum_cache[address]
+
+    def decode_logs(self, tracked, logs):
+        """Decode the logs of one event into a DataFrame with its output columns."""
+        if tracked.bulk_decoder is not None:
+            try:
+                decoded = tracked.bulk_decoder.decode(logs)
+                if 'address' in tracked.columns:
+                    decoded['address'] = [self.checksum_address(log['address']) for log in logs]
+                return pd.DataFrame({c: decoded[c] for c in tracked.columns}, columns=tracked.columns)
+            except ValueError as ex:
+                self.logger.info(f"Bulk decoding failed ({ex}), decoding the logs one by one")
+
+        output_list = []
+        for log in logs:
+            if not isinstance(log, AttributeDict):
+                log = format_raw_log(log)
+            decoded_log = decode_log(log, self.event_abi_map, self.contract)
+            work = {
+                'blockNumber': decoded_log['blockNumber'],
+                'transactionHash': decoded_log['transactionHash']
+                }
+            if 'address' in tracked.columns:
+                work['address'] = decoded_log['address']
+            for field in tracked.event['fields']:
+                work[field] = decoded_log['args'][field]
+
+            output_list.append(work)
+        return pd.DataFrame(output_list, columns=tracked.columns)
+
+    def to_arrow(self, tracked, output, schema=None):
+        """
+        Turn a decoded DataFrame into an Arrow table with the output schema of the event,
+        or with the types of schema for the columns it has, e.g. the schema of an older output.
+        """
+        decoded_schema = tracked.decoded_schema
+        if schema is not None:
+            decoded_schema = pa.schema([schema.field(f.name) if f.name in schema.names else f for f in decoded_schema])
+        arrays = [to_arrow_array(output[c].to_numpy(), decoded_schema.field(c).type) for c in tracked.columns]
+        return pa.Table.from_arrays(arrays, schema=decoded_schema)
+
+    def output_files(self, output_file):
+        """Output of each event, output_file itself if a single event is tracked."""
+        if len(self.events) == 1:
+            return {self.events[0].topic: output_file}
+        return {e.topic: event_output_file(output_file, e.name) for e in self.events}
+
+    def tracked_block(self, output_file):
+        """Last block covered by the outputs of every event, None if one of them has nothing."""
+        blocks = [last_tracked_block(path) if os.path.exists(path) else None for path in self.output_files(output_file).values()]
+        return None if None in blocks else min(blocks)
+
+    def written_files(self, output_file):
+        """The files and fragments of the outputs of every event."""
+        return [path for output in self.output_files(output_file).values() for path in dataset_files(output)]
+
+    def track(self, from_block, to_block, output_file, append=False, split=None, progress=None, last_block=None, checkpoint=None):
+        """
+        Track the events over [from_block, to_block] and write them to output_file,
+        or to one file per event derived from it when several events are tracked.
+
+        Args:
+            last_block (int): Last block of the outputs when appending, if the caller
+                knows it, e.g. from an earlier call. Their footers are read otherwise.
+            split (callable): split(written_block, end_block) is called after each
+                window of a range written from scratch. It returns None to go on, or
+                (new_end_block, new_output_file) to stop at new_end_block and write
+                to new_output_file instead, the blocks after it being left to another
+                worker.
+            progress (callable): progress(written_block, events) is called after
+                each window written, with the events found so far.
+            checkpoint (callable): When given, the files are closed after each window
+                where a row group was flushed, with the window as their last block,
+                and the next windows go to new fragments. checkpoint(written_block,
+                events) is then called, the blocks up to written_block are kept on
+                disk even if the process is killed, and append mode resumes after them.
+
+        Returns:
+            int: The number of events found.
+
+        Raises:
+            PartialRangeError: When the fetch fails after the first windows, which
+                are kept in the output.
+        """
+        logger = self.logger
+        stages = self.stage_seconds = dict.fromkeys(STAGES, 0.0)
+
+        def add_stage(stage, started):
+            seconds = time.monotonic() - started
+            stages[stage] += seconds
+            METRICS.inc('stage_seconds_total', seconds, stage=stage)
+            return seconds
+
+        if from_block is None:
+            fromblock = 0
+        else:
+            fromblock = from_block
+
+        if to_block is None:
+            to_block = self.w3.eth.block_number
+            head = to_block
+        elif self.log_cache is not None or self.enricher is not None:
+            head = self.w3.eth.block_number
+        # only blocks deep enough not to be reorganized are cached
+        if self.log_cache is not None:
+            self.log_cache.finalized_block = head - FINALITY_DEPTH
+        if self.enricher is not None:
+            self.enricher.finalized_block = head - FINALITY_DEPTH
+
+        logger.info(f"Final block range: fromblock={fromblock}, toblock={to_block}")
+
+        outputs = self.output_files(output_file)
+        # if the files already exist and it is append mode
+        # don't repeat the analysis, the last blocks are read from the footers only
+        last_blocks = {}
+        if append and all(os.path.exists(path) for path in outputs.values()):
+            if last_block is not None:
+                last_blocks = dict.fromkeys(outputs, last_block)
+            else:
+                last_blocks = {topic: last_tracked_block(path) for topic, path in outputs.items()}
+            if None not in last_blocks.values():
+                fromblock = max(fromblock, min(last_blocks.values()) + 1)
+            if fromblock > to_block:
+                logger.info(f"Output {output_file} is already up to block {to_block}")
+                return 0
+
+        events_found = 0
+
+        ##### write the output
+        # each decoded window is streamed to the files as Arrow batches
+        with contextlib.ExitStack() as stack:
+            writers = {}
+            schemas = {}
+
+            def open_writer(tracked, target_file):
+                # empty fragments are kept when several events are tracked, so that
+                # a rare event does not hold back the resume block of the others
+                return stack.enter_context(StreamingParquetWriter(
+                    target_file, schemas[tracked.topic], self.config.flush_rows, self.config.flush_bytes,
+                    keep_empty=target_file == outputs[tracked.topic] or len(self.events) > 1,
+                    index=AddressIndex(tracked.address_columns) if tracked.address_columns else None
+                ))
+
+            def commit(block, new_outputs=None):
+                """Close the files with the windows up to block, the next ones go to new fragments of the outputs."""
+                nonlocal outputs
+                for writer in writers.values():
+                    writer.metadata[LAST_BLOCK_KEY] = block
+                stack.pop_all().close()
+                for topic, path in outputs.items():
+                    # a rewritten output drops the fragments appended to its previous version
+                    if writers[topic].output_file == path and os.path.isdir(fragment_dir(path)):
+                        shutil.rmtree(fragment_dir(path))
+                if new_outputs is not None:
+                    # the files committed so far follow a split range to its new name
+                    for topic, path in outputs.items():
+                        rename_output(path, new_outputs[topic], end_block)
+                    outputs = new_outputs
+                for topic in writers:
+                    writers[topic] = open_writer(self.events_by_topic[topic], fragment_file(outputs[topic], block + 1, end_block))
+
+            for tracked in self.events:
+                path = outputs[tracked.topic]
+                schema = tracked.schema
+                if append and os.path.exists(path):
+                    # new rows go to a fragment file, the existing output is never rewritten
+                    target_file = fragment_file(path, fromblock, to_block)
+                    logger.info(f"Appending blocks {fromblock} to {to_block} to {target_file}")
+                    # with the types of the output, e.g. string columns of older outputs,
+                    # so that it is read back with its fragments as a single table
+                    schema = pq.read_schema(path).remove_metadata()
+                    if not schema.equals(tracked.schema):
+                        logger.info(f"Appending with the schema of {path}: {schema}")
+                else:
+                    target_file = path
+                logger.info(f"Output columns of {tracked.name}: {tracked.columns}")
+                schemas[tracked.topic] = schema
+                writers[tracked.topic] = open_writer(tracked, target_file)
+
+            written_block = None
+            # last block of the files closed by a checkpoint
+            committed = None
+            error = None
+            end_block = to_block
+            # only a range written from scratch can hand its tail over
+            if any(writer.output_file != outputs[topic] for topic, writer in writers.items()):
+                split = None
+            try:
+                started = time.monotonic()
+                for step, toblock, logs in self.iter_windows(fromblock, to_block):
+                    add_stage('fetch', started)
+
+                    for topic, event_logs in self.split_logs(logs).items():
+                        tracked = self.events_by_topic[topic]
+                        started = time.monotonic()
+                        table = self.to_arrow(tracked, self.decode_logs(tracked, event_logs), schemas[topic])
+                        seconds = add_stage('decode', started)
+                        if event_logs:
+                            METRICS.inc('decoded_logs_total', len(event_logs))
+                            METRICS.observe('decode_seconds_per_1k_logs', seconds * 1000 / len(event_logs))
+                        if self.enricher is not None:
+                            # blocks and transactions come from the node, timed apart from the decoding
+                            started = time.monotonic()
+                            table = self.enricher.enrich(table)
+                            add_stage('enrich', started)
+                        # an event can be ahead of the others after an interrupted append
+                        if last_blocks.get(topic) is not None and last_blocks[topic] >= fromblock:
+                            table = table.filter(pc.greater(table['blockNumber'], last_blocks[topic]))
+                        # the last window can go past the end of a split range
+                        if toblock > end_block:
+                            table = table.filter(pc.less_equal(table['blockNumber'], end_block))
+                        started = time.monotonic()
+                        writers[topic].write(table)
+                        add_stage('write', started)
+                        METRICS.inc('events_written_total', table.num_rows)
+                        events_found += table.num_rows
+                    written_block = min(toblock, end_block)
+                    if progress is not None:
+                        progress(written_block, events_found)
+                    if written_block >= end_block:
+                        break
+                    if checkpoint is not None and any(writer.row_groups for writer in writers.values()):
+                        started = time.monotonic()
+                        commit(written_block)
+                        add_stage('write', started)
+                        committed = written_block
+                        logger.info(f"Checkpoint after block {written_block}, {events_found} events")
+                        checkpoint(written_block, events_found)
+                    if split is not None:
+                        tail = split(written_block, end_block)
+                        if tail is not None:
+                            end_block, output_file = tail
+                            logger.info(f"Range split, tracking up to block {end_block} into {output_file}")
+                            if committed is None:
+                                outputs = self.output_files(output_file)
+                                for topic, writer in writers.items():
+                                    writer.output_file = outputs[topic]
+                            else:
+                                commit(written_block, self.output_files(output_file))
+                                committed = written_block
+                    started = time.monotonic()
+            except Exception as ex:
+                if written_block is None:
+                    raise
+                # the windows written so far are kept, append mode resumes after them
+                logger.info(f"Fetch failed after block {written_block}, keeping the blocks written so far")
+                error = ex
+            # resuming reads this instead of the data
+            for writer in writers.values():
+                writer.metadata[LAST_BLOCK_KEY] = end_block if error is None else written_block
+            # the last row groups and the footers are written on closing
+            started = time.monotonic()
+        add_stage('write', started)
+        for writer in writers.values():
+            if os.path.exists(writer.output_file):
+                METRICS.inc('bytes_written_total', os.path.getsize(writer.output_file))
+
+        for topic, path in outputs.items():
+            # a rewritten output drops the fragments appended to its previous version
+            if writers[topic].output_file == path and os.path.isdir(fragment_dir(path)):
+                shutil.rmtree(fragment_dir(path))
+            logger.info(f"Dumped logs to file {writers[topic].output_file}")
+
+        save_range_state(self.config.range_state_file, self.state_key, self.controller)
+        if self.pool is not None:
+            logger.info(f"RPC endpoints: {self.pool.summary()}")
+        logger.info(f"Learned block window: {self.controller.size} blocks, density: {self.controller.density} events per block")
+        logger.info(f"Stage seconds: {format_stages(stages)}")
+
+        if error is not None:
+            raise PartialRangeError(written_block, events_found, error) from error
+        logger.info(f"Finished processing logs for address: {self.config.contract_address}, block range: {from_block} to {end_block}. Total events found: {events_found}")
+        return events_found
+
+
+def run_worker(config, log_file, task_queue, result_queue, worker_id=0, split_requests=None, metrics_interval=METRICS_INTERVAL):
+    """
+    Long-lived worker of parallel_event_tracker.
+
+    The contract, the decoder and the HTTP sessions are loaded once, then block
+    ranges are pulled from task_queue until a None is received. Each range is
+    also logged to its own file. The worker reports on result_queue:
+
+    - ('started', worker_id, from_block, to_block) when it takes a range,
+    - ('split', worker_id, from_block, to_block, new_to_block) when it answers a
+      split request, keeping [from_block, new_to_block] and handing the blocks
+      after it over, new_to_block being None if the range is too short to split,
+    - ('done', worker_id, from_block, to_block, events, error, details) at the end
+      of the range, details giving the last block written, the rows and the files
+      of the output with their size and checksum for the run manifest,
+    - ('progress', worker_id, from_block, to_block, written_block, events) at
+      most every PROGRESS_INTERVAL seconds while the range is tracked,
+    - ('checkpoint', worker_id, from_block, to_block, last_block, rows) each time
+      the files of the range are committed up to last_block while it is tracked,
+      rows being the rows they hold, so that a killed worker is resumed from there,
+    - ('metrics', worker_id, snapshot) every metrics_interval seconds and before
+      each 'done', snapshot being the metrics of the worker since it started.
+
+    result_queue only needs a put(), a queue or the ResultSender of a worker_pool
+    pipe. A split is requested by setting split_requests[worker_id], a shared byte array.
+    The output of the worker goes to its log files only, the console is left to
+    the scheduler.
+    """
+    setup_logging(log_file_path=log_file, echo=False)
+    logger = logging.getLogger()
+    tracker = EventTracker(config)
+    formatter = logging.Formatter('%(asctime)s:%(levelname)s:%(name)s:%(message)s')
+    stop_reporter = start_reporter(lambda snapshot: result_queue.put(('metrics', worker_id, snapshot)), metrics_interval)
+
+    for task in iter(task_queue.get, None):
+        from_block, to_block, output_file, range_log_file, append = task
+        if split_requests is not None:
+            split_requests[worker_id] = 0
+        result_queue.put(('started', worker_id, from_block, to_block))
+        handler = logging.FileHandler(range_log_file)
+        handler.setFormatter(formatter)
+        logger.addHandler(handler)
+
+        def split(written_block, end_block):
+            nonlocal to_block, output_file
+            if split_requests is None or not split_requests[worker_id]:
+                return None
+            split_requests[worker_id] = 0
+            # the tail is only worth handing over if it holds a few windows
+            if end_block - written_block < 2 * max(tracker.controller.size, MIN_SPLIT_BLOCKS):
+                result_queue.put(('split', worker_id, from_block, end_block, None))
+                return None
+            new_end = written_block + (end_block - written_block) // 2
+            result_queue.put(('split', worker_id, from_block, end_block, new_end))
+            # the range is reported under its new bounds from now on
+            to_block, output_file = new_end, range_output_file(output_file, from_block, new_end)
+            return to_block, output_file
+
+        reported = time.monotonic()
+
+        def progress(written_block, events):
+            nonlocal reported
+            if time.monotonic() - reported >= PROGRESS_INTERVAL:
+                reported = time.monotonic()
+                result_queue.put(('progress', worker_id, from_block, to_block, written_block, events))
+
+        def checkpoint(written_block, events):
+            rows = sum(pq.read_metadata(path).num_rows for path in tracker.written_files(output_file))
+            result_queue.put(('checkpoint', worker_id, from_block, to_block, written_block, rows))
+
+        events, error, last_block = 0, None, None
+        try:
+            events = tracker.track(from_block, to_block, output_file, append, split, progress, checkpoint=checkpoint)
+            last_block = to_block
+        except PartialRangeError as ex:
+            logger.exception(f"Failed block range {from_block} to {to_block} after block {ex.last_block}")
+            events, error, last_block = ex.events, repr(ex.error), ex.last_block
+        except Exception as ex:
+            logger.exception(f"Failed block range {from_block} to {to_block}")
+            error = repr(ex)
+            # what an earlier attempt kept
+            last_block = tracker.tracked_block(output_file)
+        try:
+            files = tracker.written_files(output_file)
+            size, checksum = file_digest(files)
+            rows = sum(pq.read_metadata(path).num_rows for path in files)
+        except (OSError, pa.ArrowException):
+            files, size, checksum, rows = [], None, None, None
+        details = {'last_block': last_block, 'rows': rows, 'files': files, 'size': size, 'checksum': checksum,
+                   'stages': dict(tracker.stage_seconds)}
+        result_queue.put(('metrics', worker_id, METRICS.snapshot()))
+        result_queue.put(('done', worker_id, from_block, to_block, events, error, details))
+        logger.removeHandler(handler)
+        handler.close()
+    stop_reporter.set()
+
+
+def main():
+    config = parse_arguments()
+
+    # Set up logging
+    setup_logging(log_file_path=config.log_file_path)
+    logger = logging.getLogger()
+    logger.info(f"Started event tracking with arguments: contract_file={config.contract_abi_path}, contract_address={config.contract_address}, event_file={config.event_solidity_path}, from_block={config.from_block}, to_block={config.to_block}, append={config.append}, log_file={config.log_file_path}, output_file={config.output_file}, rpc={config.rpc}, batch_size={config.batch_size}, in_flight={config.in_flight}")
+
+    tracker = EventTracker(config)
+    exporter = None
+    if config.metrics_file is not None or config.prometheus_file is not None or config.metrics_port is not None:
+        exporter = MetricsExporter(METRICS.snapshot, config.metrics_file, config.prometheus_file, config.metrics_port, config.metrics_interval)
+        stop_reporter = start_reporter(lambda snapshot: exporter.export(), config.metrics_interval)
+    try:
+        if config.follow:
+            follower = ChainFollower(tracker, config.output_file, config.from_block, config.confirmations, config.poll_interval, config.append)
+            follower.run(config.to_block)
+        else:
+            tracker.track(config.from_block, config.to_block, config.output_file, config.append)
+    finally:
+        if exporter is not None:
+            stop_reporter.set()
+            logger.info(f"Metrics: {summary_line(exporter.export())}")
+            exporter.close()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,192 @@
+"""Adaptive sizing of the block windows passed to eth_getLogs.
+
+The controller grows the window while responses stay small and fast, halves it
+when the provider refuses a request because the answer would be too large, and
+remembers the learned event density per contract in a small JSON state file so
+that the next run starts from a sensible window instead of the default one.
+"""
+import json
+import os
+import tempfile
+import time
+from .metrics import METRICS
+
+# the error messages providers return when a get_logs response would be too
+# big (too many logs, too many bytes, too many blocks)
+RANGE_LIMIT_MESSAGES = (
+    'query returned more than',  # geth, infura
+    'too many results',
+    'log response size exceeded',  # alchemy
+    'response size exceeded',
+    'response size should not',
+    'response is too big',
+    'logs matched by query exceeds limit',
+    'query exceeds max results',
+    'block range is too wide',  # ankr
+    'block range too large',
+    'exceed maximum block range',  # bsc and polygon nodes
+    'eth_getlogs is limited to',  # quicknode
+    'range too large',
+    'query timeout exceeded',
+    'payload too large',
+)
+# "limit exceeded" in EIP-1474, which infura also answers when rate limiting
+RANGE_LIMIT_CODES = (-32005,)
+RATE_LIMIT_MESSAGES = ('rate limit', 'request rate', 'too many requests', 'request count', 'per second')
+
+
+def error_code(ex):
+    """The JSON-RPC error code of an exception raised by get_logs, None if it has none."""
+    code = getattr(ex, 'code', None)
+    if code is None and ex.args and isinstance(ex.args[0], dict):
+        code = ex.args[0].get('code')
+    if code is None and isinstance(getattr(ex, 'rpc_response', None), dict):
+        code = (ex.rpc_response.get('error') or {}).get('code')
+    return code
+
+
+def is_range_limit_error(ex):
+    """Tell whether an exception raised by get_logs means the window was too large."""
+    message = str(ex).lower()
+    if any(fragment in message for fragment in RATE_LIMIT_MESSAGES):
+        return False
+    return any(fragment in message for fragment in RANGE_LIMIT_MESSAGES) or error_code(ex) in RANGE_LIMIT_CODES
+
+
+class AdaptiveRangeController:
+    """
+    Keeps the size of the next get_logs window.
+
+    Args:
+        initial_size (int): Window used before anything is known about the contract.
+        min_size (int): The window is never shrunk below this number of blocks.
+        max_size (int): The window is never grown above this number of blocks.
+        target_logs (int): Number of logs a single response should stay under.
+        target_latency (float): Seconds a single response should stay under.
+        growth (float): Maximum factor the window can grow by after one response.
+        smoothing (float): Weight of the last response in the density moving average.
+    """
+    def __init__(self, initial_size=2000, min_size=1, max_size=500000, target_logs=5000,
+                 target_latency=5.0, growth=2.0, smoothing=0.3):
+        self.size = max(min_size, min(int(initial_size), max_size))
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_logs = target_logs
+        self.target_latency = target_latency
+        self.growth = growth
+        self.smoothing = smoothing
+        # logs per block, None until the first response
+        self.density = None
+
+    def shrink(self):
+        """Halve the window, returns False if it is already at its minimum."""
+        if self.size <= self.min_size:
+            return False
+        self.size = max(self.min_size, self.size // 2)
+        return True
+
+    def update(self, n_blocks, n_logs, elapsed):
+        """Adjust the window after a successful response of n_logs over n_blocks."""
+        density = n_logs / max(n_blocks, 1)
+        if self.density is None:
+            self.density = density
+        else:
+            self.density = self.smoothing * density + (1 - self.smoothing) * self.density
+
+        if n_logs > self.target_logs or elapsed > self.target_latency:
+            self.shrink()
+            return
+
+        if self.density > 0:
+            estimate = self.target_logs / self.density
+        else:
+            estimate = self.max_size
+        ceiling = min(self.size * self.growth, self.max_size)
+        self.size = int(max(self.min_size, min(estimate, ceiling)))
+
+    def to_state(self):
+        return {'size': self.size, 'density': self.density}
+
+    def load_state(self, state):
+        """Start from a window learned by a previous run."""
+        if not state:
+            return
+        self.density = state.get('density')
+        if self.density:
+            size = self.target_logs / self.density
+        else:
+            size = state.get('size', self.size)
+        self.size = int(max(self.min_size, min(size, self.max_size)))
+
+
+def range_state_key(address, topics):
+    addresses = address if isinstance(address, (list, tuple)) else [address]
+    return f"{','.join(a.lower() for a in addresses)}:{','.join(str(t).lower() for t in topics)}"
+
+
+def load_range_state(path, key):
+    """Read the state stored for key, or None if the file or the key do not exist."""
+    if path is None or not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            return json.load(f).get(key)
+    except (OSError, ValueError):
+        return None
+
+
+def save_range_state(path, key, controller):
+    """
+    Store the controller state under key.
+
+    Several processes of the same run may save at the same time, the file is
+    replaced atomically so a reader never sees a half written file.
+    """
+    if path is None:
+        return
+    states = {}
+    if os.path.exists(path):
+        try:
+            with open(path) as f:
+                states = json.load(f)
+        except (OSError, ValueError):
+            states = {}
+    states[key] = controller.to_state()
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(states, f)
+    os.replace(tmp_path, path)
+
+
+def fetch_range(fetch_logs, from_block, to_block, controller):
+    """
+    Walk [from_block, to_block] with windows sized by the controller.
+
+    Args:
+        fetch_logs (callable): fetch_logs(from_block, to_block) returning the list of logs.
+        from_block (int): First block, included.
+        to_block (int): Last block, included.
+        controller (AdaptiveRangeController): Sizes the windows.
+
+    Yields:
+        tuple: (window_from, window_to, logs) in block order.
+    """
+    step = int(from_block)
+    to_block = int(to_block)
+    while step <= to_block:
+        toblock = min(step + controller.size - 1, to_block)
+        started = time.monotonic()
+        try:
+            logs = fetch_logs(step, toblock)
+        except Exception as ex:
+            # retry the same start with a smaller window
+            if toblock > step and is_range_limit_error(ex) and controller.shrink():
+                METRICS.inc('retries_total', reason='range_limit')
+                print(f"Window {step}-{toblock} too large, retrying with {controller.size} blocks")
+                continue
+            raise
+        controller.update(toblock - step + 1, len(logs), time.monotonic() - started)
+        yield step, toblock, logs
+        step = toblock + 1
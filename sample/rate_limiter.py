@@ -0,0 +1,141 @@
+"""Token bucket shared by all the processes of a run.
+
+The bucket lives in shared memory created by the parent process and handed to
+the workers, so every request to the provider, from any worker, draws from the
+same requests per second and compute units per second budget. A 429 answer
+pauses all the workers for the Retry-After delay instead of letting each of
+them retry on its own.
+"""
+import json
+import multiprocessing
+import time
+import requests
+
+# compute units charged by the providers per method (Alchemy's table),
+# methods not listed cost DEFAULT_COMPUTE_UNITS
+COMPUTE_UNITS = {
+    'eth_getLogs': 75,
+    'eth_blockNumber': 10,
+    'eth_chainId': 0,
+    'eth_getBlockByNumber': 16,
+    'eth_getTransactionByHash': 17,
+    'eth_getTransactionReceipt': 15,
+}
+DEFAULT_COMPUTE_UNITS = 20
+
+# pause when a 429 comes without a usable Retry-After header
+DEFAULT_RETRY_AFTER = 1.0
+
+# indexes of the shared state
+REQUEST_TOKENS, UNIT_TOKENS, LAST_REFILL, PAUSED_UNTIL = range(4)
+
+
+def compute_units(methods):
+    return sum(COMPUTE_UNITS.get(m, DEFAULT_COMPUTE_UNITS) for m in methods)
+
+
+def retry_after_seconds(value):
+    """Seconds to wait from a Retry-After header, only the delay form is supported."""
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return DEFAULT_RETRY_AFTER
+
+
+class RateLimiter:
+    """
+    Token bucket limiting requests and compute units per second.
+
+    Create it in the parent process and pass it to the worker processes
+    (as a Process argument, or inside the EventTrackerConfig).
+
+    Args:
+        requests_per_second (float): Requests allowed per second, unlimited if None.
+        compute_units_per_second (float): Compute units allowed per second, unlimited if None.
+        burst (float): Seconds of budget that can be spent at once after an idle period.
+        context: multiprocessing context the shared memory is created with.
+    """
+    def __init__(self, requests_per_second=None, compute_units_per_second=None, burst=1.0, context=None):
+        context = context if context is not None else multiprocessing
+        self.requests_per_second = requests_per_second
+        self.compute_units_per_second = compute_units_per_second
+        self.burst = burst
+        self.lock = context.Lock()
+        self.state = context.RawArray('d', 4)
+        self.state[REQUEST_TOKENS] = (requests_per_second or 0) * burst
+        self.state[UNIT_TOKENS] = (compute_units_per_second or 0) * burst
+        self.state[LAST_REFILL] = time.time()
+
+    def reserve(self, requests=1, units=0):
+        """
+        Take the tokens of a request and return the seconds to wait before sending it.
+
+        The tokens are taken right away, going below zero if needed, so the
+        callers are served in the order they reserved.
+        """
+        with self.lock:
+            now = time.time()
+            elapsed = max(0.0, now - self.state[LAST_REFILL])
+            self.state[LAST_REFILL] = now
+            wait = max(0.0, self.state[PAUSED_UNTIL] - now)
+            for index, rate, cost in ((REQUEST_TOKENS, self.requests_per_second, requests),
+                                      (UNIT_TOKENS, self.compute_units_per_second, units)):
+                if not rate:
+                    continue
+                tokens = min(rate * self.burst, self.state[index] + elapsed * rate) - cost
+                self.state[index] = tokens
+                if tokens < 0:
+                    wait = max(wait, -tokens / rate)
+            return wait
+
+    def acquire(self, requests=1, units=0):
+        wait = self.reserve(requests, units)
+        if wait > 0:
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Stop every process sending requests for the given seconds."""
+        with self.lock:
+            self.state[PAUSED_UNTIL] = max(self.state[PAUSED_UNTIL], time.time() + seconds)
+
+
+def payload_methods(data=None, json_payload=None):
+    """JSON-RPC methods of a request body, a batch counts all its calls."""
+    payload = json_payload
+    if payload is None and data is not None:
+        try:
+            payload = json.loads(data)
+        except (TypeError, ValueError):
+            return []
+    if isinstance(payload, dict):
+        payload = [payload]
+    return [call.get('method') for call in payload or [] if isinstance(call, dict)]
+
+
+class RateLimitedSession(requests.Session):
+    """
+    requests.Session drawing every JSON-RPC POST from a RateLimiter.
+
+    Used by the web3 HTTPProvider and by the JsonRpcBatchClient. A 429 answer
+    pauses the limiter of all the processes and the request is sent again.
+
+    Args:
+        limiter (RateLimiter): The shared bucket.
+        max_attempts (int): Number of 429 answers before the last one is returned.
+    """
+    def __init__(self, limiter, max_attempts=5):
+        super().__init__()
+        self.limiter = limiter
+        self.max_attempts = max_attempts
+
+    def post(self, url, data=None, json=None, **kwargs):
+        methods = payload_methods(data, json)
+        for attempt in range(self.max_attempts):
+            self.limiter.acquire(len(methods) or 1, compute_units(methods))
+            response = super().post(url, data=data, json=json, **kwargs)
+            if response.status_code != 429 or attempt == self.max_attempts - 1:
+                return response
+            delay = retry_after_seconds(response.headers.get('Retry-After'))
+            print(f"Rate limited by the provider, pausing all the workers for {delay} seconds")
+            self.limiter.pause(delay)
+        return response
@@ -0,0 +1,168 @@
+"""JSON-RPC batch requests for eth_getLogs.
+
+Several consecutive block windows are packed in a single HTTP POST and the
+responses are split back per window. Providers that refuse batches, or refuse
+batches of a given size, make the fetch fall back to smaller batches and in
+the end to one request per window.
+
+The client also serves the fast path of single get_logs requests: the logs are
+returned as parsed from the JSON answer, with hex strings, without going
+through web3's middlewares and formatters. orjson is used to parse the answers
+when it is installed.
+"""
+import json
+import time
+import requests
+try:
+    import orjson
+except ImportError:
+    orjson = None
+from .range_controller import fetch_range, is_range_limit_error
+from .metrics import METRICS
+
+# HTTP status codes used by providers to refuse a batch as a whole
+BATCH_REJECTED_STATUS = (400, 405, 413, 501)
+
+
+class JsonRpcError(Exception):
+    """Error object returned by the node for a single request."""
+    def __init__(self, code, message):
+        super().__init__(f"{code}: {message}")
+        self.code = code
+        self.message = message
+
+
+class BatchRejectedError(Exception):
+    """The provider did not accept the batch as a whole."""
+
+
+def to_rpc_filter(filter_params):
+    """Turn the filter built by make_filter into eth_getLogs JSON params."""
+    rpc_filter = dict(filter_params)
+    rpc_filter['fromBlock'] = hex(int(filter_params['fromBlock']))
+    rpc_filter['toBlock'] = hex(int(filter_params['toBlock']))
+    return rpc_filter
+
+
+class JsonRpcBatchClient:
+    """
+    Minimal client posting JSON-RPC batches.
+
+    Args:
+        rpc (str): The RPC connection string.
+        timeout (int): Timeout of the HTTP request in seconds.
+        session (requests.Session): Session to reuse, a new one is created if None.
+    """
+    def __init__(self, rpc, timeout=40, session=None):
+        self.rpc = rpc
+        self.timeout = timeout
+        self.session = session if session is not None else requests.Session()
+
+    def post(self, payload):
+        """Post a JSON-RPC payload and return the parsed answer."""
+        if orjson is not None:
+            response = self.session.post(self.rpc, data=orjson.dumps(payload), timeout=self.timeout,
+                                         headers={'Content-Type': 'application/json'})
+        else:
+            response = self.session.post(self.rpc, json=payload, timeout=self.timeout)
+        if response.status_code in BATCH_REJECTED_STATUS and isinstance(payload, list):
+            raise BatchRejectedError(f"HTTP {response.status_code}: {response.text[:200]}")
+        response.raise_for_status()
+        return orjson.loads(response.content) if orjson is not None else json.loads(response.content)
+
+    def call(self, method, params):
+        """A single request, raising JsonRpcError if the node answers with an error."""
+        body = self.post({'jsonrpc': '2.0', 'id': 0, 'method': method, 'params': params})
+        if 'error' in body:
+            raise JsonRpcError(body['error'].get('code'), body['error'].get('message'))
+        return body.get('result')
+
+    def get_logs(self, filter_params):
+        """The raw logs of a filter built by make_filter."""
+        return self.call('eth_getLogs', [to_rpc_filter(filter_params)])
+
+    def call_batch(self, calls):
+        """
+        Post a batch of (method, params) calls.
+
+        Returns:
+            list: One entry per call, in order, either the result or a JsonRpcError.
+        """
+        payload = [
+            {'jsonrpc': '2.0', 'id': i, 'method': method, 'params': params}
+            for i, (method, params) in enumerate(calls)
+        ]
+        body = self.post(payload)
+        # a single error object instead of a list means the batch itself was refused
+        if not isinstance(body, list):
+            error = body.get('error', {}) if isinstance(body, dict) else {}
+            raise BatchRejectedError(error.get('message', str(body)[:200]))
+
+        by_id = {item.get('id'): item for item in body if isinstance(item, dict)}
+        results = []
+        for i in range(len(calls)):
+            item = by_id.get(i)
+            if item is None:
+                results.append(JsonRpcError(None, 'missing response in batch'))
+            elif 'error' in item:
+                results.append(JsonRpcError(item['error'].get('code'), item['error'].get('message')))
+            else:
+                results.append(item.get('result'))
+        return results
+
+    def get_logs_batch(self, filters):
+        return self.call_batch([('eth_getLogs', [to_rpc_filter(f)]) for f in filters])
+
+
+def fetch_range_batched(fetch_batch, fetch_logs, from_block, to_block, controller, batch_size):
+    """
+    Walk [from_block, to_block] sending batch_size windows per HTTP request.
+
+    Args:
+        fetch_batch (callable): fetch_batch(windows) returning, for each (from, to) window,
+            the list of logs or the exception raised for that window.
+        fetch_logs (callable): fetch_logs(from_block, to_block) used for single requests.
+        from_block (int): First block, included.
+        to_block (int): Last block, included.
+        controller (AdaptiveRangeController): Sizes the windows.
+        batch_size (int): Number of windows in a batch.
+
+    Yields:
+        tuple: (window_from, window_to, logs) in block order.
+    """
+    step = int(from_block)
+    to_block = int(to_block)
+    while step <= to_block:
+        if batch_size <= 1:
+            yield from fetch_range(fetch_logs, step, to_block, controller)
+            return
+
+        windows = []
+        start = step
+        while start <= to_block and len(windows) < batch_size:
+            end = min(start + controller.size - 1, to_block)
+            windows.append((start, end))
+            start = end + 1
+
+        started = time.monotonic()
+        try:
+            results = fetch_batch(windows)
+        except BatchRejectedError as ex:
+            batch_size //= 2
+            METRICS.inc('retries_total', reason='batch_rejected')
+            print(f"Batch rejected by the provider ({ex}), using batches of {batch_size}")
+            continue
+        # the windows of a batch share the time of the request
+        elapsed = (time.monotonic() - started) / len(windows)
+
+        for (window_from, window_to), logs in zip(windows, results):
+            if isinstance(logs, Exception):
+                # fetch this window on its own, shrinking it if it was too large
+                METRICS.inc('retries_total', reason='range_limit' if is_range_limit_error(logs) else 'batch_element')
+                if not is_range_limit_error(logs):
+                    print(f"Batch element {window_from}-{window_to} failed: {logs}, retrying it alone")
+                yield from fetch_range(fetch_logs, window_from, window_to, controller)
+            else:
+                controller.update(window_to - window_from + 1, len(logs), elapsed)
+                yield window_from, window_to, logs
+        step = windows[-1][1] + 1
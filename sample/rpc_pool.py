@@ -0,0 +1,230 @@
+"""Pool of RPC endpoints with latency aware routing and hedged requests.
+
+Each request goes to the endpoint with the lowest expected latency for its
+weight. When it takes longer than a latency percentile of that endpoint, a
+duplicate is sent to the next best endpoint and the first answer wins, so one
+slow provider does not stall a range. Endpoints failing several times in a row
+are ejected for a while, and the request is sent again to another one.
+"""
+import asyncio
+import collections
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import aiohttp
+import requests
+
+# answers counted as an endpoint failure besides the exceptions
+FAILURE_STATUS = (429, 500, 502, 503, 504)
+# exceptions of the async engine sending the request to another endpoint
+ENDPOINT_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError, OSError)
+
+
+class Endpoint:
+    """One RPC endpoint and its recent statistics."""
+    def __init__(self, url, weight=1.0, session=None, window=100):
+        self.url = url
+        self.weight = weight
+        self.session = session if session is not None else requests.Session()
+        self.latencies = collections.deque(maxlen=window)
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+
+    def expected_latency(self):
+        if not self.latencies:
+            # unknown endpoints are tried first
+            return 0.0
+        return sum(self.latencies) / len(self.latencies)
+
+    def percentile(self, q):
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def summary(self):
+        return {
+            'url': self.url,
+            'requests': self.requests,
+            'errors': self.errors,
+            'mean_latency': round(self.expected_latency(), 3),
+            'ejections': self.ejections,
+        }
+
+
+class RpcPool:
+    """
+    Routes requests over several endpoints.
+
+    Args:
+        urls (list): The RPC connection strings.
+        weights (list): Relative share of the requests of each endpoint, 1 each if None.
+        session_factory (callable): Builds the requests.Session of an endpoint.
+        hedge_percentile (float): Latency percentile of an endpoint after which a duplicate is sent.
+        min_samples (int): Requests to observe on an endpoint before hedging its requests.
+        max_failures (int): Consecutive failures ejecting an endpoint.
+        eject_seconds (float): First ejection delay, doubled at each new ejection up to max_eject_seconds.
+        max_eject_seconds (float): Longest ejection.
+    """
+    def __init__(self, urls, weights=None, session_factory=requests.Session, hedge_percentile=0.95,
+                 min_samples=10, max_failures=3, eject_seconds=30.0, max_eject_seconds=600.0):
+        weights = weights or [1.0] * len(urls)
+        if len(weights) != len(urls):
+            raise ValueError(f"{len(weights)} weights given for {len(urls)} endpoints")
+        self.endpoints = [Endpoint(url, float(weight), session_factory()) for url, weight in zip(urls, weights)]
+        self.hedge_percentile = hedge_percentile
+        self.min_samples = min_samples
+        self.max_failures = max_failures
+        self.eject_seconds = eject_seconds
+        self.max_eject_seconds = max_eject_seconds
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=2 * len(urls) + 2)
+
+    def choose(self, exclude=()):
+        """The healthiest endpoint not in exclude, None if there is none."""
+        with self.lock:
+            now = time.time()
+            candidates = [e for e in self.endpoints if e not in exclude]
+            if not candidates:
+                return None
+            available = [e for e in candidates if e.ejected_until <= now]
+            if not available:
+                # everything is ejected, the one coming back first is the best bet
+                endpoint = min(candidates, key=lambda e: e.ejected_until)
+            else:
+                endpoint = min(available, key=lambda e: e.expected_latency() * (1 + e.in_flight) / e.weight)
+            endpoint.in_flight += 1
+            endpoint.requests += 1
+            return endpoint
+
+    def hedge_delay(self, endpoint):
+        """Seconds after which a duplicate of a request sent to endpoint is sent elsewhere."""
+        if len(self.endpoints) < 2 or len(endpoint.latencies) < self.min_samples:
+            return None
+        return endpoint.percentile(self.hedge_percentile)
+
+    def record(self, endpoint, elapsed, ok):
+        with self.lock:
+            endpoint.in_flight = max(0, endpoint.in_flight - 1)
+            if ok:
+                endpoint.latencies.append(elapsed)
+                endpoint.consecutive_failures = 0
+                return
+            endpoint.errors += 1
+            endpoint.consecutive_failures += 1
+            if endpoint.consecutive_failures >= self.max_failures:
+                endpoint.ejections += 1
+                delay = min(self.eject_seconds * 2 ** (endpoint.ejections - 1), self.max_eject_seconds)
+                endpoint.ejected_until = time.time() + delay
+                endpoint.consecutive_failures = 0
+                print(f"Ejecting endpoint {endpoint.url} for {delay} seconds")
+
+    def _attempt(self, call, endpoint):
+        started = time.monotonic()
+        try:
+            result = call(endpoint)
+        except Exception:
+            self.record(endpoint, time.monotonic() - started, False)
+            raise
+        ok = getattr(result, 'status_code', 200) not in FAILURE_STATUS
+        self.record(endpoint, time.monotonic() - started, ok)
+        return result, ok
+
+    def call(self, call):
+        """
+        Run call(endpoint) on the best endpoint, hedged and failed over to the others.
+
+        A result with a FAILURE_STATUS status_code is retried on another endpoint,
+        the last one is returned if every endpoint fails.
+        """
+        tried = []
+        last_error = None
+        last_result = None
+        while True:
+            endpoint = self.choose(exclude=tried)
+            if endpoint is None:
+                if last_result is not None:
+                    return last_result
+                raise last_error
+            tried.append(endpoint)
+            pending = {self.executor.submit(self._attempt, call, endpoint)}
+            delay = self.hedge_delay(endpoint)
+            done, _ = wait(pending, timeout=delay)
+            if not done:
+                hedge = self.choose(exclude=tried)
+                if hedge is not None:
+                    tried.append(hedge)
+                    pending.add(self.executor.submit(self._attempt, call, hedge))
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        result, ok = future.result()
+                    except Exception as ex:
+                        last_error = ex
+                        continue
+                    if ok:
+                        # the slower duplicate finishes in the background
+                        return result
+                    last_result = result
+
+    async def call_async(self, call):
+        """Same as call with a coroutine function call(endpoint)."""
+        tried = []
+        last_error = None
+
+        async def attempt(endpoint):
+            started = time.monotonic()
+            try:
+                result = await call(endpoint)
+            except ENDPOINT_ERRORS:
+                self.record(endpoint, time.monotonic() - started, False)
+                raise
+            except Exception:
+                # an error answered by the node, e.g. a too large window, is not the endpoint's fault
+                self.record(endpoint, time.monotonic() - started, True)
+                raise
+            self.record(endpoint, time.monotonic() - started, True)
+            return result
+
+        while True:
+            endpoint = self.choose(exclude=tried)
+            if endpoint is None:
+                raise last_error
+            tried.append(endpoint)
+            pending = {asyncio.ensure_future(attempt(endpoint))}
+            done, _ = await asyncio.wait(pending, timeout=self.hedge_delay(endpoint))
+            if not done:
+                hedge = self.choose(exclude=tried)
+                if hedge is not None:
+                    tried.append(hedge)
+                    pending.add(asyncio.ensure_future(attempt(hedge)))
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if isinstance(task.exception(), ENDPOINT_ERRORS):
+                        last_error = task.exception()
+                        continue
+                    for other in pending:
+                        other.cancel()
+                    return task.result()
+
+    def summary(self):
+        return [e.summary() for e in self.endpoints]
+
+
+class PooledSession(requests.Session):
+    """
+    requests.Session sending every POST through an RpcPool.
+
+    The URL given by the caller is replaced by the one of the chosen endpoint,
+    so web3's HTTPProvider and the JsonRpcBatchClient use the pool unchanged.
+    """
+    def __init__(self, pool):
+        super().__init__()
+        self.pool = pool
+
+    def post(self, url, data=None, json=None, **kwargs):
+        return self.pool.call(lambda endpoint: endpoint.session.post(endpoint.url, data=data, json=json, **kwargs))
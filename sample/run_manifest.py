@@ -0,0 +1,117 @@
+"""Manifest of the block ranges of parallel_event_tracker.
+
+A SQLite file in the output directory records, for each range output, its
+status, number of rows, last block written, files, size and checksum. The
+scheduler reads it before starting any worker: ranges done by an earlier run
+whose files are unchanged are skipped right away, only the pending, failed and
+partial ones are queued again. While a range is tracked, the last block and the
+rows its files hold are updated at each checkpoint of its worker, a range left
+partial by a killed worker or run is resumed after that block.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+PENDING = 'pending'
+DONE = 'done'
+PARTIAL = 'partial'
+FAILED = 'failed'
+
+
+def file_digest(paths):
+    """Total size and sha256 of the content of files, in the given order."""
+    digest = hashlib.sha256()
+    size = 0
+    for path in paths:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+                size += len(chunk)
+    return size, digest.hexdigest()
+
+
+class RunManifest:
+    """
+    Status of the range outputs of the runs sharing an output directory.
+
+    Args:
+        path (str): SQLite file, only in memory if None.
+    """
+    def __init__(self, path=None):
+        self.connection = sqlite3.connect(path if path is not None else ':memory:', timeout=60)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS ranges ('
+            'output_file TEXT PRIMARY KEY, from_block INTEGER, to_block INTEGER, status TEXT, '
+            'rows INTEGER, last_block INTEGER, files TEXT, size INTEGER, checksum TEXT, '
+            'error TEXT, attempts INTEGER DEFAULT 0, updated REAL)'
+        )
+        self.connection.commit()
+
+    def get(self, output_file):
+        """The record of a range output as a dict, None if it was never scheduled."""
+        row = self.connection.execute('SELECT * FROM ranges WHERE output_file = ?', (output_file,)).fetchone()
+        if row is None:
+            return None
+        record = dict(row)
+        record['files'] = json.loads(record['files']) if record['files'] else []
+        return record
+
+    def is_done(self, output_file):
+        """Whether a range output was completed and its files were not changed since."""
+        record = self.get(output_file)
+        if record is None or record['status'] != DONE:
+            return False
+        # the sizes only, the files are not read
+        if not all(os.path.exists(path) for path in record['files']):
+            return False
+        return sum(os.path.getsize(path) for path in record['files']) == record['size']
+
+    def ranges(self, from_block, to_block):
+        """Records of the range outputs within [from_block, to_block], in block order."""
+        rows = self.connection.execute(
+            'SELECT output_file FROM ranges WHERE from_block >= ? AND to_block <= ? ORDER BY from_block, to_block',
+            (from_block, to_block)
+        ).fetchall()
+        return [self.get(row['output_file']) for row in rows]
+
+    def remove(self, output_file):
+        """Forget a range output, its files are left as they are."""
+        self.connection.execute('DELETE FROM ranges WHERE output_file = ?', (output_file,))
+        self.connection.commit()
+
+    def schedule(self, ranges):
+        """Mark (from_block, to_block, output_file) ranges as pending, in a single transaction."""
+        now = time.time()
+        self.connection.executemany(
+            'INSERT INTO ranges (output_file, from_block, to_block, status, updated) VALUES (?, ?, ?, ?, ?) '
+            'ON CONFLICT(output_file) DO UPDATE SET status = excluded.status, updated = excluded.updated',
+            [(output_file, from_block, to_block, PENDING, now) for from_block, to_block, output_file in ranges]
+        )
+        self.connection.commit()
+
+    def record(self, output_file, status, rows=None, last_block=None, files=None, size=None, checksum=None, error=None):
+        """Store the outcome of an attempt at a range output."""
+        self.connection.execute(
+            'UPDATE ranges SET status = ?, rows = ?, last_block = ?, files = ?, size = ?, checksum = ?, '
+            'error = ?, attempts = attempts + 1, updated = ? WHERE output_file = ?',
+            (status, rows, last_block, json.dumps(files or []), size, checksum, error, time.time(), output_file)
+        )
+        self.connection.commit()
+
+    def checkpoint(self, output_file, last_block, rows):
+        """Store the last block and the rows committed so far by the attempt at a range output."""
+        self.connection.execute(
+            'UPDATE ranges SET status = ?, rows = ?, last_block = ?, updated = ? WHERE output_file = ?',
+            (PARTIAL, rows, last_block, time.time(), output_file)
+        )
+        self.connection.commit()
+
+    def summary(self):
+        """Number of range outputs by status."""
+        return dict(self.connection.execute('SELECT status, COUNT(*) FROM ranges GROUP BY status').fetchall())
+
+    def close(self):
+        self.connection.close()
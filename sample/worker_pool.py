@@ -0,0 +1,114 @@
+"""Worker processes of parallel_event_tracker and their messages.
+
+Each worker sends its messages on a pipe of its own. The scheduler waits on
+all the pipes and on the sentinels of the processes at once, so it wakes up as
+soon as a message arrives or a worker exits, however long the ranges take, and
+a worker that died is seen at once instead of when all of them are gone.
+Messages are sent synchronously: there is no feeder thread left holding a
+worker back at exit while the scheduler is not reading.
+"""
+import threading
+from multiprocessing.connection import wait
+
+
+class ResultSender:
+    """
+    Sending end of the pipe of a worker, shared by its threads.
+
+    It has the put() of a queue, so the worker does not care which one it is given.
+    """
+    def __init__(self, connection):
+        self.connection = connection
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        # the lock is not sent to the worker, it gets its own
+        return {'connection': self.connection}
+
+    def __setstate__(self, state):
+        self.connection = state['connection']
+        self.lock = threading.Lock()
+
+    def put(self, message):
+        with self.lock:
+            self.connection.send(message)
+
+
+def receive(reader):
+    """
+    The messages waiting on a pipe, and whether its other end is closed.
+    """
+    messages = []
+    try:
+        while reader.poll():
+            messages.append(reader.recv())
+    except (EOFError, OSError):
+        return messages, True
+    return messages, False
+
+
+class WorkerPool:
+    """
+    Worker processes, each sending its messages on its own pipe.
+
+    Args:
+        context: The multiprocessing context starting the processes.
+        target (callable): Function run by the workers.
+        make_args (callable): make_args(worker_id, sender) gives the arguments of
+            target, sender being the ResultSender of the worker.
+    """
+    def __init__(self, context, target, make_args):
+        self.context = context
+        self.target = target
+        self.make_args = make_args
+        # worker id -> (process, reading end of its pipe)
+        self.workers = {}
+        self.started = 0
+
+    def start(self, worker_id):
+        """Start a worker, or a new one in place of a worker that exited."""
+        reader, writer = self.context.Pipe(duplex=False)
+        process = self.context.Process(target=self.target, args=self.make_args(worker_id, ResultSender(writer)), daemon=True)
+        process.start()
+        # the pipe reads EOF once the worker is gone
+        writer.close()
+        self.workers[worker_id] = (process, reader)
+        self.started += 1
+
+    def __len__(self):
+        return len(self.workers)
+
+    def wait(self, timeout=None):
+        """
+        Wait until a worker sends a message or exits, at most timeout seconds.
+
+        Returns:
+            tuple: The messages received, in the order each worker sent them, and
+                the (worker_id, exitcode) of the workers that exited, after their
+                last messages.
+        """
+        handles = {}
+        for worker_id, (process, reader) in self.workers.items():
+            handles[reader] = worker_id
+            handles[process.sentinel] = worker_id
+        messages, exited = [], []
+        for worker_id in sorted({handles[handle] for handle in wait(list(handles), timeout)}):
+            process, reader = self.workers[worker_id]
+            received, closed = receive(reader)
+            messages += received
+            if closed or not process.is_alive():
+                # everything it sent is in the pipe already
+                if not closed:
+                    messages += receive(reader)[0]
+                process.join()
+                reader.close()
+                del self.workers[worker_id]
+                exited.append((worker_id, process.exitcode))
+        return messages, exited
+
+    def terminate(self):
+        for process, reader in self.workers.values():
+            process.terminate()
+            process.join()
+            reader.close()
+        self.workers = {}
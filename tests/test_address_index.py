@@ -0,0 +1,97 @@
+import unittest
+import os
+import tempfile
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from sample.address_index import AddressIndex, address_columns, find_events, index_file, lookup
+from sample.compaction import compact
+from sample.parquet_writer import StreamingParquetWriter
+
+# ten accounts, the last one only in block 777
+ACCOUNTS = ['0x' + f'{i:02x}' * 20 for i in range(10)]
+
+
+class TestAddressIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.output_file = os.path.join(self.tmp_dir.name, 'events-0-999.parquet')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, path, address_type=pa.string(), index=True):
+        schema = pa.schema([('blockNumber', pa.int64()), ('from', address_type), ('to', address_type)])
+        blocks = list(range(1000))
+        senders = [ACCOUNTS[9] if b == 777 else ACCOUNTS[b % 3] for b in blocks]
+        receivers = [ACCOUNTS[3 + b % 2] for b in blocks]
+        if address_type == pa.binary(20):
+            senders, receivers = [bytes.fromhex(a[2:]) for a in senders], [bytes.fromhex(a[2:]) for a in receivers]
+        else:
+            # checksummed or not, the index does not care
+            senders = [a.upper().replace('0X', '0x') for a in senders]
+        with StreamingParquetWriter(path, schema, flush_rows=100, index=AddressIndex(['from', 'to']) if index else None) as writer:
+            for start in range(0, 1000, 50):
+                writer.write(pa.table({'blockNumber': blocks[start:start + 50], 'from': senders[start:start + 50],
+                                       'to': receivers[start:start + 50]}, schema=schema))
+
+    def test_only_the_row_groups_holding_the_address_are_read(self):
+        self.write(self.output_file)
+        self.assertTrue(os.path.exists(index_file(self.output_file)))
+        # nor is the index of a range output by a reader of the output directory
+        self.assertEqual(ds.dataset(self.tmp_dir.name).count_rows(), 1000)
+        self.assertEqual(lookup(self.output_file, ACCOUNTS[9]), [7])
+        self.assertEqual(lookup(self.output_file, ACCOUNTS[1]), list(range(10)))
+        self.assertEqual(lookup(self.output_file, ACCOUNTS[5]), [])
+
+        table = find_events(self.output_file, ACCOUNTS[9])
+        self.assertEqual(table['blockNumber'].to_pylist(), [777])
+        table = find_events(self.output_file, ACCOUNTS[4], columns=['blockNumber'])
+        self.assertEqual(table['blockNumber'].to_pylist(), list(range(1, 1000, 2)))
+        self.assertEqual(find_events(self.output_file, ACCOUNTS[5]).num_rows, 0)
+
+    def test_binary_addresses(self):
+        self.write(self.output_file, pa.binary(20))
+        # block 777 is sent by the last account
+        self.assertEqual(find_events(self.output_file, ACCOUNTS[0]).num_rows, len(range(0, 1000, 3)) - 1)
+
+    def test_files_without_a_valid_index_are_scanned(self):
+        self.write(self.output_file, index=False)
+        # every column that can hold an address is compared
+        self.assertEqual(find_events(self.output_file, ACCOUNTS[9])['blockNumber'].to_pylist(), [777])
+        self.assertEqual(find_events(self.output_file, ACCOUNTS[3], fields=['from']).num_rows, 0)
+        # or the columns the other files are indexed on
+        other_file = os.path.join(self.tmp_dir.name, 'events-1000-1999.parquet')
+        self.write(other_file)
+        self.assertEqual(find_events([self.output_file, other_file], ACCOUNTS[9]).num_rows, 2)
+
+        # an index left by an earlier version of the file is not used
+        self.write(self.output_file)
+        table = pq.read_table(self.output_file).slice(0, 500)
+        pq.write_table(table, self.output_file)
+        self.assertIsNone(lookup(self.output_file, ACCOUNTS[9]))
+        self.assertEqual(find_events(self.output_file, ACCOUNTS[3])['blockNumber'].to_pylist(), list(range(0, 500, 2)))
+
+    def test_compacted_partitions_are_indexed(self):
+        self.write(self.output_file)
+        compact(self.tmp_dir.name, 'events', bucket_blocks=500)
+        dataset_dir = os.path.join(self.tmp_dir.name, '_events.dataset')
+        part = os.path.join(dataset_dir, 'block_bucket=500', 'part-0.parquet')
+        self.assertEqual(lookup(part, ACCOUNTS[9]), [0])
+        self.assertEqual(find_events(dataset_dir, ACCOUNTS[9])['blockNumber'].to_pylist(), [777])
+        # the indexes of the partitions are not read as data
+        self.assertEqual(ds.dataset(dataset_dir).count_rows(), 1000)
+
+    def test_indexed_parameters_come_from_the_abi(self):
+        event = {'event_name': 'Transfer', 'fields': ['from', 'to', 'value'], 'types': ['address', 'address', 'uint256'],
+                 'indexed': [False, False, False]}
+        abi = {'inputs': [{'name': 'from', 'type': 'address', 'indexed': True},
+                          {'name': 'to', 'type': 'address', 'indexed': True},
+                          {'name': 'value', 'type': 'uint256', 'indexed': False}]}
+        self.assertEqual(address_columns(event), [])
+        self.assertEqual(address_columns(event, abi), ['from', 'to'])
+
+if __name__ == "__main__":
+    unittest.main()
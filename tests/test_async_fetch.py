@@ -0,0 +1,80 @@
+import unittest
+import asyncio
+import aiohttp
+
+from sample.async_fetch import fetch_range_async, fetch_window, iterate_async
+from sample.range_controller import AdaptiveRangeController
+
+
+class FakeNode:
+    """Answers one log per block, the earlier windows the slowest, so that they complete out of order."""
+    def __init__(self, max_blocks=None, failing=None):
+        self.max_blocks = max_blocks
+        self.failing = failing
+        self.running = 0
+        self.max_running = 0
+        self.calls = []
+
+    async def fetch_logs(self, from_block, to_block):
+        self.calls.append((from_block, to_block))
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            await asyncio.sleep(0.02 * (1 - from_block / 1000))
+            if self.failing is not None and from_block <= self.failing <= to_block:
+                raise ValueError('execution reverted')
+            if self.max_blocks is not None and to_block - from_block + 1 > self.max_blocks:
+                raise ValueError({'code': -32005, 'message': 'query returned more than 10000 results'})
+            return list(range(from_block, to_block + 1))
+        finally:
+            self.running -= 1
+
+
+class TestAsyncFetch(unittest.TestCase):
+
+    def fetch(self, node, in_flight, to_block=999):
+        controller = AdaptiveRangeController(initial_size=50, max_size=50)
+        return iterate_async(fetch_range_async(node.fetch_logs, 0, to_block, controller, in_flight))
+
+    def test_windows_come_in_block_order(self):
+        node = FakeNode()
+        windows = list(self.fetch(node, 4))
+        self.assertEqual([w[:2] for w in windows], [(b, b + 49) for b in range(0, 1000, 50)])
+        self.assertEqual([log for _, _, logs in windows for log in logs], list(range(1000)))
+        # several requests ran at once, never more than in_flight
+        self.assertGreater(node.max_running, 1)
+        self.assertLessEqual(node.max_running, 4)
+
+    def test_windows_too_large_are_split_in_order(self):
+        node = FakeNode(max_blocks=20)
+        windows = list(self.fetch(node, 3))
+        self.assertTrue(all(to_block - from_block < 20 for from_block, to_block, _ in windows))
+        for previous, current in zip(windows, windows[1:]):
+            self.assertEqual(previous[1] + 1, current[0])
+        self.assertEqual([log for _, _, logs in windows for log in logs], list(range(1000)))
+
+    def test_errors_reach_the_caller_after_the_windows_before_them(self):
+        node = FakeNode(failing=420)
+        received = []
+        with self.assertRaises(ValueError) as raised:
+            for window in self.fetch(node, 4):
+                received.append(window[:2])
+        self.assertEqual(str(raised.exception), 'execution reverted')
+        self.assertEqual(received, [(b, b + 49) for b in range(0, 400, 50)])
+
+    def test_network_errors_are_retried(self):
+        attempts = []
+
+        async def fetch_logs(from_block, to_block):
+            attempts.append((from_block, to_block))
+            if len(attempts) == 1:
+                raise aiohttp.ClientConnectionError('connection reset')
+            return [from_block]
+
+        controller = AdaptiveRangeController(initial_size=10)
+        pieces = asyncio.run(fetch_window(fetch_logs, 0, 9, controller, asyncio.Semaphore(1), delay=0))
+        self.assertEqual(pieces, [(0, 9, [0])])
+        self.assertEqual(attempts, [(0, 9), (0, 9)])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+import unittest
+import json
+import random
+from eth_abi import encode
+from hexbytes import HexBytes
+from web3 import Web3
+from web3.datastructures import AttributeDict
+
+from sample.log_decoder import generate_event_abi_map, decode_log, parse_raw_log
+from sample.bulk_decoder import BulkEventDecoder, checksum_addresses
+
+
+class TestBulkDecoder(unittest.TestCase):
+
+    def setUp(self):
+        with open('tests/stETH.json') as f:
+            self.contract_abi = json.load(f)
+        self.contract = Web3().eth.contract(address='0xae7ab96520DE3A18E5e111B5EaAb095312D7fE84', abi=self.contract_abi)
+        self.event_abi_map = generate_event_abi_map(self.contract_abi)
+
+    def make_logs(self, topic, event_abi, n):
+        rng = random.Random(0)
+        logs = []
+        for i in range(n):
+            topics = [HexBytes(topic)]
+            data_types, data_values = [], []
+            for param in event_abi['inputs']:
+                if param['type'] == 'address':
+                    # addresses ending with zero bytes are the tricky ones
+                    value = Web3.to_checksum_address('0x' + rng.randbytes(18).hex() + '0000')
+                else:
+                    value = rng.getrandbits(rng.choice([8, 64, 256]))
+                if param['indexed']:
+                    topics.append(HexBytes(encode([param['type']], [value])))
+                else:
+                    data_types.append(param['type'])
+                    data_values.append(value)
+            logs.append(AttributeDict({
+                'address': self.contract.address,
+                'blockHash': HexBytes(rng.randbytes(32)),
+                'blockNumber': 17000000 + i,
+                'data': HexBytes(encode(data_types, data_values)),
+                'logIndex': 0,
+                'removed': False,
+                'topics': topics,
+                'transactionHash': HexBytes(rng.randbytes(32)),
+                'transactionIndex': 0,
+            }))
+        return logs
+
+    def test_same_values_as_web3(self):
+        for topic, event_abi in self.event_abi_map.items():
+            if event_abi['name'] not in ('Transfer', 'TransferShares', 'SharesBurnt', 'TokenRebased'):
+                continue
+            logs = self.make_logs(topic, event_abi, 50)
+            decoder = BulkEventDecoder(event_abi)
+            self.assertTrue(decoder.supported)
+            columns = decoder.decode(logs)
+            for i, log in enumerate(logs):
+                expected = decode_log(log, self.event_abi_map, self.contract)
+                self.assertEqual(columns['blockNumber'][i], expected['blockNumber'])
+                self.assertEqual(columns['transactionHash'][i], expected['transactionHash'])
+                for param in event_abi['inputs']:
+                    self.assertEqual(columns[param['name']][i], expected['args'][param['name']])
+
+    def test_raw_logs_of_the_fast_path(self):
+        topic, event_abi = next((t, e) for t, e in self.event_abi_map.items() if e['name'] == 'Transfer')
+        logs = self.make_logs(topic, event_abi, 20)
+        raw_logs = [parse_raw_log({
+            'address': log['address'].lower(),
+            'blockHash': '0x' + log['blockHash'].hex(),
+            'blockNumber': hex(log['blockNumber']),
+            'data': '0x' + log['data'].hex(),
+            'logIndex': hex(log['logIndex']),
+            'topics': ['0x' + t.hex() for t in log['topics']],
+            'transactionHash': '0x' + log['transactionHash'].hex(),
+            'transactionIndex': hex(log['transactionIndex']),
+        }) for log in logs]
+        decoder = BulkEventDecoder(event_abi)
+        expected = decoder.decode(logs)
+        columns = decoder.decode(raw_logs)
+        for name in expected:
+            self.assertEqual(list(columns[name]), list(expected[name]))
+
+    def test_checksum_addresses(self):
+        rng = random.Random(1)
+        addresses = [rng.randbytes(20) for _ in range(200)] + [bytes(20), b'\xff' * 20]
+        self.assertEqual(checksum_addresses(addresses), [Web3.to_checksum_address('0x' + a.hex()) for a in addresses])
+
+    def test_empty_logs(self):
+        topic, event_abi = next((t, e) for t, e in self.event_abi_map.items() if e['name'] == 'Transfer')
+        columns = BulkEventDecoder(event_abi).decode([])
+        self.assertEqual(len(columns['value']), 0)
+
+if __name__ == "__main__":
+    unittest.main()
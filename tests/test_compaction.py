@@ -0,0 +1,100 @@
+import unittest
+import os
+import tempfile
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from sample.compaction import compact, read_dataset
+from sample.output_dataset import fragment_file
+from sample.parquet_writer import StreamingParquetWriter
+
+
+class TestCompaction(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.output_dir = self.tmp_dir.name
+        self.dataset_dir = os.path.join(self.output_dir, '_events.dataset')
+        self.schema = pa.schema([('blockNumber', pa.int64()), ('value', pa.string()),
+                                 ('timestamp', pa.timestamp('ms', tz='UTC'))])
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_range(self, from_block, to_block, name=None, step=7):
+        """One event every step blocks, written in two row groups."""
+        path = name or os.path.join(self.output_dir, f'events-{from_block}-{to_block}.parquet')
+        blocks = list(range(from_block, to_block + 1, step))
+        with StreamingParquetWriter(path, self.schema, flush_rows=len(blocks) // 2 + 1) as writer:
+            writer.write(pa.table({
+                'blockNumber': pa.array(blocks, pa.int64()),
+                'value': [str(b) for b in blocks],
+                # a block every 12 seconds from 2024-01-01
+                'timestamp': pa.array([(1704067200 + 12 * b) * 1000 for b in blocks], pa.timestamp('ms', tz='UTC')),
+            }))
+        return blocks
+
+    def test_partitions_and_metadata(self):
+        blocks = self.write_range(0, 999) + self.write_range(1000, 1999) + self.write_range(2000, 2499)
+        rewritten = compact(self.output_dir, 'events', bucket_blocks=1000, row_group_rows=50)
+        self.assertEqual(rewritten, ['block_bucket=0', 'block_bucket=1000', 'block_bucket=2000'])
+
+        table = read_dataset(self.dataset_dir)
+        self.assertEqual(table.num_rows, len(blocks))
+        self.assertEqual(sorted(table['blockNumber'].to_pylist()), blocks)
+        part = pq.ParquetFile(os.path.join(self.dataset_dir, 'block_bucket=1000', 'part-0.parquet'))
+        self.assertEqual(part.read()['blockNumber'].to_pylist(), [b for b in blocks if 1000 <= b < 2000])
+        self.assertTrue(all(part.metadata.row_group(i).num_rows <= 100 for i in range(part.num_row_groups)))
+        metadata = pq.read_metadata(os.path.join(self.dataset_dir, '_metadata'))
+        self.assertEqual(metadata.num_rows, len(blocks))
+        # the partition column comes from the directories
+        bucket = read_dataset(self.dataset_dir, filter=pc.field('block_bucket') == 2000)
+        self.assertEqual(bucket['blockNumber'].to_pylist(), [b for b in blocks if b >= 2000])
+        # a reader of the output directory sees the range outputs only
+        self.assertEqual(ds.dataset(self.output_dir).count_rows(), len(blocks))
+
+    def test_later_runs_only_rewrite_the_partitions_they_touch(self):
+        self.write_range(0, 999)
+        self.write_range(1000, 1499)
+        compact(self.output_dir, 'events', bucket_blocks=1000)
+        self.assertEqual(compact(self.output_dir, 'events', bucket_blocks=1000), [])
+
+        # an appended range and a fragment of the previous one
+        first = os.path.getmtime(os.path.join(self.dataset_dir, 'block_bucket=0', 'part-0.parquet'))
+        self.write_range(1500, 2199)
+        self.write_range(1500, 1599, name=fragment_file(os.path.join(self.output_dir, 'events-1000-1499.parquet'), 1500, 1599), step=50)
+        self.assertEqual(compact(self.output_dir, 'events', bucket_blocks=1000), ['block_bucket=1000', 'block_bucket=2000'])
+        self.assertEqual(os.path.getmtime(os.path.join(self.dataset_dir, 'block_bucket=0', 'part-0.parquet')), first)
+        self.assertEqual(read_dataset(self.dataset_dir).num_rows, len(range(0, 2200, 7)) + 2)
+
+        # a removed source empties its partition
+        os.remove(os.path.join(self.output_dir, 'events-1500-2199.parquet'))
+        self.assertEqual(compact(self.output_dir, 'events', bucket_blocks=1000), ['block_bucket=1000', 'block_bucket=2000'])
+        self.assertFalse(os.path.exists(os.path.join(self.dataset_dir, 'block_bucket=2000')))
+        self.assertEqual(read_dataset(self.dataset_dir)['blockNumber'].to_pylist()[-1], 1550)
+
+    def test_month_partitions_and_events(self):
+        # 216000 blocks of 12 seconds are 30 days
+        self.write_range(0, 299999, name=os.path.join(self.output_dir, 'events-0-299999.Transfer.parquet'), step=1000)
+        self.write_range(0, 99999, name=os.path.join(self.output_dir, 'events-0-99999.Approval.parquet'), step=1000)
+        rewritten = compact(self.output_dir, 'events', partition_by='month')
+        self.assertEqual(rewritten, ['event=Approval/month=2024-01', 'event=Transfer/month=2024-01', 'event=Transfer/month=2024-02'])
+        table = read_dataset(self.dataset_dir, filter=pc.field('event') == 'Transfer')
+        self.assertEqual(table.num_rows, 300)
+        # another layout starts over
+        self.assertEqual(len(compact(self.output_dir, 'events', bucket_blocks=100000)), 4)
+
+    def test_the_newest_of_overlapping_outputs_is_kept(self):
+        self.write_range(0, 999)
+        self.write_range(1000, 1499)
+        os.utime(os.path.join(self.output_dir, 'events-1000-1499.parquet'), (0, 0))
+        # the range tracked again up to a later block
+        blocks = self.write_range(1000, 2999, step=5)
+        compact(self.output_dir, 'events', bucket_blocks=1000)
+        table = read_dataset(self.dataset_dir, filter=pc.field('blockNumber') >= 1000)
+        self.assertEqual(sorted(table['blockNumber'].to_pylist()), blocks)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,123 @@
+import unittest
+import os
+import tempfile
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from sample.density_planner import DensityPlanner, DensityProfile
+from sample.output_dataset import file_last_block
+from sample.parallel_event_tracker import fixed_ranges, migrate_range_names, plan_ranges
+from sample.range_controller import AdaptiveRangeController
+from sample.run_manifest import RunManifest, DONE
+
+
+def density(block):
+    """Ten events per block in [12000, 12999], one every 100 blocks elsewhere."""
+    return 10 if 12000 <= block < 13000 else 1 if block % 100 == 0 else 0
+
+
+class FakeTracker:
+    def __init__(self, limit=None):
+        self.limit = limit
+        self.controller = AdaptiveRangeController(target_logs=5000, max_size=500000)
+        self.events_by_topic = {'0xt': None}
+        self.batch_client = self
+
+    def window_filter(self, from_block, to_block):
+        return {'fromBlock': from_block, 'toBlock': to_block}
+
+    def get_logs(self, filter_params):
+        blocks = range(filter_params['fromBlock'], filter_params['toBlock'] + 1)
+        logs = [{'blockNumber': b, 'logIndex': i, 'transactionIndex': 0} for b in blocks for i in range(density(b))]
+        if self.limit is not None and len(logs) > self.limit:
+            raise ValueError({'code': -32005, 'message': f'query returned more than {self.limit} results'})
+        return logs
+
+    def split_logs(self, logs):
+        return {'0xt': logs}
+
+    def decode_logs(self, tracked, logs):
+        return logs
+
+
+class TestDensityPlanner(unittest.TestCase):
+
+    def test_ranges_hold_the_same_events(self):
+        profile = DensityProfile([(0, 9999, 0.01), (10000, 19999, 1.0), (20000, 99999, 0.01)])
+        ranges = plan_ranges(profile, 0, 99999, 4)
+        self.assertEqual(ranges[0][0], 0)
+        self.assertEqual(ranges[-1][1], 99999)
+        for previous, current in zip(ranges, ranges[1:]):
+            self.assertEqual(previous[1] + 1, current[0])
+        events = [profile.events(a, b) for a, b in ranges]
+        self.assertEqual(len(ranges), 4)
+        self.assertLess(max(events) - min(events), 0.01 * sum(events))
+        # the dense blocks are shared by the middle ranges
+        self.assertTrue(10000 <= ranges[1][0] < ranges[2][0] < 20000)
+
+    def test_kept_ranges_are_left_as_they_are(self):
+        profile = DensityProfile([(0, 99999, 0.1)])
+        ranges = plan_ranges(profile, 0, 99999, 4, kept=[(0, 49999)])
+        self.assertEqual(ranges, [(0, 49999), (50000, 74999), (75000, 99999)])
+
+    def test_fixed_ranges_are_aligned(self):
+        self.assertEqual(fixed_ranges(12345, 120000, 50000), [(12345, 49999), (50000, 99999), (100000, 120000)])
+
+    def test_profile_from_samples_and_known_ranges(self):
+        planner = DensityPlanner(FakeTracker(limit=2000), samples=20, sample_blocks=1000)
+        # the events of the first 10000 blocks are known from an earlier run
+        profile = planner.profile(0, 109999, known=[(0, 9999, 100)])
+        self.assertEqual(profile.events(0, 9999), 100)
+        # one window per stratum, the dense one is halved until the node answers
+        self.assertEqual(planner.calls, 20 + 3)
+        # the sampled window stands for the 5000 blocks of its stratum
+        self.assertEqual(profile.events(10000, 14999), 50000)
+        self.assertAlmostEqual(profile.events(15000, 109999), 950)
+        self.assertEqual(planner.decoded, sum(logs for logs, _ in planner.timings))
+
+        estimate = planner.estimate(profile, [(0, 54999), (55000, 109999)], workers=2)
+        self.assertEqual([r['blocks'] for r in estimate['ranges']], [55000, 55000])
+        self.assertEqual(estimate['calls'], sum(r['calls'] for r in estimate['ranges']))
+        self.assertEqual(estimate['compute_units'], 75 * estimate['calls'])
+        limited = planner.estimate(profile, [(0, 109999)], requests_per_second=0.5)
+        self.assertGreaterEqual(limited['seconds'], limited['requests'] / 0.5)
+
+
+class TestRangeNames(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.output_dir = self.tmp_dir.name
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, from_block, to_block):
+        path = f'{self.output_dir}/t-{from_block}-{to_block}.parquet'
+        pq.write_table(pa.table({'blockNumber': [from_block, to_block], 'value': ['1', '2']}), path)
+        return path
+
+    def test_overlapping_ranges_of_older_runs_are_renamed(self):
+        # the ranges of older runs ended on the first block of the next one
+        self.write(12345, 50000)
+        self.write(50000, 100000)
+        last = self.write(100000, 120000)
+        # a piece of a split range is left as it is
+        manifest = RunManifest()
+        manifest.schedule([(150000, 249999, f'{self.output_dir}/t-150000-249999.parquet')])
+        piece = self.write(150000, 200000)
+        manifest.record(f'{self.output_dir}/t-150000-249999.parquet', DONE, 2, 249999, [piece])
+
+        renamed = migrate_range_names(self.output_dir, 't', 50000, manifest)
+        self.assertEqual([os.path.basename(new) for _, new in renamed], ['t-12345-49999.parquet', 't-50000-99999.parquet'])
+        self.assertEqual(sorted(os.listdir(self.output_dir)), ['t-100000-120000.parquet', 't-12345-49999.parquet',
+                                                              't-150000-200000.parquet', 't-50000-99999.parquet'])
+        # without the first block of the next range, appending resumes after it
+        table = pq.read_table(f'{self.output_dir}/t-50000-99999.parquet')
+        self.assertEqual(table['blockNumber'].to_pylist(), [50000])
+        self.assertEqual(file_last_block(f'{self.output_dir}/t-50000-99999.parquet'), 99999)
+        self.assertEqual(pq.read_table(last)['blockNumber'].to_pylist(), [100000, 120000])
+        self.assertEqual(migrate_range_names(self.output_dir, 't', 50000, manifest), [])
+
+if __name__ == "__main__":
+    unittest.main()
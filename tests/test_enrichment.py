@@ -0,0 +1,69 @@
+import unittest
+import pyarrow as pa
+from web3 import Web3
+
+from sample.enrichment import ChainStore, Enricher
+
+
+class FakeClient:
+    """Answers eth_getBlockByNumber and eth_getTransactionByHash, recording the calls."""
+    def __init__(self, nulls=0):
+        # the first nulls answers of each call are null, as from a node behind the head
+        self.calls = []
+        self.nulls = nulls
+
+    def call_batch(self, calls):
+        self.calls += calls
+        results = []
+        for method, params in calls:
+            if self.calls.count((method, params)) <= self.nulls:
+                results.append(None)
+            elif method == 'eth_getBlockByNumber':
+                results.append({'timestamp': hex(1600000000 + 12 * int(params[0], 16))})
+            else:
+                block = int(params[0][-2:], 16)
+                results.append({'blockNumber': hex(block), 'from': '0x' + '11' * 20, 'gasPrice': hex(1000 + block)})
+        return results
+
+
+class TestEnricher(unittest.TestCase):
+
+    def table(self):
+        blocks = [10, 10, 10, 20, 30, 30]
+        hashes = [bytes(31) + bytes([b]) for b in blocks]
+        return pa.table({'blockNumber': pa.array(blocks, pa.int64()), 'transactionHash': pa.array(hashes, pa.binary())})
+
+    def test_one_call_per_distinct_block_and_transaction(self):
+        client = FakeClient()
+        enricher = Enricher(client, ChainStore(), ['timestamp', 'tx_from', 'gasPrice'], batch_size=2, finalized_block=20)
+        table = enricher.enrich(self.table())
+
+        self.assertEqual(table.schema.names[-3:], ['timestamp', 'tx_from', 'gasPrice'])
+        self.assertEqual(table['timestamp'].cast(pa.int64()).to_pylist()[3], (1600000000 + 12 * 20) * 1000)
+        self.assertEqual(table['gasPrice'].to_pylist(), [1010, 1010, 1010, 1020, 1030, 1030])
+        self.assertEqual(len(client.calls), 6)
+
+        # finalized blocks come from the store, block 30 is fetched again
+        client.calls = []
+        enricher.enrich(self.table())
+        self.assertEqual([params[0] for _, params in client.calls], [hex(30), '0x' + '00' * 31 + '1e'])
+
+    def test_null_answers_are_asked_again(self):
+        client = FakeClient(nulls=1)
+        enricher = Enricher(client, ChainStore(), ['timestamp', 'tx_from'], delay=0)
+        table = enricher.enrich(self.table())
+        self.assertEqual(table['tx_from'].to_pylist(), [Web3.to_checksum_address('0x' + '11' * 20)] * 6)
+        # each call twice
+        self.assertEqual(len(client.calls), 12)
+
+    def test_null_answers_name_the_missing_block(self):
+        enricher = Enricher(FakeClient(nulls=3), ChainStore(), ['timestamp'], delay=0)
+        with self.assertRaises(ValueError) as raised:
+            enricher.enrich(self.table())
+        self.assertEqual(str(raised.exception), 'The node has no block 10 after 3 attempts')
+        enricher = Enricher(FakeClient(nulls=3), ChainStore(), ['gasPrice'], delay=0)
+        with self.assertRaisesRegex(ValueError, 'no transaction 0x0{62}0a after 3 attempts'):
+            enricher.enrich(self.table())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,165 @@
+import unittest
+import os
+import tempfile
+from types import SimpleNamespace
+import pyarrow as pa
+
+from sample.address_index import AddressIndex, find_events, index_file, lookup
+from sample.follow import ChainFollower
+from sample.output_dataset import fragment_file, output_files, read_output, last_tracked_block, LAST_BLOCK_KEY
+from sample.parquet_writer import StreamingParquetWriter
+
+SCHEMA = pa.schema([('blockNumber', pa.int64()), ('value', pa.int64()), ('account', pa.string())])
+
+
+def account(block):
+    return '0x' + f'{block % 4:02x}' * 20
+
+
+class FakeChain:
+    """One event per block, whose value and hash change with the fork the block is on."""
+    def __init__(self, block_number):
+        self.block_number = block_number
+        self.forks = []
+
+    def fork(self, block):
+        return sum(1 for f in self.forks if block >= f)
+
+    def call_batch(self, calls):
+        return [{'hash': f"0x{int(params[0], 16):x}{self.fork(int(params[0], 16))}"} for _, params in calls]
+
+
+class FakeTracker:
+    def __init__(self, chain):
+        self.chain = chain
+        self.w3 = SimpleNamespace(eth=chain)
+        self.batch_client = chain
+        self.tracked = []
+        self.last_blocks = []
+
+    def output_files(self, output_file):
+        return {'topic': output_file}
+
+    def track(self, from_block, to_block, output_file, append=False, last_block=None):
+        self.tracked.append((from_block, to_block))
+        self.last_blocks.append(last_block)
+        target = fragment_file(output_file, from_block, to_block) if append and os.path.exists(output_file) else output_file
+        blocks = list(range(from_block, to_block + 1))
+        with StreamingParquetWriter(target, SCHEMA, index=AddressIndex(['account'])) as writer:
+            writer.write(pa.table({'blockNumber': blocks, 'value': [self.chain.fork(b) for b in blocks],
+                                   'account': [account(b) for b in blocks]}, schema=SCHEMA))
+            writer.metadata[LAST_BLOCK_KEY] = to_block
+        return len(blocks)
+
+
+class TestChainFollower(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.output_file = os.path.join(self.tmp_dir.name, 'output.parquet')
+        self.chain = FakeChain(120)
+        self.tracker = FakeTracker(self.chain)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def advance(self, blocks):
+        self.chain.block_number += blocks
+
+    def test_reorg_rewrites_the_tail_only(self):
+        follower = ChainFollower(self.tracker, self.output_file, from_block=100, confirmations=10, append=False)
+        follower.poll()
+        for _ in range(3):
+            self.advance(5)
+            follower.poll()
+        self.assertEqual(self.tracker.tracked, [(100, 110), (111, 115), (116, 120), (121, 125)])
+
+        # blocks from 118 on are replaced, the append ending at 115 is still on the chain
+        self.chain.forks.append(118)
+        self.advance(2)
+        follower.poll()
+        self.assertEqual(self.tracker.tracked[-1], (116, 127))
+        table = read_output(self.output_file)
+        self.assertEqual(sorted(table['blockNumber'].to_pylist()), list(range(100, 128)))
+        values = dict(zip(table['blockNumber'].to_pylist(), table['value'].to_pylist()))
+        self.assertEqual(values[117], 0)
+        self.assertEqual(values[118], 1)
+
+        # a new follower resumes after the last append
+        self.advance(3)
+        follower = ChainFollower(self.tracker, self.output_file, from_block=100, confirmations=10)
+        follower.poll()
+        self.assertEqual(self.tracker.tracked[-1], (128, 130))
+        self.assertEqual(last_tracked_block(self.output_file), 130)
+
+    def test_reorg_inside_the_first_file(self):
+        follower = ChainFollower(self.tracker, self.output_file, from_block=100, confirmations=10, append=False)
+        follower.poll()
+        self.advance(5)
+        follower.poll()
+        follower.rewind(105)
+        table = read_output(self.output_file)
+        self.assertEqual(table['blockNumber'].to_pylist(), list(range(100, 106)))
+        self.assertEqual(last_tracked_block(self.output_file), 105)
+
+    def test_truncated_outputs_keep_their_index(self):
+        follower = ChainFollower(self.tracker, self.output_file, from_block=100, confirmations=10, append=False)
+        follower.poll()
+        for _ in range(2):
+            self.advance(5)
+            follower.poll()
+        follower.rewind(113)
+        # the fragment 116-120 is gone with its index, 111-115 is rewritten as 111-113
+        files = output_files(self.output_file)
+        self.assertEqual(files, [self.output_file, fragment_file(self.output_file, 111, 113)])
+        self.assertEqual(os.listdir(os.path.dirname(index_file(files[1]))), [os.path.basename(index_file(files[1]))])
+        for path in files:
+            self.assertIsNotNone(lookup(path, account(1)))
+        table = find_events(self.output_file, account(1))
+        self.assertEqual(table['blockNumber'].to_pylist(), [b for b in range(100, 114) if b % 4 == 1])
+        self.assertEqual(lookup(files[1], account(1)), [0])
+        # block 114 was dropped with the only event of its account
+        self.assertEqual(lookup(files[1], account(2)), [])
+
+    def test_last_block_is_kept_between_polls(self):
+        follower = ChainFollower(self.tracker, self.output_file, from_block=100, confirmations=10, append=False)
+        follower.poll()
+        for _ in range(2):
+            self.advance(5)
+            follower.poll()
+        # the first poll writes the output again, the next ones are told where it ends
+        self.assertEqual(self.tracker.last_blocks, [None, 110, 115])
+
+    def test_fragments_behind_the_hashes_are_merged(self):
+        follower = ChainFollower(self.tracker, self.output_file, from_block=100, confirmations=10, append=False,
+                                 merge_fragments=3)
+        follower.hashes.keep = 4
+        follower.poll()
+        for _ in range(8):
+            self.advance(2)
+            follower.poll()
+        # the hashes reach back to block 120, the fragments up to it were merged once 3 of them were behind
+        self.assertEqual(follower.hashes.blocks()[-1], 120)
+        files = output_files(self.output_file)
+        self.assertEqual(files, [self.output_file, fragment_file(self.output_file, 111, 120)]
+                         + [fragment_file(self.output_file, b, b + 1) for b in (121, 123, 125)])
+        table = read_output(self.output_file)
+        self.assertEqual(sorted(table['blockNumber'].to_pylist()), list(range(100, 127)))
+        self.assertEqual(last_tracked_block(files[1]), 120)
+        self.assertEqual(find_events(self.output_file, account(1))['blockNumber'].to_pylist(),
+                         [b for b in range(100, 127) if b % 4 == 1])
+        self.assertEqual(sorted(os.listdir(os.path.dirname(index_file(files[1])))),
+                         sorted(os.path.basename(index_file(path)) for path in files[1:]))
+
+        # a reorganization within the hashes kept leaves the merged fragment alone
+        self.chain.forks.append(124)
+        self.advance(2)
+        follower.poll()
+        self.assertEqual(self.tracker.tracked[-1], (123, 128))
+        self.assertEqual(output_files(self.output_file)[1], fragment_file(self.output_file, 111, 120))
+        table = read_output(self.output_file)
+        values = dict(zip(table['blockNumber'].to_pylist(), table['value'].to_pylist()))
+        self.assertEqual((values[123], values[124]), (0, 1))
+
+if __name__ == "__main__":
+    unittest.main()
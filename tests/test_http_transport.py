@@ -0,0 +1,177 @@
+import unittest
+import asyncio
+import gzip
+import json
+import socket
+import sys
+import threading
+import types
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+try:
+    import httpx
+    import h2.config
+    import h2.connection
+    import h2.events
+except ImportError:
+    httpx = None
+
+from sample.http_transport import async_session, aiohttp_accept_encoding, configure_session, accept_encoding, ACCEPT_ENCODING
+
+
+class GzipHandler(BaseHTTPRequestHandler):
+    """Answers every POST with a gzip body when the client accepts it."""
+    received = []
+
+    def do_POST(self):
+        self.received.append(self.headers.get('Accept-Encoding'))
+        self.rfile.read(int(self.headers['Content-Length']))
+        body = json.dumps({'jsonrpc': '2.0', 'id': 0, 'result': ['0x' + '00' * 32] * 100}).encode()
+        accepted = 'gzip' in self.headers.get('Accept-Encoding', '')
+        if accepted:
+            body = gzip.compress(body)
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        if accepted:
+            self.send_header('Content-Encoding', 'gzip')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestHttpTransport(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), GzipHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_compressed_answers_on_pooled_connections(self):
+        session = configure_session(requests.Session(), pool_size=2, timeout=(1, 5))
+        for _ in range(3):
+            response = session.post(self.url, json={'method': 'eth_getLogs'}, timeout=(1, 5))
+            self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+            self.assertEqual(len(response.json()['result']), 100)
+        self.assertEqual(session.get_adapter(self.url)._pool_maxsize, 2)
+
+    def test_async_sessions_are_set_up_as_the_requests_ones(self):
+        async def post():
+            async with async_session(pool_size=2, timeout=(1, 5)) as session:
+                self.assertEqual(session.connector.limit, 2)
+                self.assertEqual(session.timeout.sock_connect, 1)
+                async with session.post(self.url, json={'method': 'eth_getLogs'}) as response:
+                    return await response.json(content_type=None)
+
+        GzipHandler.received.clear()
+        self.assertEqual(len(asyncio.run(post())['result']), 100)
+        self.assertEqual(GzipHandler.received, [aiohttp_accept_encoding()])
+
+    def test_encodings_sent_are_the_decodable_ones(self):
+        GzipHandler.received.clear()
+        session = configure_session(requests.Session(), timeout=(1, 5))
+        session.post(self.url, json={'method': 'eth_getLogs'}, timeout=(1, 5))
+        self.assertEqual(GzipHandler.received, [ACCEPT_ENCODING])
+
+        # br and zstd only when their decoders import
+        modules = {name: sys.modules.get(name) for name in ('brotli', 'zstandard')}
+        try:
+            sys.modules.update(brotli=None, zstandard=None)
+            self.assertEqual(accept_encoding(), 'gzip, deflate')
+            sys.modules.update(brotli=types.ModuleType('brotli'), zstandard=types.ModuleType('zstandard'))
+            self.assertEqual(accept_encoding(), 'gzip, deflate, br, zstd')
+        finally:
+            for name, module in modules.items():
+                if module is None:
+                    sys.modules.pop(name, None)
+                else:
+                    sys.modules[name] = module
+
+
+class H2Server:
+    """A plaintext HTTP/2 server answering every request with a gzip body, counting its connections."""
+    def __init__(self):
+        self.sock = socket.create_server(('127.0.0.1', 0))
+        self.url = f"http://127.0.0.1:{self.sock.getsockname()[1]}"
+        self.connections = 0
+        self.requests = []
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def serve(self):
+        while True:
+            try:
+                client, _ = self.sock.accept()
+            except OSError:
+                return
+            self.connections += 1
+            threading.Thread(target=self.handle, args=(client,), daemon=True).start()
+
+    def handle(self, client):
+        connection = h2.connection.H2Connection(h2.config.H2Configuration(client_side=False, header_encoding='utf-8'))
+        connection.initiate_connection()
+        client.sendall(connection.data_to_send())
+        headers = {}
+        with client:
+            while True:
+                data = client.recv(65535)
+                if not data:
+                    return
+                for event in connection.receive_data(data):
+                    if isinstance(event, h2.events.RequestReceived):
+                        headers[event.stream_id] = dict(event.headers)
+                    elif isinstance(event, h2.events.DataReceived):
+                        connection.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+                    elif isinstance(event, h2.events.StreamEnded):
+                        self.requests.append(headers.pop(event.stream_id))
+                        body = gzip.compress(json.dumps({'jsonrpc': '2.0', 'id': 0, 'result': ['0x' + '00' * 32] * 100}).encode())
+                        connection.send_headers(event.stream_id, [(':status', '200'), ('content-type', 'application/json'),
+                                                                  ('content-encoding', 'gzip'), ('content-length', str(len(body)))])
+                        connection.send_data(event.stream_id, body, end_stream=True)
+                client.sendall(connection.data_to_send())
+
+    def close(self):
+        # wakes up accept, close alone leaves the port listening
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+@unittest.skipIf(httpx is None, "HTTP/2 needs httpx with its h2 extra")
+class TestHttp2Adapter(unittest.TestCase):
+
+    def setUp(self):
+        self.server = H2Server()
+        self.session = configure_session(requests.Session(), pool_size=2, http2=True, timeout=(1, 5))
+        adapter = self.session.get_adapter(self.server.url)
+        # prior knowledge, the local server has no TLS to negotiate HTTP/2 with
+        adapter.client = httpx.Client(http1=False, http2=True, timeout=adapter.client.timeout)
+
+    def tearDown(self):
+        self.session.close()
+        self.server.close()
+
+    def test_requests_share_one_http2_connection(self):
+        for _ in range(3):
+            response = self.session.post(self.server.url, json={'method': 'eth_getLogs'}, timeout=(1, 5))
+            self.assertEqual(response.status_code, 200)
+            # httpx decoded the body already
+            self.assertNotIn('Content-Encoding', response.headers)
+            self.assertEqual(len(response.json()['result']), 100)
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual([r[':method'] for r in self.server.requests], ['POST'] * 3)
+        self.assertTrue(all('connection' not in r and r['accept-encoding'] == ACCEPT_ENCODING for r in self.server.requests))
+
+    def test_transport_errors_are_requests_errors(self):
+        self.server.close()
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            self.session.post(self.server.url, json={'method': 'eth_getLogs'}, timeout=(1, 5))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import unittest
+import os
+import tempfile
+from web3.datastructures import AttributeDict
+from hexbytes import HexBytes
+
+from sample.log_cache import LogCache
+
+ADDRESS = '0xae7ab96520DE3A18E5e111B5EaAb095312D7fE84'
+TOPICS = ['0x' + 'dd' * 32]
+
+
+def make_log(block, index):
+    return AttributeDict({
+        'address': ADDRESS,
+        'blockHash': HexBytes(block.to_bytes(32, 'big')),
+        'blockNumber': block,
+        'data': HexBytes(index.to_bytes(32, 'big')),
+        'logIndex': index,
+        'removed': False,
+        'topics': [HexBytes(TOPICS[0])],
+        'transactionHash': HexBytes((block * 10 + index).to_bytes(32, 'big')),
+        'transactionIndex': index,
+    })
+
+
+class TestLogCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.calls = []
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def fetch_logs(self, from_block, to_block):
+        self.calls.append((from_block, to_block))
+        return [make_log(b, i) for b in range(from_block, to_block + 1) if b % 3 == 0 for i in range(2)]
+
+    def test_overlapping_windows_fetch_only_missing_blocks(self):
+        cache = LogCache(self.tmp_dir.name, 1, ADDRESS, TOPICS, finalized_block=1000)
+        first = cache.fetch(self.fetch_logs, 0, 99)
+        self.assertEqual(first, self.fetch_logs(0, 99))
+        self.calls = []
+
+        logs = cache.fetch(self.fetch_logs, 50, 149)
+        self.assertEqual(self.calls, [(100, 149)])
+        self.assertEqual([(l['blockNumber'], l['logIndex']) for l in logs],
+                         [(l['blockNumber'], l['logIndex']) for l in self.fetch_logs(50, 149)])
+
+        # another instance on the same directory serves everything from the disk
+        expected = self.fetch_logs(10, 140)
+        self.calls = []
+        other = LogCache(self.tmp_dir.name, 1, ADDRESS, TOPICS, finalized_block=1000)
+        self.assertEqual(other.fetch(self.fetch_logs, 10, 140), expected)
+        self.assertEqual(self.calls, [])
+
+    def test_recent_blocks_and_other_chains_are_not_served(self):
+        cache = LogCache(self.tmp_dir.name, 1, ADDRESS, TOPICS, finalized_block=60)
+        cache.fetch(self.fetch_logs, 0, 99)
+        self.assertEqual(cache.missing(0, 99), [(61, 99)])
+        self.assertEqual(LogCache(self.tmp_dir.name, 5, ADDRESS, TOPICS).missing(0, 50), [(0, 50)])
+
+    def test_cached_addresses_are_checksummed(self):
+        cache = LogCache(self.tmp_dir.name, 1, ADDRESS, TOPICS, finalized_block=1000)
+        # the fast path gives them in lowercase
+        cache.fetch(lambda a, b: [dict(log, address=ADDRESS.lower()) for log in self.fetch_logs(a, b)], 0, 99)
+        self.assertEqual({log['address'] for log in cache.fetch(self.fetch_logs, 0, 99)}, {ADDRESS})
+
+    def test_segments_of_a_bucket_are_merged(self):
+        cache = LogCache(self.tmp_dir.name, 1, ADDRESS, TOPICS, finalized_block=250, bucket_blocks=100)
+        for first in range(0, 300, 30):
+            cache.fetch(self.fetch_logs, first, first + 29)
+        # the buckets 0-99 and 100-199 are merged, the segment 180-209 goes past them and the last bucket is not final
+        self.assertEqual(sorted(f for f in os.listdir(cache.directory) if f.endswith('.arrow')),
+                         ['0-99.arrow', '100-199.arrow', '180-209.arrow', '210-239.arrow', '240-250.arrow'])
+        expected = self.fetch_logs(0, 250)
+        self.calls = []
+        other = LogCache(self.tmp_dir.name, 1, ADDRESS, TOPICS, finalized_block=250, bucket_blocks=100)
+        self.assertEqual(other.fetch(self.fetch_logs, 0, 250), expected)
+        self.assertEqual(self.calls, [])
+
+if __name__ == "__main__":
+    unittest.main()
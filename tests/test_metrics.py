@@ -0,0 +1,85 @@
+import unittest
+import json
+import os
+import tempfile
+import urllib.request
+
+from sample.metrics import Metrics, MetricsExporter, merge, prometheus_text, summarize, summary_line
+
+
+class TestMetrics(unittest.TestCase):
+
+    def worker(self, fetch, decode, events):
+        metrics = Metrics()
+        metrics.inc('stage_seconds_total', fetch, stage='fetch')
+        metrics.inc('stage_seconds_total', decode, stage='decode')
+        metrics.inc('stage_seconds_total', 0.1, stage='write')
+        metrics.inc('decoded_logs_total', events)
+        metrics.inc('events_written_total', events)
+        metrics.inc('retries_total', reason='range_limit')
+        metrics.observe('rpc_latency_seconds', 0.2, method='eth_getLogs')
+        metrics.observe('rpc_latency_seconds', 3.0, method='eth_getLogs')
+        return metrics.snapshot()
+
+    def test_snapshots_are_merged(self):
+        merged = merge([self.worker(1.0, 2.0, 100), self.worker(2.0, 2.0, 300)])
+        summary = summarize(merged, 2.0)
+        self.assertEqual(summary['events'], 400)
+        self.assertEqual(summary['events_per_second'], 200)
+        self.assertEqual(summary['stage_seconds'], {'fetch': 3.0, 'decode': 4.0, 'write': 0.2})
+        self.assertEqual(summary['bound'], 'cpu')
+        self.assertEqual(summary['retries'], {'range_limit': 2})
+        self.assertEqual(summary['decode_seconds_per_1k_logs'], 10.0)
+        self.assertEqual(summary['rpc_latency_seconds']['count'], 4)
+        self.assertEqual(summary['rpc_latency_seconds']['p50'], 0.25)
+        self.assertEqual(summary['rpc_latency_seconds']['p95'], 5.0)
+        self.assertIn('cpu bound', summary_line(summary))
+
+    def test_enrichment_is_provider_time(self):
+        metrics = Metrics()
+        metrics.inc('stage_seconds_total', 2.0, stage='fetch')
+        metrics.inc('stage_seconds_total', 3.0, stage='decode')
+        metrics.inc('stage_seconds_total', 1.5, stage='enrich')
+        summary = summarize(metrics.snapshot(), 10.0)
+        self.assertEqual(summary['stage_seconds']['enrich'], 1.5)
+        self.assertEqual(summary['bound'], 'provider')
+
+    def test_prometheus_text(self):
+        metrics = Metrics()
+        metrics.inc('retries_total', reason='http')
+        metrics.set('workers_alive', 3)
+        metrics.observe('logs_per_call', 50)
+        lines = prometheus_text(metrics.snapshot()).splitlines()
+        self.assertIn('# TYPE event_tracker_retries_total counter', lines)
+        self.assertIn('event_tracker_retries_total{reason="http"} 1', lines)
+        self.assertIn('event_tracker_workers_alive 3', lines)
+        self.assertIn('# TYPE event_tracker_logs_per_call histogram', lines)
+        # the buckets are cumulative
+        self.assertIn('event_tracker_logs_per_call_bucket{le="10"} 0', lines)
+        self.assertIn('event_tracker_logs_per_call_bucket{le="100"} 1', lines)
+        self.assertIn('event_tracker_logs_per_call_bucket{le="10000"} 1', lines)
+        self.assertIn('event_tracker_logs_per_call_bucket{le="+Inf"} 1', lines)
+        self.assertIn('event_tracker_logs_per_call_count 1', lines)
+
+    def test_exporter(self):
+        snapshot = self.worker(3.0, 1.0, 10)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            json_file = os.path.join(tmp_dir, 'metrics.json')
+            prometheus_file = os.path.join(tmp_dir, 'metrics.prom')
+            exporter = MetricsExporter(lambda: snapshot, json_file, prometheus_file, port=0, interval=3600)
+            try:
+                self.assertIsNone(exporter.maybe_export())
+                self.assertFalse(os.path.exists(json_file))
+                exporter.export()
+                with open(json_file) as f:
+                    self.assertEqual(json.load(f)['bound'], 'provider')
+                with open(prometheus_file) as f:
+                    self.assertIn('event_tracker_events_written_total 10', f.read())
+                port = exporter.httpd.server_address[1]
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as response:
+                    self.assertIn(b'event_tracker_retries_total', response.read())
+            finally:
+                exporter.close()
+
+if __name__ == "__main__":
+    unittest.main()
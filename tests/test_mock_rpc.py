@@ -0,0 +1,72 @@
+import unittest
+import io
+import os
+import socket
+import struct
+import tempfile
+import time
+from contextlib import redirect_stderr
+import requests
+import pyarrow.parquet as pq
+from web3 import Web3
+
+from benchmarks.mock_rpc import SyntheticChain, MockRpcServer
+from sample.rpc_batch import JsonRpcBatchClient, JsonRpcError
+from sample.process_event_tracker import EventTracker, EventTrackerConfig
+
+ADDRESS = '0xae7ab96520DE3A18E5e111B5EaAb095312D7fE84'
+TRANSFER = '0x' + Web3.keccak(text='Transfer(address,address,uint256)').hex().removeprefix('0x')
+
+
+class TestMockRpc(unittest.TestCase):
+
+    def setUp(self):
+        self.chain = SyntheticChain('abi/stETH.json', ADDRESS, ['Transfer', 'Approval'], density=0.5,
+                                    bursts=[(1000, 1099, 50)], head=5000)
+
+    def test_logs_are_filtered_and_repeatable(self):
+        with MockRpcServer(self.chain, max_logs=1000) as server:
+            client = JsonRpcBatchClient(server.url)
+            logs = client.get_logs({'fromBlock': 0, 'toBlock': 999, 'address': ADDRESS, 'topics': [TRANSFER]})
+            self.assertTrue(logs)
+            self.assertTrue(all(log['topics'][0] == TRANSFER for log in logs))
+            self.assertEqual(client.get_logs({'fromBlock': 0, 'toBlock': 999, 'address': ADDRESS, 'topics': [TRANSFER]}), logs)
+            # the burst is refused as the providers do
+            with self.assertRaises(JsonRpcError):
+                client.get_logs({'fromBlock': 0, 'toBlock': 4999, 'address': ADDRESS, 'topics': [TRANSFER]})
+            self.assertEqual(client.call('eth_blockNumber', []), hex(5000))
+            self.assertEqual(server.stats['refused'], 1)
+
+    def test_errors_are_injected(self):
+        with MockRpcServer(self.chain, error_rate=1.0) as server:
+            response = requests.post(server.url, json={'jsonrpc': '2.0', 'id': 0, 'method': 'eth_blockNumber', 'params': []})
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(server.stats['errors'], 1)
+
+    def test_closed_connections_are_quiet(self):
+        body = b'{"jsonrpc": "2.0", "id": 0, "method": "eth_blockNumber", "params": []}'
+        stderr = io.StringIO()
+        with redirect_stderr(stderr), MockRpcServer(self.chain, latency=0.2) as server:
+            # the client goes away with a reset before the answer
+            client = socket.create_connection(server.httpd.server_address)
+            client.sendall(b'POST / HTTP/1.1\r\nHost: x\r\nContent-Length: %d\r\n\r\n' % len(body) + body)
+            client.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+            client.close()
+            time.sleep(0.5)
+            response = requests.post(server.url, json={'jsonrpc': '2.0', 'id': 0, 'method': 'eth_blockNumber', 'params': []})
+            self.assertEqual(response.json()['result'], hex(5000))
+        self.assertEqual(stderr.getvalue(), '')
+
+    def test_tracker_against_the_mock(self):
+        with MockRpcServer(self.chain) as server, tempfile.TemporaryDirectory() as tmp_dir:
+            config = EventTrackerConfig('abi/stETH.json', ADDRESS, 'event/stETH-Transfer.sol', None, None, False, None, None, server.url)
+            output_file = os.path.join(tmp_dir, 'transfers.parquet')
+            events = EventTracker(config).track(0, 4999, output_file)
+            expected = JsonRpcBatchClient(server.url).get_logs({'fromBlock': 900, 'toBlock': 1199, 'address': ADDRESS, 'topics': [TRANSFER]})
+            table = pq.read_table(output_file)
+            self.assertEqual(table.num_rows, events)
+            blocks = table['blockNumber'].to_pylist()
+            self.assertEqual(sum(900 <= b <= 1199 for b in blocks), len(expected))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+import unittest
+import os
+import tempfile
+from eth_abi import encode
+from web3 import Web3
+import pyarrow.parquet as pq
+
+from sample.process_event_tracker import EventTracker, EventTrackerConfig
+
+STETH = '0xae7ab96520DE3A18E5e111B5EaAb095312D7fE84'
+USDT = '0xdAC17F958D2ee523a2206206994597C13D831ec7'
+TRANSFER = '0x' + Web3.keccak(text='Transfer(address,address,uint256)').hex()
+TRANSFER_SHARES = '0x' + Web3.keccak(text='TransferShares(address,address,uint256)').hex()
+APPROVAL = '0x' + Web3.keccak(text='Approval(address,address,uint256)').hex()
+
+
+def raw_logs(from_block, to_block):
+    """A Transfer and a TransferShares per block from alternating contracts, and an untracked Approval."""
+    logs = []
+    for block in range(from_block, to_block + 1):
+        for index, topic in enumerate((TRANSFER, TRANSFER_SHARES, APPROVAL)):
+            logs.append({
+                'address': (STETH if (block + index) % 2 == 0 else USDT).lower(),
+                'blockHash': '0x' + '00' * 32,
+                'blockNumber': block,
+                'data': '0x' + encode(['uint256'], [block * 10 + index]).hex(),
+                'logIndex': index,
+                'topics': [topic, '0x' + '00' * 31 + '01', '0x' + '00' * 31 + '02'],
+                'transactionHash': '0x' + block.to_bytes(32, 'big').hex(),
+                'transactionIndex': 0,
+            })
+    return logs
+
+
+class TestMultiEvent(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        config = EventTrackerConfig(
+            'tests/stETH.json', [STETH, USDT], ['event/stETH-Transfer.sol', 'event/stETH-TransferShares.sol'],
+            None, None, False, None, None, 'http://127.0.0.1:1'
+        )
+        # no node is queried, the windows are made up
+        self.tracker = EventTracker(config)
+        self.tracker.iter_windows = lambda a, b: ((s, min(s + 9, b), raw_logs(s, min(s + 9, b))) for s in range(a, b + 1, 10))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_one_request_for_all_the_events(self):
+        self.assertEqual(self.tracker.topics, [[TRANSFER, TRANSFER_SHARES]])
+
+    def test_logs_are_split_by_topic(self):
+        groups = self.tracker.split_logs(raw_logs(0, 4))
+        self.assertEqual(sorted(groups), sorted([TRANSFER, TRANSFER_SHARES]))
+        self.assertEqual([log['blockNumber'] for log in groups[TRANSFER]], list(range(5)))
+        self.assertTrue(all(log['topics'][0] == TRANSFER_SHARES for log in groups[TRANSFER_SHARES]))
+
+    def test_one_output_per_event_with_the_emitting_contract(self):
+        output_file = os.path.join(self.tmp_dir.name, 't-0-19.parquet')
+        self.assertEqual(self.tracker.track(0, 19, output_file), 40)
+        self.assertFalse(os.path.exists(output_file))
+        transfers = pq.read_table(os.path.join(self.tmp_dir.name, 't-0-19.Transfer.parquet'))
+        shares = pq.read_table(os.path.join(self.tmp_dir.name, 't-0-19.TransferShares.parquet'))
+        self.assertEqual(transfers['blockNumber'].to_pylist(), list(range(20)))
+        self.assertEqual(shares['blockNumber'].to_pylist(), list(range(20)))
+        self.assertIn('sharesValue', shares.column_names)
+        # checksummed, from the contract that emitted each log
+        self.assertEqual(transfers['address'].to_pylist(), [STETH if b % 2 == 0 else USDT for b in range(20)])
+        self.assertEqual(shares['address'].to_pylist(), [USDT if b % 2 == 0 else STETH for b in range(20)])
+
+if __name__ == "__main__":
+    unittest.main()
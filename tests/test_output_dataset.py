@@ -0,0 +1,70 @@
+import unittest
+import os
+import tempfile
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from sample.output_dataset import (event_output_file, file_last_block, fragment_file, last_tracked_block, output_files,
+                                   range_output_file, read_output, LAST_BLOCK_KEY)
+from sample.parquet_writer import StreamingParquetWriter
+
+SCHEMA = pa.schema([('blockNumber', pa.int64()), ('value', pa.string())])
+
+
+def blocks_table(blocks):
+    return pa.table({'blockNumber': blocks, 'value': [str(b) for b in blocks]}, schema=SCHEMA)
+
+
+class TestOutputDataset(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.output_file = os.path.join(self.tmp_dir.name, 'events-0-999.parquet')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, path, blocks, last_block=None):
+        with StreamingParquetWriter(path, SCHEMA, flush_rows=10) as writer:
+            writer.write(blocks_table(blocks))
+            if last_block is not None:
+                writer.metadata[LAST_BLOCK_KEY] = last_block
+
+    def test_last_block_is_read_from_the_footer(self):
+        # the range went past the last event
+        self.write(self.output_file, list(range(0, 500, 7)), last_block=999)
+        self.assertEqual(file_last_block(self.output_file), 999)
+
+    def test_older_files_fall_back_to_the_statistics(self):
+        pq.write_table(blocks_table(list(range(0, 500, 7))), self.output_file, row_group_size=10)
+        self.assertEqual(file_last_block(self.output_file), 497)
+        # without statistics, the blockNumber column alone is read
+        pq.write_table(blocks_table([3, 12, 5]), self.output_file, write_statistics=False)
+        self.assertEqual(file_last_block(self.output_file), 12)
+        pq.write_table(blocks_table([]), self.output_file)
+        self.assertIsNone(file_last_block(self.output_file))
+
+    def test_fragments_are_merged_in_block_order(self):
+        self.write(self.output_file, list(range(0, 100)), last_block=199)
+        # named by their blocks, 1000 sorts after 200
+        self.write(fragment_file(self.output_file, 1000, 1099), list(range(1000, 1100)), last_block=1099)
+        self.write(fragment_file(self.output_file, 200, 999), list(range(200, 300)), last_block=999)
+        files = output_files(self.output_file)
+        self.assertEqual(files, [self.output_file, fragment_file(self.output_file, 200, 999),
+                                 fragment_file(self.output_file, 1000, 1099)])
+        self.assertEqual(last_tracked_block(self.output_file), 1099)
+        table = read_output(self.output_file, columns=['blockNumber'])
+        self.assertEqual(table.column_names, ['blockNumber'])
+        self.assertEqual(sorted(table['blockNumber'].to_pylist()), list(range(100)) + list(range(200, 300)) + list(range(1000, 1100)))
+
+    def test_nothing_written(self):
+        self.assertEqual(output_files(self.output_file), [])
+        self.assertIsNone(last_tracked_block(self.output_file))
+
+    def test_output_names(self):
+        self.assertEqual(event_output_file('out/events-0-999.parquet', 'Transfer'), 'out/events-0-999.Transfer.parquet')
+        self.assertEqual(range_output_file('out/events-0-999.parquet', 1000, 1999), 'out/events-1000-1999.parquet')
+        self.assertEqual(fragment_file('out/events.parquet', 5, 9), os.path.join('out/events.parts', '5-9.parquet'))
+
+if __name__ == "__main__":
+    unittest.main()
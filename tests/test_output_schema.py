@@ -0,0 +1,39 @@
+import unittest
+import numpy as np
+import pyarrow as pa
+
+from sample.output_schema import arrow_type, build_schema, to_arrow_array
+from sample.parse_solidity_event import parse_solidity_event
+
+
+class TestOutputSchema(unittest.TestCase):
+
+    def test_types_from_solidity_event(self):
+        event = parse_solidity_event('tests/stETH-Transfer.sol')
+        schema = build_schema(event)
+        self.assertEqual(schema.field('value').type, pa.binary(32))
+        self.assertEqual(schema.field('from').type, pa.string())
+        schema = build_schema(event, wide_int='decimal', address='binary')
+        self.assertEqual(schema.field('value').type, pa.decimal256(76, 0))
+        self.assertEqual(schema.field('to').type, pa.binary(20))
+        self.assertEqual(arrow_type('uint8'), pa.uint8())
+        self.assertEqual(arrow_type('int24'), pa.int32())
+        self.assertEqual(arrow_type('uint64'), pa.uint64())
+
+    def test_wide_integers(self):
+        values = np.array([0, 10 ** 75, 2 ** 200 + 1], dtype=object)
+        self.assertEqual(to_arrow_array(values, pa.decimal256(76, 0)).cast(pa.string()).to_pylist(), [str(v) for v in values])
+        signed = np.array([-1, -(10 ** 70)], dtype=object)
+        self.assertEqual(to_arrow_array(signed, pa.decimal256(76, 0)).cast(pa.string()).to_pylist(), [str(v) for v in signed])
+        binary = to_arrow_array(values, pa.binary(32)).to_pylist()
+        self.assertEqual([int.from_bytes(b, 'big') for b in binary], list(values))
+        with self.assertRaises(ValueError):
+            to_arrow_array(np.array([2 ** 256 - 1], dtype=object), pa.decimal256(76, 0))
+
+    def test_addresses(self):
+        address = '0xae7ab96520DE3A18E5e111B5EaAb095312D7fE84'
+        array = to_arrow_array(np.array([address], dtype=object), pa.binary(20))
+        self.assertEqual(array[0].as_py(), bytes.fromhex(address[2:]))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -12,7 +12,7 @@ class TestParallelEventTracker(unittest.TestCase):
     def test_parallel_event_tracker(self):
         # Define the command to run the parallel_event_tracker script
         cmd = [
-            'python', 'sample/parallel_event_tracker.py',
+            'python', '-m', 'sample.parallel_event_tracker',
             '-n', 'tests/stETH.json',
             '-a', '0xae7ab96520DE3A18E5e111B5EaAb095312D7fE84',
             '-e', 'tests/stETH-Transfer.sol',
@@ -0,0 +1,46 @@
+import unittest
+import os
+import tempfile
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from sample.parquet_writer import StreamingParquetWriter
+
+
+class TestStreamingParquetWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.output_file = os.path.join(self.tmp_dir.name, 'output.parquet')
+        self.schema = pa.schema([('blockNumber', pa.int64()), ('value', pa.string())])
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def batch(self, start, n):
+        return pa.record_batch([pa.array(range(start, start + n), pa.int64()), pa.array([str(i) for i in range(n)])], schema=self.schema)
+
+    def test_row_groups_and_append(self):
+        with StreamingParquetWriter(self.output_file, self.schema, flush_rows=100) as writer:
+            for start in range(0, 1000, 50):
+                writer.write(self.batch(start, 50))
+        self.assertEqual(pq.ParquetFile(self.output_file).num_row_groups, 10)
+
+        with StreamingParquetWriter(self.output_file, self.schema, flush_rows=100, append=True) as writer:
+            writer.write(self.batch(1000, 10))
+        table = pq.read_table(self.output_file)
+        self.assertEqual(table.num_rows, 1010)
+        self.assertEqual(table.column('blockNumber').to_pylist(), list(range(1010)))
+
+    def test_failure_keeps_previous_output(self):
+        with StreamingParquetWriter(self.output_file, self.schema) as writer:
+            writer.write(self.batch(0, 10))
+        with self.assertRaises(RuntimeError):
+            with StreamingParquetWriter(self.output_file, self.schema, append=True) as writer:
+                writer.write(self.batch(10, 10))
+                raise RuntimeError('fetch failed')
+        self.assertEqual(pq.read_table(self.output_file).num_rows, 10)
+        self.assertFalse(os.path.exists(self.output_file + '.tmp'))
+
+if __name__ == "__main__":
+    unittest.main()
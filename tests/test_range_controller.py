@@ -0,0 +1,69 @@
+import unittest
+
+from sample.range_controller import AdaptiveRangeController, fetch_range, is_range_limit_error, range_state_key
+from sample.rpc_batch import JsonRpcError
+
+
+class TestRangeController(unittest.TestCase):
+
+    def test_window_grows_on_sparse_range(self):
+        controller = AdaptiveRangeController(initial_size=2000, max_size=500000)
+        calls = []
+
+        def fetch_logs(from_block, to_block):
+            calls.append((from_block, to_block))
+            return []
+
+        windows = list(fetch_range(fetch_logs, 0, 999999, controller))
+        # the windows cover the whole range without holes or overlaps
+        self.assertEqual(windows[0][0], 0)
+        self.assertEqual(windows[-1][1], 999999)
+        for previous, current in zip(windows, windows[1:]):
+            self.assertEqual(previous[1] + 1, current[0])
+        self.assertLess(len(calls), 15)
+
+    def test_window_halves_on_size_limit_error(self):
+        controller = AdaptiveRangeController(initial_size=1000)
+
+        def fetch_logs(from_block, to_block):
+            if to_block - from_block + 1 > 250:
+                raise ValueError({'code': -32005, 'message': 'query returned more than 10000 results'})
+            return [None] * 10
+
+        windows = list(fetch_range(fetch_logs, 0, 999, controller))
+        self.assertEqual(windows[0][:2], (0, 249))
+        self.assertEqual(windows[-1][1], 999)
+
+    def test_other_errors_are_raised(self):
+        controller = AdaptiveRangeController(initial_size=1000)
+
+        def fetch_logs(from_block, to_block):
+            raise ValueError('execution reverted')
+
+        self.assertFalse(is_range_limit_error(ValueError('execution reverted')))
+        with self.assertRaises(ValueError):
+            list(fetch_range(fetch_logs, 0, 999, controller))
+
+    def test_range_limit_errors_of_the_providers(self):
+        for message in ('query returned more than 10000 results',
+                        'Log response size exceeded. You can make eth_getLogs requests with up to a 2K block range',
+                        'block range is too wide', 'exceed maximum block range: 5000',
+                        'eth_getLogs is limited to a 10,000 range'):
+            self.assertTrue(is_range_limit_error(ValueError({'code': -32000, 'message': message})), message)
+        # the code alone, whatever the message
+        self.assertTrue(is_range_limit_error(JsonRpcError(-32005, 'limit exceeded')))
+        # rate limits and other errors mentioning limits or block ranges are not
+        for error in (ValueError({'code': -32005, 'message': 'daily request count exceeded, request rate limited'}),
+                      JsonRpcError(429, 'Your app has exceeded its compute units per second capacity'),
+                      ValueError({'code': -32000, 'message': 'rate limit exceeded'}),
+                      ValueError({'code': -32602, 'message': 'invalid block range params'}),
+                      ValueError('gas limit exceeded')):
+            self.assertFalse(is_range_limit_error(error), error)
+
+    def test_state_key_of_several_addresses_and_events(self):
+        self.assertEqual(range_state_key('0xAbC', ['0xT1']), '0xabc:0xt1')
+        self.assertEqual(range_state_key(['0xAbC', '0xDeF'], ['0xT1']), '0xabc,0xdef:0xt1')
+        self.assertNotEqual(range_state_key('0xabc', [['0xt1', '0xt2']]), range_state_key('0xabc', ['0xt1']))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,144 @@
+import unittest
+import multiprocessing
+import os
+import signal
+import tempfile
+from eth_abi import encode
+from web3 import Web3
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from sample.process_event_tracker import EventTracker, EventTrackerConfig
+from sample.output_dataset import range_output_file, file_last_block, fragment_dir, last_tracked_block, output_files, read_output
+
+TOPIC = '0x' + Web3.keccak(text='Transfer(address,address,uint256)').hex()
+
+
+def raw_logs(from_block, to_block):
+    """One Transfer per block, as parsed by the fast path."""
+    return [{
+        'address': '0xae7ab96520de3a18e5e111b5eaab095312d7fe84',
+        'blockHash': '0x' + '00' * 32,
+        'blockNumber': block,
+        'data': '0x' + encode(['uint256'], [block]).hex(),
+        'logIndex': 0,
+        'topics': [TOPIC, '0x' + '00' * 31 + '01', '0x' + '00' * 31 + '02'],
+        'transactionHash': '0x' + block.to_bytes(32, 'big').hex(),
+        'transactionIndex': 0,
+    } for block in range(from_block, to_block + 1)]
+
+
+class TestRangeSplit(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        config = EventTrackerConfig(
+            'tests/stETH.json', '0xae7ab96520DE3A18E5e111B5EaAb095312D7fE84', 'tests/stETH-Transfer.sol',
+            None, None, False, None, None, 'http://127.0.0.1:1'
+        )
+        # no node is queried, the windows are made up
+        self.tracker = EventTracker(config)
+        self.tracker.iter_windows = lambda a, b: ((s, min(s + 9, b), raw_logs(s, min(s + 9, b))) for s in range(a, b + 1, 10))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_tail_handed_over(self):
+        output_file = os.path.join(self.tmp_dir.name, 't-0-99.parquet')
+        splits = []
+
+        def split(written_block, end_block):
+            if splits:
+                return None
+            # the worker keeps up to block 54, the last window goes past it
+            splits.append((written_block, end_block))
+            return 54, range_output_file(output_file, 0, 54)
+
+        events = self.tracker.track(0, 99, output_file, split=split)
+        self.assertEqual(splits, [(9, 99)])
+        self.assertFalse(os.path.exists(output_file))
+        head = os.path.join(self.tmp_dir.name, 't-0-54.parquet')
+        self.assertEqual(pq.read_table(head)['blockNumber'].to_pylist(), list(range(55)))
+        self.assertEqual(file_last_block(head), 54)
+        self.assertEqual(events, 55)
+
+    def test_no_split_when_appending(self):
+        output_file = os.path.join(self.tmp_dir.name, 't-0-99.parquet')
+        self.tracker.track(0, 49, output_file)
+        self.tracker.track(0, 99, output_file, append=True, split=lambda written_block, end_block: self.fail('split'))
+        self.assertEqual(file_last_block(output_file), 49)
+
+    def test_append_keeps_the_types_of_the_output(self):
+        output_file = os.path.join(self.tmp_dir.name, 't-0-99.parquet')
+        # an older output, with the event fields as strings
+        blocks = list(range(50))
+        pq.write_table(pa.table({
+            'blockNumber': blocks,
+            'transactionHash': [b.to_bytes(32, 'big') for b in blocks],
+            'from': [Web3.to_checksum_address('0x' + '00' * 19 + '01')] * 50,
+            'to': [Web3.to_checksum_address('0x' + '00' * 19 + '02')] * 50,
+            'value': [str(b) for b in blocks],
+        }), output_file)
+        self.assertEqual(self.tracker.track(0, 99, output_file, append=True), 50)
+        self.assertEqual(len(output_files(output_file)), 2)
+        table = read_output(output_file)
+        self.assertEqual(table.schema.field('value').type, pa.string())
+        self.assertEqual(sorted(table['value'].to_pylist(), key=int), [str(b) for b in range(100)])
+
+    def test_checkpoints_commit_the_windows_written(self):
+        output_file = os.path.join(self.tmp_dir.name, 't-0-99.parquet')
+        # a row group every 2 windows
+        self.tracker.config.flush_rows = 20
+        checkpoints = []
+        events = self.tracker.track(0, 99, output_file, checkpoint=lambda block, events: checkpoints.append((block, events)))
+        self.assertEqual(events, 100)
+        self.assertEqual(checkpoints, [(19, 20), (39, 40), (59, 60), (79, 80)])
+        self.assertEqual([file_last_block(path) for path in output_files(output_file)], [19, 39, 59, 79, 99])
+        self.assertEqual(read_output(output_file)['blockNumber'].to_pylist(), list(range(100)))
+
+    def test_killed_range_resumes_after_its_checkpoint(self):
+        output_file = os.path.join(self.tmp_dir.name, 't-0-99.parquet')
+        self.tracker.config.flush_rows = 20
+        checkpoints = multiprocessing.get_context('fork').SimpleQueue()
+
+        def kill(written_block, events):
+            # killed with the windows after the last checkpoint being written
+            if written_block == 69:
+                os.kill(os.getpid(), signal.SIGKILL)
+
+        process = multiprocessing.get_context('fork').Process(target=self.tracker.track, args=(0, 99, output_file), kwargs={
+            'progress': kill, 'checkpoint': lambda block, events: checkpoints.put(block)})
+        process.start()
+        process.join()
+        self.assertEqual(process.exitcode, -signal.SIGKILL)
+        self.assertEqual(last_tracked_block(output_file), 59)
+        blocks = []
+        while not checkpoints.empty():
+            blocks.append(checkpoints.get())
+        self.assertEqual(blocks, [19, 39, 59])
+
+        self.assertEqual(self.tracker.track(0, 99, output_file, append=True), 40)
+        self.assertEqual(read_output(output_file)['blockNumber'].to_pylist(), list(range(100)))
+        self.assertEqual(last_tracked_block(output_file), 99)
+
+    def test_split_after_a_checkpoint(self):
+        output_file = os.path.join(self.tmp_dir.name, 't-0-99.parquet')
+        self.tracker.config.flush_rows = 20
+
+        def split(written_block, end_block):
+            if written_block != 49:
+                return None
+            return 74, range_output_file(output_file, 0, 74)
+
+        self.assertEqual(self.tracker.track(0, 99, output_file, split=split, checkpoint=lambda block, events: None), 75)
+        # the files committed before the split follow the range to its new name
+        head = range_output_file(output_file, 0, 74)
+        self.assertFalse(os.path.exists(output_file))
+        self.assertFalse(os.path.exists(fragment_dir(output_file)))
+        self.assertEqual([os.path.basename(path) for path in output_files(head)],
+                         ['t-0-74.parquet', '20-74.parquet', '40-74.parquet', '50-74.parquet', '70-74.parquet'])
+        self.assertEqual(read_output(head)['blockNumber'].to_pylist(), list(range(75)))
+        self.assertEqual(last_tracked_block(head), 74)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,28 @@
+import unittest
+
+from sample.rate_limiter import RateLimiter, compute_units, payload_methods
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def test_requests_beyond_the_budget_wait(self):
+        limiter = RateLimiter(requests_per_second=10, burst=1.0)
+        waits = [limiter.reserve() for _ in range(15)]
+        # the first second of budget is spent at once, then one request every 0.1 s
+        self.assertEqual(waits[:9], [0.0] * 9)
+        self.assertAlmostEqual(waits[14], 0.5, delta=0.05)
+
+    def test_compute_units_and_pause(self):
+        limiter = RateLimiter(compute_units_per_second=150, burst=1.0)
+        self.assertEqual(limiter.reserve(2, compute_units(['eth_getLogs', 'eth_getLogs'])), 0.0)
+        self.assertAlmostEqual(limiter.reserve(1, 75), 0.5, delta=0.05)
+        limiter.pause(3)
+        self.assertGreater(limiter.reserve(1, 0), 2.5)
+
+    def test_batch_payload_counts_every_call(self):
+        body = b'[{"jsonrpc": "2.0", "id": 0, "method": "eth_getLogs"}, {"jsonrpc": "2.0", "id": 1, "method": "eth_chainId"}]'
+        self.assertEqual(payload_methods(data=body), ['eth_getLogs', 'eth_chainId'])
+        self.assertEqual(payload_methods(json_payload={'method': 'eth_blockNumber'}), ['eth_blockNumber'])
+
+if __name__ == "__main__":
+    unittest.main()
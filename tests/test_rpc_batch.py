@@ -0,0 +1,106 @@
+import unittest
+import json
+
+from sample.range_controller import AdaptiveRangeController
+from sample.rpc_batch import BatchRejectedError, JsonRpcBatchClient, JsonRpcError, fetch_range_batched, to_rpc_filter
+
+
+class StubResponse:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.content = json.dumps(body).encode()
+        self.text = self.content.decode()
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"HTTP {self.status_code}")
+
+
+class StubSession:
+    """
+    A node answering eth_getLogs with one log per block of the window.
+
+    Batches of more than max_batch requests are refused with an HTTP status,
+    and the windows starting at a block of failing get an error in the batch.
+    """
+    def __init__(self, max_batch=None, failing=()):
+        self.max_batch = max_batch
+        self.failing = set(failing)
+        self.payloads = []
+
+    def answer(self, request, batched):
+        from_block, to_block = (int(request['params'][0][k], 16) for k in ('fromBlock', 'toBlock'))
+        if batched and from_block in self.failing:
+            return {'jsonrpc': '2.0', 'id': request['id'], 'error': {'code': -32000, 'message': 'header not found'}}
+        return {'jsonrpc': '2.0', 'id': request['id'], 'result': [{'blockNumber': hex(b)} for b in range(from_block, to_block + 1)]}
+
+    def post(self, url, **kwargs):
+        # the body is sent as json, or as data when orjson serializes it
+        payload = kwargs['json'] if 'json' in kwargs else json.loads(kwargs['data'])
+        self.payloads.append(payload)
+        if not isinstance(payload, list):
+            return StubResponse(200, self.answer(payload, False))
+        if self.max_batch is not None and len(payload) > self.max_batch:
+            return StubResponse(413, {'error': 'batch too large'})
+        # answers of a batch can come in any order
+        return StubResponse(200, [self.answer(request, True) for request in reversed(payload)])
+
+
+def make_filter(from_block, to_block):
+    return {'fromBlock': from_block, 'toBlock': to_block, 'address': '0xabc'}
+
+
+class TestRpcBatch(unittest.TestCase):
+
+    def fetch(self, session, batch_size, to_block=99):
+        client = JsonRpcBatchClient('http://node', session=session)
+        controller = AdaptiveRangeController(initial_size=10, max_size=10)
+        fetch_batch = lambda windows: client.get_logs_batch([make_filter(*w) for w in windows])
+        fetch_logs = lambda from_block, to_block: client.get_logs(make_filter(from_block, to_block))
+        return list(fetch_range_batched(fetch_batch, fetch_logs, 0, to_block, controller, batch_size))
+
+    def assert_covers(self, windows, to_block=99):
+        self.assertEqual([w[:2] for w in windows], [(b, b + 9) for b in range(0, to_block + 1, 10)])
+        blocks = [int(log['blockNumber'], 16) for _, _, logs in windows for log in logs]
+        self.assertEqual(blocks, list(range(to_block + 1)))
+
+    def test_windows_are_packed_in_batches(self):
+        session = StubSession()
+        windows = self.fetch(session, 4)
+        self.assert_covers(windows)
+        self.assertEqual([len(p) for p in session.payloads], [4, 4, 2])
+
+    def test_batch_rejection_halves_the_batch_size(self):
+        session = StubSession(max_batch=2)
+        windows = self.fetch(session, 8)
+        self.assert_covers(windows)
+        # 8 and 4 refused, then batches of 2
+        self.assertEqual([len(p) for p in session.payloads], [8, 4] + [2] * 5)
+
+    def test_refused_batches_fall_back_to_single_requests(self):
+        session = StubSession(max_batch=0)
+        windows = self.fetch(session, 2)
+        self.assert_covers(windows)
+        self.assertEqual([len(p) if isinstance(p, list) else 1 for p in session.payloads], [2] + [1] * 10)
+        self.assertTrue(all(isinstance(p, dict) for p in session.payloads[1:]))
+
+    def test_failed_element_is_fetched_again_alone(self):
+        session = StubSession(failing=[20])
+        windows = self.fetch(session, 5)
+        self.assert_covers(windows)
+        single = [p for p in session.payloads if isinstance(p, dict)]
+        self.assertEqual(len(single), 1)
+        self.assertEqual(single[0]['params'][0]['fromBlock'], hex(20))
+
+    def test_batch_answers(self):
+        client = JsonRpcBatchClient('http://node', session=StubSession(failing=[5]))
+        results = client.get_logs_batch([make_filter(0, 1), make_filter(5, 6)])
+        self.assertEqual(results[0], [{'blockNumber': '0x0'}, {'blockNumber': '0x1'}])
+        self.assertIsInstance(results[1], JsonRpcError)
+        self.assertEqual(results[1].code, -32000)
+        with self.assertRaises(BatchRejectedError):
+            JsonRpcBatchClient('http://node', session=StubSession(max_batch=1)).get_logs_batch([make_filter(0, 1)] * 2)
+        self.assertEqual(to_rpc_filter(make_filter(16, 255)), {'fromBlock': '0x10', 'toBlock': '0xff', 'address': '0xabc'})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,39 @@
+import unittest
+import time
+
+from sample.rpc_pool import RpcPool
+
+
+class TestRpcPool(unittest.TestCase):
+
+    def test_failing_endpoint_is_ejected(self):
+        pool = RpcPool(['http://a', 'http://b'], max_failures=2)
+        used = []
+
+        def call(endpoint):
+            used.append(endpoint.url)
+            if endpoint.url == 'http://a':
+                raise ConnectionError('refused')
+            return 'ok'
+
+        for _ in range(5):
+            self.assertEqual(pool.call(call), 'ok')
+        self.assertEqual(used.count('http://a'), 2)
+        self.assertGreater(pool.endpoints[0].ejected_until, time.time())
+
+    def test_slow_request_is_hedged(self):
+        pool = RpcPool(['http://slow', 'http://fast'], weights=[10, 1], min_samples=3)
+        for endpoint in pool.endpoints:
+            endpoint.latencies.extend([0.01] * 3)
+
+        def call(endpoint):
+            time.sleep(1.0 if endpoint.url == 'http://slow' else 0.01)
+            return endpoint.url
+
+        started = time.monotonic()
+        # the weight sends the request to the slow endpoint first, the duplicate answers
+        self.assertEqual(pool.call(call), 'http://fast')
+        self.assertLess(time.monotonic() - started, 0.5)
+
+if __name__ == "__main__":
+    unittest.main()
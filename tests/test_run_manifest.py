@@ -0,0 +1,114 @@
+import unittest
+import multiprocessing
+import os
+import tempfile
+import pyarrow.parquet as pq
+
+from benchmarks.mock_rpc import SyntheticChain, MockRpcServer
+from sample.output_dataset import last_tracked_block, read_output
+from sample.process_event_tracker import EventTracker, EventTrackerConfig, run_worker
+from sample.run_manifest import RunManifest, file_digest, DONE, PARTIAL, PENDING
+
+ADDRESS = '0xae7ab96520DE3A18E5e111B5EaAb095312D7fE84'
+
+
+class TestRunManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, '.manifest.sqlite')
+        self.output_file = os.path.join(self.tmp_dir.name, 'out-0-99.parquet')
+        with open(self.output_file, 'wb') as f:
+            f.write(b'x' * 100)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_done_ranges_are_skipped_until_their_files_change(self):
+        manifest = RunManifest(self.path)
+        manifest.schedule([(0, 99, self.output_file)])
+        self.assertEqual(manifest.get(self.output_file)['status'], PENDING)
+        self.assertFalse(manifest.is_done(self.output_file))
+
+        size, checksum = file_digest([self.output_file])
+        manifest.record(self.output_file, DONE, 10, 99, [self.output_file], size, checksum)
+        manifest.close()
+
+        # read back by the next run
+        manifest = RunManifest(self.path)
+        record = manifest.get(self.output_file)
+        self.assertEqual((record['rows'], record['last_block'], record['attempts']), (10, 99, 1))
+        self.assertTrue(manifest.is_done(self.output_file))
+        self.assertEqual(manifest.summary(), {DONE: 1})
+
+        with open(self.output_file, 'ab') as f:
+            f.write(b'y')
+        self.assertFalse(manifest.is_done(self.output_file))
+
+    def test_partial_range(self):
+        manifest = RunManifest()
+        manifest.schedule([(0, 99, self.output_file)])
+        manifest.record(self.output_file, PARTIAL, 4, 49, [self.output_file], 100, None, 'timeout')
+        self.assertFalse(manifest.is_done(self.output_file))
+        self.assertEqual(manifest.get(self.output_file)['last_block'], 49)
+
+    def test_killed_worker_resumes_from_its_checkpoint(self):
+        chain = SyntheticChain('abi/stETH.json', ADDRESS, ['Transfer'], density=0.5, head=20000)
+        output_file = os.path.join(self.tmp_dir.name, 'out-0-19999.parquet')
+        log_file = os.path.join(self.tmp_dir.name, 'logs', 'job.log')
+        manifest = RunManifest(self.path)
+        manifest.schedule([(0, 19999, output_file)])
+        context = multiprocessing.get_context('fork')
+
+        with MockRpcServer(chain, latency=0.1) as server:
+            # a row group and a checkpoint every few windows
+            config = EventTrackerConfig('abi/stETH.json', ADDRESS, 'event/stETH-Transfer.sol', None, None, False, None, None,
+                                        server.url, flush_rows=500)
+
+            def start_worker(task):
+                task_queue, result_queue = context.Queue(), context.Queue()
+                task_queue.put(task)
+                task_queue.put(None)
+                worker = context.Process(target=run_worker, args=(config, log_file, task_queue, result_queue))
+                worker.start()
+                return worker, result_queue
+
+            worker, result_queue = start_worker((0, 19999, output_file, log_file, False))
+            message = result_queue.get(timeout=60)
+            while message[0] != 'checkpoint':
+                self.assertNotEqual(message[0], 'done')
+                message = result_queue.get(timeout=60)
+            worker.kill()
+            worker.join()
+            # recorded as the scheduler does
+            _, _, from_block, to_block, last_block, rows = message
+            manifest.checkpoint(output_file, last_block, rows)
+            record = manifest.get(output_file)
+            self.assertEqual((record['status'], record['last_block'], record['rows']), (PARTIAL, last_block, rows))
+            self.assertFalse(manifest.is_done(output_file))
+            # later checkpoints may have been committed before the kill, never fewer
+            self.assertGreaterEqual(last_tracked_block(output_file), last_block)
+            self.assertLess(last_tracked_block(output_file), 19999)
+
+            # the range is queued again in append mode
+            worker, result_queue = start_worker((0, 19999, output_file, log_file, True))
+            message = result_queue.get(timeout=60)
+            while message[0] != 'done':
+                message = result_queue.get(timeout=60)
+            worker.join()
+            _, _, _, _, events, error, details = message
+            self.assertIsNone(error)
+            manifest.record(output_file, DONE, details['rows'], details['last_block'], details['files'], details['size'], details['checksum'])
+            self.assertTrue(manifest.is_done(output_file))
+
+            expected_file = os.path.join(self.tmp_dir.name, 'expected.parquet')
+            EventTracker(config).track(0, 19999, expected_file)
+        expected = pq.read_table(expected_file)
+        table = read_output(output_file)
+        self.assertEqual(details['rows'], expected.num_rows)
+        key = lambda t: sorted(zip(t['blockNumber'].to_pylist(), t['transactionHash'].to_pylist(), t['value'].to_pylist()))
+        self.assertEqual(key(table), key(expected))
+        manifest.close()
+
+if __name__ == "__main__":
+    unittest.main()
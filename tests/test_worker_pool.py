@@ -0,0 +1,61 @@
+import unittest
+import multiprocessing
+import os
+import time
+
+from sample.worker_pool import WorkerPool
+
+
+def chatty_worker(sender, worker_id, messages):
+    # far more than a pipe buffer holds, sent before the scheduler reads anything
+    for i in range(messages):
+        sender.put(('progress', worker_id, i, 'x' * 1000))
+    sender.put(('done', worker_id))
+
+
+def dying_worker(sender, worker_id):
+    sender.put(('started', worker_id))
+    os._exit(3)
+
+
+class TestWorkerPool(unittest.TestCase):
+
+    def setUp(self):
+        self.context = multiprocessing.get_context('spawn')
+
+    def collect(self, pool):
+        messages, exits = [], []
+        while len(pool):
+            received, exited = pool.wait(timeout=30)
+            messages += received
+            exits += exited
+        return messages, exits
+
+    def test_messages_are_drained_until_exit(self):
+        pool = WorkerPool(self.context, chatty_worker, lambda worker_id, sender: (sender, worker_id, 500))
+        for worker_id in range(2):
+            pool.start(worker_id)
+        messages, exits = self.collect(pool)
+        self.assertEqual(sorted(exits), [(0, 0), (1, 0)])
+        for worker_id in range(2):
+            sent = [m for m in messages if m[1] == worker_id]
+            self.assertEqual(len(sent), 501)
+            # in the order they were sent, the last one before the exit
+            self.assertEqual([m[2] for m in sent[:-1]], list(range(500)))
+            self.assertEqual(sent[-1], ('done', worker_id))
+
+    def test_exit_is_seen_at_once(self):
+        pool = WorkerPool(self.context, dying_worker, lambda worker_id, sender: (sender, worker_id))
+        pool.start(0)
+        started = time.monotonic()
+        messages, exits = self.collect(pool)
+        self.assertEqual(messages, [('started', 0)])
+        self.assertEqual(exits, [(0, 3)])
+        self.assertLess(time.monotonic() - started, 10)
+        # a worker takes the place of the one that died
+        pool.start(0)
+        self.assertEqual(self.collect(pool)[1], [(0, 3)])
+        self.assertEqual(pool.started, 2)
+
+if __name__ == "__main__":
+    unittest.main()